@@ -2,12 +2,21 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import os
+import sys
 import zmq
 import time
 import json
 import numpy as np
 import gymnasium as gym
-from typing import Dict, Any, Tuple, Optional
+from typing import Dict, Any, List, Tuple, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gymnasium.vector.utils import batch_space
+from carla_gym.src.transport.codec import ENCODING_BINARY, ENCODING_SHM, SUPPORTED_ENCODINGS, describe_space, encode_message, negotiate_encoding
+from carla_gym.src.transport.shm_ring import ObservationRing
+from carla_gym.src.transport.image_codec import IMAGE_CODEC_KEY, ImageFormat
+from carla_gym.src.transport.delta import STREAM_KEY, DeltaEncoder
 
 # 尝试导入 gym_carla，如果不存在则使用自定义环境
 try:
@@ -16,94 +25,337 @@ except ImportError:
     print("⚠️ 未找到 gym_carla，将使用自定义环境")
     # 这里可以添加自定义环境的代码
 
+class ClientSession:
+    """每个客户端（按ZMQ identity区分）协商得到的传输设置"""
+    
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        # 图像的分辨率、通道顺序和压缩方式，服务器在发送前统一处理一次
+        self.image_format = ImageFormat()
+        # 流模式：关键帧 + 相对客户端已确认帧的压缩XOR差分帧（仅在协商了stream时使用）
+        self.delta = None
+        # 共享内存观测环（仅在同一主机并协商为shm编码时使用）
+        self.shm_ring = None
+        # 布局中的观测项退回二进制消息时只提示一次
+        self.shm_fallback_logged = False
+    
+    def close(self) -> None:
+        if self.shm_ring is not None:
+            self.shm_ring.close()
+            self.shm_ring = None
+
 class CarlaServer:
-    """CARLA服务器，通过ZMQ接收命令并与CARLA环境交互"""
+    """
+    CARLA服务器，通过ZMQ接收命令并与CARLA环境交互。
+    使用ROUTER套接字：DEALER客户端可以带请求id流水线式发送请求（step_async/step_wait），REQ客户端依然兼容。
+    """
     
-    def __init__(self, port: int = 5555, env_id: str = "carla_rl-gym-v0"):
+    def __init__(self, port: int = 5555, env_id: str = "carla_rl-gym-v0", encoding: str = ENCODING_BINARY,
+                 num_envs: int = 1, carla_ports: Optional[List[int]] = None, env_kwargs: Optional[Dict[str, Any]] = None):
         self.port = port
         self.env_id = env_id
-        self.env = None
+        # 一个服务器可以托管多个环境，每个环境连接各自的CARLA端口
+        self.num_envs = num_envs
+        self.carla_ports = carla_ports
+        self.env_kwargs = env_kwargs or {}
+        self.envs = []
+        # 观测编码方式：默认二进制多帧，客户端可通过hello命令协商（json仅用于调试）
+        self.encoding = encoding
+        self.sessions: Dict[bytes, ClientSession] = {}
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REP)
+        self.socket = self.context.socket(zmq.ROUTER)
         self.socket.bind(f"tcp://*:{self.port}")
         print(f"🚗 CARLA服务器启动，监听端口 {self.port}...")
     
+    @property
+    def env(self) -> Optional[gym.Env]:
+        """单环境命令（reset/step）使用第一个环境"""
+        return self.envs[0] if self.envs else None
+    
     def init_env(self) -> None:
         """初始化CARLA环境"""
-        print(f"🔧 初始化环境: {self.env_id}")
+        print(f"🔧 初始化环境: {self.env_id} x {self.num_envs}")
+        self.close_envs()
         try:
-            self.env = gym.make(self.env_id)
+            for i in range(self.num_envs):
+                kwargs = dict(self.env_kwargs)
+                if self.carla_ports is not None:
+                    kwargs["sim_port"] = self.carla_ports[i]
+                self.envs.append(gym.make(self.env_id, **kwargs))
             print("✅ 环境初始化成功")
         except Exception as e:
             print(f"❌ 环境初始化失败: {e}")
+            self.close_envs()
             raise
     
+    def close_envs(self) -> None:
+        for env in self.envs:
+            env.close()
+        self.envs = []
+    
     def handle_request(self) -> None:
         """处理客户端请求"""
-        while True:
+        running = True
+        while running:
+            envelope = None
+            request_id = None
+            session = None
             try:
-                # 接收请求
-                request = self.socket.recv_json()
+                # 接收请求：[信封..., 请求JSON]
+                envelope, body = self._split_envelope(self.socket.recv_multipart())
+                session = self._session(envelope[0])
+                request = json.loads(body[0])
+                request_id = request.get("id")
                 cmd = request.get("cmd")
                 params = request.get("params", {})
+                if session.delta is not None:
+                    # 客户端最后解码的帧，下一帧相对它编码
+                    session.delta.acknowledge(params.get("ack"))
                 
                 # 处理命令
                 response = {"status": "success"}
+                obs = None
+                # 观测已经编码好（keyframe命令），发送时不再处理
+                encoded = False
+                
+                if cmd == "hello":
+                    # 协商观测编码（客户端按优先级发送编码列表）和图像格式
+                    session.close()
+                    session.encoding = negotiate_encoding(params.get("encodings"))
+                    session.image_format = ImageFormat.from_request(params.get("image"))
+                    session.delta = None
+                    if params.get("stream") and session.encoding != ENCODING_SHM:
+                        # 差分帧只对原始图像有效，同一主机（shm）时也没有必要
+                        if session.image_format.is_compressed:
+                            raise ValueError("stream模式只能和原始图像（compression=raw）一起使用")
+                        session.delta = DeltaEncoder.from_request(params["stream"], session.image_format)
+                    if session.encoding == ENCODING_SHM:
+                        # 槽位按实际环境的观测空间（缩放后的图像尺寸）分配，压缩后的图像大小不固定，不放入共享内存
+                        if not self.env:
+                            self.init_env()
+                        # 使用 reset_batch/step_batch 的客户端（batch=True）收到的是堆叠后的 (num_envs, ...) 观测，
+                        # 槽位按堆叠后的空间分配（num_envs == 1 时也一样）；旧客户端不发送batch，多环境时按堆叠处理
+                        batched = params.get("batch", self.num_envs > 1)
+                        space = session.image_format.wire_space(self._observation_space(batched))
+                        session.shm_ring = ObservationRing.create(space, num_slots=params.get("shm_slots", 8))
+                        session.shm_fallback_logged = False
+                        response["shm"] = session.shm_ring.describe()
+                    response["encoding"] = session.encoding
+                    response["image"] = session.image_format.describe()
+                    response["stream"] = session.delta.describe() if session.delta is not None else None
+                    response["supported_encodings"] = SUPPORTED_ENCODINGS
                 
-                if cmd == "init":
+                elif cmd == "spaces":
+                    # 单个环境的观测/动作空间，客户端据此构建VectorEnv的空间
+                    if not self.env:
+                        self.init_env()
+                    response["num_envs"] = self.num_envs
+                    response["observation_space"] = describe_space(session.image_format.transform_space(self.env.unwrapped.obs_space))
+                    response["action_space"] = describe_space(self.env.unwrapped.act_space)
+                
+                elif cmd == "init":
                     self.init_env()
                     response["message"] = "环境初始化完成"
                 
                 elif cmd == "reset":
                     if not self.env:
                         self.init_env()
-                    obs = self.env.reset()
-                    response["obs"] = self._serialize_obs(obs)
+                    obs, info = self.env.reset()
+                    response["info"] = info
+                    self._force_keyframe(session)
                 
                 elif cmd == "step":
                     if not self.env:
                         raise RuntimeError("环境未初始化，请先调用init")
                     
                     action = np.array(params.get("action", []))
-                    obs, reward, done, info = self.env.step(action)
+                    obs, reward, terminated, truncated, info = self._step_env(self.env, action, params.get("repeat"))
                     
                     response.update({
-                        "obs": self._serialize_obs(obs),
                         "reward": float(reward),
-                        "done": bool(done),
+                        "terminated": bool(terminated),
+                        "truncated": bool(truncated),
+                        "done": bool(terminated or truncated),
                         "info": info
                     })
                 
+                elif cmd == "reset_batch":
+                    if not self.env:
+                        self.init_env()
+                    obs, infos = self.reset_batch(params.get("seeds"), params.get("options"))
+                    response["infos"] = infos
+                    self._force_keyframe(session)
+                
+                elif cmd == "step_batch":
+                    if not self.env:
+                        raise RuntimeError("环境未初始化，请先调用init")
+                    obs, rewards, terminated, truncated, infos = self.step_batch(params.get("actions", []), params.get("repeat"))
+                    response.update({
+                        "rewards": rewards,
+                        "terminated": terminated,
+                        "truncated": truncated,
+                        "infos": infos
+                    })
+                
+                elif cmd == "keyframe":
+                    # 客户端缺少差分帧的参考帧：把已发送的第seq帧作为关键帧重新发送（不执行step）
+                    if session.delta is None:
+                        raise RuntimeError("keyframe命令只能在stream模式下使用")
+                    obs, meta = session.delta.keyframe(params["seq"])
+                    response[STREAM_KEY] = meta
+                    encoded = True
+                
                 elif cmd == "close":
-                    if self.env:
-                        self.env.close()
+                    self.close_envs()
                     response["message"] = "环境已关闭"
-                    break
+                    running = False
                 
                 elif cmd == "ping":
                     response["message"] = "pong"
                 
+                elif cmd == "bye":
+                    # 客户端断开，释放其会话（共享内存等），环境保持运行
+                    session.close()
+                    self.sessions.pop(envelope[0], None)
+                
                 else:
                     response = {"status": "error", "message": f"未知命令: {cmd}"}
                 
                 # 发送响应
-                self.socket.send_json(response)
+                response["id"] = request_id
+                self._send(envelope, session, response, obs, encoded)
             
             except Exception as e:
                 error_msg = f"处理请求时出错: {str(e)}"
                 print(error_msg)
-                self.socket.send_json({"status": "error", "message": error_msg})
-    
-    def _serialize_obs(self, obs: Dict[str, np.ndarray]) -> Dict[str, Any]:
-        """序列化观测数据为JSON可传输格式"""
-        serialized = {}
-        for k, v in obs.items():
-            if isinstance(v, np.ndarray):
-                # 对于图像数据，可以考虑压缩以提高传输效率
-                serialized[k] = v.tolist()
-            else:
-                serialized[k] = v
-        return serialized
+                if envelope is not None:
+                    self._send(envelope, session, {"status": "error", "message": error_msg, "id": request_id})
+    
+    @staticmethod
+    def _split_envelope(frames: List[bytes]) -> Tuple[List[bytes], List[bytes]]:
+        """
+        拆分路由信封和消息体。REQ客户端（以及本项目的DEALER客户端）在消息体前有一个空的分隔帧，
+        回复时原样带回信封，这样REQ和DEALER客户端都可以使用。
+        """
+        for i in range(1, len(frames)):
+            if frames[i] == b"":
+                return frames[:i + 1], frames[i + 1:]
+        return frames[:1], frames[1:]
+    
+    def _session(self, identity: bytes) -> ClientSession:
+        if identity not in self.sessions:
+            self.sessions[identity] = ClientSession(self.encoding)
+        return self.sessions[identity]
+    
+    def reset_batch(self, seeds: Optional[List[Optional[int]]] = None, options: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, np.ndarray], List[Dict[str, Any]]]:
+        """重置所有环境，返回堆叠后的观测"""
+        seeds = seeds if seeds is not None else [None] * self.num_envs
+        obs_list, infos = [], []
+        for env, seed in zip(self.envs, seeds):
+            obs, info = env.reset(seed=seed, options=options) if options else env.reset(seed=seed)
+            obs_list.append(obs)
+            infos.append(info)
+        return self._stack_obs(obs_list), infos
+    
+    def step_batch(self, actions: List[Any], repeat: Optional[int] = None) -> Tuple[Dict[str, np.ndarray], List[float], List[bool], List[bool], List[Dict[str, Any]]]:
+        """
+        所有环境各执行一步，返回堆叠后的观测。
+        结束的环境在同一步内自动重置（SameStep），最终观测以 "final_obs/<i>/<key>" 的键随观测一起发送，最终info放在 info["final_info"]。
+        """
+        if len(actions) != self.num_envs:
+            raise ValueError(f"需要 {self.num_envs} 个动作，收到 {len(actions)} 个")
+        obs_list, rewards, terminated, truncated, infos = [], [], [], [], []
+        final_obs = {}
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            obs, reward, term, trunc, info = self._step_env(env, np.array(action), repeat)
+            if term or trunc:
+                # 复制一份：相机图像来自传感器的双缓冲区，重置时的tick会覆盖它
+                for key, value in obs.items():
+                    final_obs[f"final_obs/{i}/{key}"] = np.array(value)
+                obs, reset_info = env.reset()
+                reset_info["final_info"] = info
+                info = reset_info
+            obs_list.append(obs)
+            rewards.append(float(reward))
+            terminated.append(bool(term))
+            truncated.append(bool(trunc))
+            infos.append(info)
+        stacked = self._stack_obs(obs_list)
+        stacked.update(final_obs)
+        return stacked, rewards, terminated, truncated, infos
+    
+    @staticmethod
+    def _step_env(env: gym.Env, action: np.ndarray, repeat: Optional[int] = None) -> Tuple[Dict[str, Any], float, bool, bool, Dict[str, Any]]:
+        """
+        在服务器端重复动作：CarlaEnv 连续 tick repeat 次，奖励求和，提前结束时停止，只在最后构建一次观测。
+        省去了客户端重复动作时每次的网络往返和观测序列化。
+        repeat 只作用于这一次请求，不修改环境的 action_repeat（之后不带 repeat 的 step 仍使用环境自己的设置）。
+        调用仍然经过 gym.make 添加的包装器（TimeLimit 等），否则回合永远不会因步数上限而截断。
+        """
+        if repeat is None:
+            return env.step(action)
+        unwrapped = env.unwrapped
+        action_repeat = unwrapped.action_repeat
+        unwrapped.action_repeat = int(repeat)
+        try:
+            return env.step(action)
+        finally:
+            unwrapped.action_repeat = action_repeat
+    
+    @staticmethod
+    def _stack_obs(obs_list: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        return {key: np.stack([np.asarray(obs[key]) for obs in obs_list]) for key in obs_list[0]}
+    
+    def _send(self, envelope: List[bytes], session: Optional[ClientSession], response: Dict[str, Any], obs: Optional[Dict[str, Any]] = None,
+              encoded: bool = False) -> None:
+        """
+        按协商的编码发送响应：二进制模式下数组以原始缓冲区作为ZMQ多帧发送，不做逐元素转换。
+        encoded 表示观测已经按会话的图像格式和流模式编码（keyframe命令），不再处理。
+        """
+        encoding = session.encoding if session is not None else self.encoding
+        if obs is not None and session is not None and not encoded:
+            # 按客户端的图像格式缩放/压缩，每条消息只处理一次
+            obs, codec = session.image_format.encode(obs)
+            if codec is not None:
+                response[IMAGE_CODEC_KEY] = codec
+            if session.delta is not None and response.get("status") == "success":
+                obs, meta = session.delta.encode(obs)
+                if meta is not None:
+                    response[STREAM_KEY] = meta
+        if obs is not None and session is not None and session.shm_ring is not None and response.get("status") == "success":
+            # 观测只写入一次共享内存槽位，通过ZMQ只传递槽位索引和标量
+            slot, seq, remaining = session.shm_ring.write(obs)
+            response["shm_slot"] = slot
+            response["shm_seq"] = seq
+            response["shm_keys"] = [key for key in obs if key not in remaining]
+            fallback = [key for key in session.shm_ring.keys() if key in remaining]
+            if fallback and not session.shm_fallback_logged:
+                # 形状或类型和槽位布局不一致，这些观测项改为随消息发送（结果正确，但失去了共享内存的意义）
+                print(f"⚠️ 观测项 {fallback} 与共享内存布局不一致，改为通过消息发送（只提示一次）")
+                session.shm_fallback_logged = True
+            obs = remaining
+        frames = encode_message(response, obs, encoding)
+        self.socket.send_multipart(envelope + frames, copy=False)
+    
+    @staticmethod
+    def _force_keyframe(session: ClientSession) -> None:
+        """新回合的第一帧和上一帧几乎没有相关性，直接发送关键帧"""
+        if session.delta is not None:
+            session.delta.force_keyframe()
+    
+    def _observation_space(self, batched: bool) -> gym.spaces.Dict:
+        """共享内存槽位的大小由观测空间决定，批量命令（reset_batch/step_batch）按堆叠后的空间分配"""
+        if self.env is not None:
+            space = self.env.unwrapped.obs_space
+        else:
+            import carla_gym.src.env.observation_action_space as observation_action_space
+            space = observation_action_space.obs_space
+        return batch_space(space, self.num_envs) if batched else space
+    
+    def close_sessions(self) -> None:
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
     
     def run(self) -> None:
         """运行服务器"""
@@ -112,8 +364,8 @@ class CarlaServer:
         except KeyboardInterrupt:
             print("🔴 服务器被用户中断")
         finally:
-            if self.env:
-                self.env.close()
+            self.close_envs()
+            self.close_sessions()
             self.socket.close()
             self.context.term()
             print("🛑 服务器已关闭")
@@ -122,7 +374,22 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="CARLA服务器")
     parser.add_argument("--port", type=int, default=5555, help="ZMQ通信端口")
     parser.add_argument("--env-id", type=str, default="carla_rl-gym-v0", help="环境ID")
+    parser.add_argument("--encoding", type=str, default=ENCODING_BINARY, choices=SUPPORTED_ENCODINGS, help="默认观测编码（json仅用于调试）")
+    parser.add_argument("--num-envs", type=int, default=1, help="托管的环境数量")
+    parser.add_argument("--carla-ports", type=str, default=None, help="每个环境的CARLA端口，逗号分隔（默认从--carla-base-port开始按--carla-port-stride递增）")
+    parser.add_argument("--carla-base-port", type=int, default=2000, help="第一个环境的CARLA端口")
+    parser.add_argument("--carla-port-stride", type=int, default=3, help="相邻环境CARLA端口的间隔（RPC端口、streaming端口等）")
+    parser.add_argument("--env-kwargs", type=str, default="{}", help="传给gym.make的参数（JSON）")
     args = parser.parse_args()
     
-    server = CarlaServer(port=args.port, env_id=args.env_id)
+    carla_ports = None
+    if args.carla_ports:
+        carla_ports = [int(p) for p in args.carla_ports.split(",")]
+    elif args.num_envs > 1:
+        carla_ports = [args.carla_base_port + i * args.carla_port_stride for i in range(args.num_envs)]
+    if carla_ports is not None and len(carla_ports) != args.num_envs:
+        parser.error("--carla-ports 的数量必须等于 --num-envs")
+    
+    server = CarlaServer(port=args.port, env_id=args.env_id, encoding=args.encoding,
+                         num_envs=args.num_envs, carla_ports=carla_ports, env_kwargs=json.loads(args.env_kwargs))
     server.run()
\ No newline at end of file
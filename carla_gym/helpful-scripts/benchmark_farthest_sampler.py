@@ -0,0 +1,71 @@
+'''
+This script measures the farthest point sampling of the LiDAR pre-processing (it doesn't need the simulator).
+
+It compares the previous implementation (one Python iteration per sampled point over a float64 (dim, n) array) with the
+numpy backend of FarthestSampler and, if torch is installed, its torch backend, for n from 500 to 20000 points and k
+from 128 to 2048. The batched rows sample the point clouds of BATCH envs in a single call.
+'''
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import numpy as np
+from carla_gym.src.env.env_aux.farthest_sampler import FarthestSampler
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+BATCH = 8
+REPETITIONS = 3
+
+# The implementation FarthestSampler replaced
+def reference_sample(pts, k, init_idx=1):
+    farthest_pts = np.zeros((3, k))
+    farthest_pts_idx = np.zeros(k, dtype=int)
+    farthest_pts[:, 0] = pts[:, init_idx]
+    farthest_pts_idx[0] = init_idx
+    distances = ((farthest_pts[:, 0:1] - pts) ** 2).sum(axis=0)
+    for i in range(1, k):
+        idx = np.argmax(distances)
+        farthest_pts[:, i] = pts[:, idx]
+        farthest_pts_idx[i] = idx
+        distances = np.minimum(distances, ((farthest_pts[:, i:i+1] - pts) ** 2).sum(axis=0))
+    return farthest_pts, farthest_pts_idx
+
+def measure(function, *args):
+    function(*args)
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        function(*args)
+    return (time.perf_counter() - start) / REPETITIONS * 1000.0
+
+def main():
+    rng = np.random.default_rng(0)
+    samplers = {'numpy': FarthestSampler(backend='numpy')}
+    if torch is not None:
+        samplers['torch'] = FarthestSampler(backend='torch')
+        if torch.cuda.is_available():
+            samplers['torch-cuda'] = FarthestSampler(backend='torch', device='cuda')
+
+    columns = ['reference'] + list(samplers) + [f'{name} x{BATCH}' for name in samplers]
+    print(f"Time per call in ms (the x{BATCH} columns sample {BATCH} point clouds in one call)")
+    print(f"{'n':>6} {'k':>5} " + " ".join(f"{column:>16}" for column in columns))
+    for n in [500, 2000, 8000, 20000]:
+        pts = rng.uniform(-50.0, 50.0, (3, n))
+        batch = rng.uniform(-50.0, 50.0, (BATCH, 3, n))
+        for k in [128, 512, 2048]:
+            if k > n:
+                continue
+            times = [measure(reference_sample, pts, k)]
+            times += [measure(sampler.sample, pts, k) for sampler in samplers.values()]
+            times += [measure(sampler.sample, batch, k) for sampler in samplers.values()]
+            print(f"{n:>6} {k:>5} " + " ".join(f"{t:>16.2f}" for t in times))
+
+    # The current observation: 500 points out of the 500 of the sensor
+    pts = rng.uniform(-50.0, 50.0, (3, 500))
+    print(f"\nn = k = 500 (current observation): reference {measure(reference_sample, pts, 500):.2f} ms | FarthestSampler {measure(samplers['numpy'].sample, pts, 500):.3f} ms")
+
+if __name__ == '__main__':
+    main()
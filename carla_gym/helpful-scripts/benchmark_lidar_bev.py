@@ -0,0 +1,60 @@
+'''
+This script compares the time of the two LiDAR representations of the observation (it doesn't need the simulator):
+    - points: The current path, the scan is reduced to 500 points by the sensor and then sampled with farthest point sampling
+    - bev:    The bird's-eye-view grid built from the full scan (env_aux/lidar_bev.py)
+
+The synthetic scans have the number of points the default LiDAR (56000 points per second) delivers per tick at the
+simulation FPS, and a full rotation.
+'''
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import numpy as np
+from carla_gym.src.env.env_aux.farthest_sampler import FarthestSampler
+from carla_gym.src.env.env_aux.lidar_bev import LidarBEV
+import carla_gym.src.env.observation_action_space as observation_action_space
+import carla_gym.src.config.configuration as config
+
+POINTS_PER_SECOND = 56000
+ROTATION_FREQUENCY = 10.0
+REPETITIONS = 50
+
+def synthetic_scan(num_points, rng):
+    # Ground ring plus some obstacles, in the sensor frame (the sensor is 1.7m above the ground)
+    angles = rng.uniform(-np.pi, np.pi, num_points)
+    distances = rng.uniform(2.0, 50.0, num_points)
+    heights = np.where(rng.random(num_points) < 0.7, -1.7, rng.uniform(-1.7, 1.0, num_points))
+    intensity = rng.uniform(0.0, 1.0, num_points)
+    return np.stack([distances * np.cos(angles), distances * np.sin(angles), heights, intensity], axis=1).astype(np.float32)
+
+# Same steps as Lidar.callback + PreProcessing.__process_lidar
+def points_representation(scan, sampler):
+    indices = np.linspace(0, scan.shape[0] - 1, 500, dtype=int)
+    lidar_data = scan[indices] if scan.shape[0] > 500 else np.pad(scan, ((0, 500 - scan.shape[0]), (0, 0)))
+    lidar_data = lidar_data[:, :-1].transpose([1, 0])
+    lidar_data, _ = sampler.sample(lidar_data, 500)
+    return np.float32(lidar_data)
+
+def measure(function, *args):
+    function(*args)
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        function(*args)
+    return (time.perf_counter() - start) / REPETITIONS * 1000.0
+
+def main():
+    rng = np.random.default_rng(0)
+    sampler = FarthestSampler()
+    bev = LidarBEV(**observation_action_space.lidar_bev_params)
+    out = np.empty(bev.shape, dtype=np.float32)
+    print(f"BEV grid: {bev.shape}, cell size {bev.cell_size}m")
+
+    for name, num_points in [("1 tick", int(POINTS_PER_SECOND / config.SIM_FPS)), ("1 rotation", int(POINTS_PER_SECOND / ROTATION_FREQUENCY)), ("1 second", POINTS_PER_SECOND)]:
+        scan = synthetic_scan(num_points, rng)
+        points_ms = measure(points_representation, scan, sampler)
+        bev_ms = measure(bev.encode, scan, out)
+        print(f"{name:>10} ({num_points:6d} points): points {points_ms:8.3f} ms | bev {bev_ms:8.3f} ms | speedup {points_ms / bev_ms:6.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''
+This script measures the time of every LiDAR downsampling strategy of the sensor callback (it doesn't need the simulator).
+
+The synthetic scans are the number of points delivered per tick at the simulation FPS by LiDARs of 56000 (the default),
+168000 and 560000 points per second, reduced to 500, 2000 and 8000 points.
+'''
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import numpy as np
+from carla_gym.src.carlacore.lidar_downsampler import LidarDownsampler, STRATEGIES
+import carla_gym.src.config.configuration as config
+
+REPETITIONS = 50
+
+def synthetic_scan(num_points, rng):
+    # Ground ring plus some obstacles, in the sensor frame (the sensor is 1.7m above the ground)
+    angles = rng.uniform(-np.pi, np.pi, num_points)
+    distances = 2.0 + 48.0 * rng.random(num_points) ** 2
+    heights = np.where(rng.random(num_points) < 0.7, -1.7, rng.uniform(-1.7, 1.0, num_points))
+    intensity = rng.uniform(0.0, 1.0, num_points)
+    return np.stack([distances * np.cos(angles), distances * np.sin(angles), heights, intensity], axis=1).astype(np.float32)
+
+def measure(downsampler, scan, out):
+    downsampler.sample(scan, out)
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        downsampler.sample(scan, out)
+    return (time.perf_counter() - start) / REPETITIONS * 1000.0
+
+def main():
+    rng = np.random.default_rng(0)
+    budget = 1000.0 / config.SIM_FPS
+    print(f"Time per scan in ms (one tick at {config.SIM_FPS} FPS is {budget:.1f} ms)")
+    print(f"{'points/s':>9} {'scan':>6} {'kept':>5} " + " ".join(f"{strategy:>16}" for strategy in STRATEGIES))
+    for points_per_second in [56000, 168000, 560000]:
+        scan = synthetic_scan(int(points_per_second / config.SIM_FPS), rng)
+        for num_points in [500, 2000, 8000]:
+            out = np.empty((num_points, 4), dtype=np.float32)
+            times = [measure(LidarDownsampler(strategy, num_points=num_points), scan, out) for strategy in STRATEGIES]
+            print(f"{points_per_second:>9} {len(scan):>6} {num_points:>5} " + " ".join(f"{t:>16.3f}" for t in times))
+
+if __name__ == '__main__':
+    main()
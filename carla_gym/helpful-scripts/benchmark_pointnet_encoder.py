@@ -0,0 +1,39 @@
+'''
+This script measures the CPU throughput (point clouds per second) of the PointNet LiDAR features of the observation
+(PointNetEncoder), eager vs TorchScript trace, for several numbers of torch threads and batch sizes (the envs encoded in
+one call). It doesn't need the simulator, the point clouds are synthetic.
+
+Usage: python benchmark_pointnet_encoder.py [points per cloud (default 500)]
+'''
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import numpy as np
+from carla_gym.src.env.env_aux.pointnet_encoder import PointNetEncoder
+
+REPETITIONS = 20
+
+def measure(encoder, clouds):
+    encoder.encode(clouds)
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        encoder.encode(clouds)
+    return (time.perf_counter() - start) / REPETITIONS
+
+def main():
+    num_points = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rng = np.random.default_rng(0)
+    print(f"{num_points} points per cloud, 64 features")
+    print(f"{'mode':>6} {'threads':>8} {'batch':>6} {'ms/call':>9} {'clouds/s':>10}")
+    for num_threads in [1, 4]:
+        for trace in [False, True]:
+            encoder = PointNetEncoder(num_points=num_points, projection_dim=64, num_threads=num_threads, trace=trace)
+            for batch in [1, 4, 16]:
+                clouds = rng.uniform(-50.0, 50.0, (batch, 3, num_points)).astype(np.float32)
+                seconds = measure(encoder, clouds)
+                mode = 'traced' if trace else 'eager'
+                print(f"{mode:>6} {num_threads:>8} {batch:>6} {1000.0 * seconds:>9.2f} {batch / seconds:>10.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+This script compares the pre-processing of the observations of N envs one by one (PreProcessing.preprocess_data, then
+stacked) with the batched version (PreProcessing.preprocess_batch), and prints the time of each stage of the batched
+one. It doesn't need the simulator, the observations are synthetic.
+
+Usage: python benchmark_preprocessing.py [lidar points per env (default 500)]
+'''
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import numpy as np
+from carla_gym.src.env.pre_processing import PreProcessing
+import carla_gym.src.env.observation_action_space as observation_action_space
+
+REPETITIONS = 20
+
+def synthetic_observations(num_envs, num_points, rng):
+    shapes = observation_action_space.observation_shapes
+    return {
+        'rgb_data': rng.integers(0, 256, (num_envs,) + shapes['rgb_data'], dtype=np.uint8),
+        'lidar_data': rng.uniform(-50.0, 50.0, (num_envs, num_points, 4)).astype(np.float32),
+        'position': rng.uniform(-100.0, 100.0, (num_envs, 3)).astype(np.float32),
+        'target_position': rng.uniform(-100.0, 100.0, (num_envs, 3)).astype(np.float32),
+        'next_waypoint_position': rng.uniform(-100.0, 100.0, (num_envs, 3)).astype(np.float32),
+        'speed': rng.uniform(0.0, 50.0, (num_envs, 1)).astype(np.float32),
+        'situation': rng.integers(0, shapes['num_of_stuations'], num_envs)
+    }
+
+# One env at a time, then stacked for the policy (what a vector env of CarlaEnvs does)
+def one_by_one(pre_processing, observations):
+    num_envs = len(observations['situation'])
+    processed = [pre_processing.preprocess_data({key: value[i] for key, value in observations.items()}) for i in range(num_envs)]
+    return {key: np.stack([observation[key] for observation in processed]) for key in processed[0]}
+
+def measure(function, *args):
+    function(*args)
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        function(*args)
+    return (time.perf_counter() - start) / REPETITIONS * 1000.0
+
+def main():
+    num_points = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rng = np.random.default_rng(0)
+    pre_processing = PreProcessing()
+    print(f"LiDAR representation: {pre_processing.lidar_representation}, {num_points} points per env")
+    print(f"{'envs':>5} {'one by one (ms)':>16} {'batched (ms)':>13} {'speedup':>8} | batched stages (ms)")
+    for num_envs in [1, 2, 4, 8, 16]:
+        observations = synthetic_observations(num_envs, num_points, rng)
+        single_ms = measure(one_by_one, pre_processing, observations)
+        batch_ms = measure(pre_processing.preprocess_batch, observations)
+        stages = " ".join(f"{stage} {ms:.3f}" for stage, ms in pre_processing.timings.items())
+        print(f"{num_envs:>5} {single_ms:>16.3f} {batch_ms:>13.3f} {single_ms / batch_ms:>7.1f}x | {stages}")
+
+if __name__ == '__main__':
+    main()
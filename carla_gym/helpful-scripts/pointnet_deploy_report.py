@@ -0,0 +1,77 @@
+'''
+This script compares the deployment variants of PointNet (env_aux/pointnet_deploy.py) with the float model on the CPU:
+the time per batch of clouds and how close their 1024 global features are to the ones of the float model (mean cosine
+similarity, relative L2 error and max absolute error), to pick the variant that keeps the env step under budget.
+
+The clouds are the LiDAR scans of a recording (the lidar_*.npz chunks of an episode written by the SensorRecorder,
+sampled to 500 points like the observation) or, without a recording, synthetic clouds.
+
+Usage: python pointnet_deploy_report.py [episode directory of a recording | synthetic] [checkpoint of PointNetfeat]
+'''
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import glob
+import time
+import numpy as np
+import torch
+from carla_gym.src.carlacore.recorder import load_chunk
+from carla_gym.src.env.env_aux.farthest_sampler import FarthestSampler
+from carla_gym.src.env.env_aux.point_net import PointNetfeat
+from carla_gym.src.env.env_aux.pointnet_deploy import VARIANTS, build_variant
+
+NUM_POINTS = 500
+MAX_CLOUDS = 256
+BATCH_SIZES = [1, 8]
+NUM_THREADS = 1
+REPETITIONS = 20
+
+def recorded_clouds(episode_dir):
+    sampler = FarthestSampler()
+    clouds = []
+    for path in sorted(glob.glob(os.path.join(episode_dir, 'lidar_*.npz'))):
+        for frame, points in sorted(load_chunk(path).items()):
+            clouds.append(sampler.sample(points[:, :3].T, NUM_POINTS)[0])
+            if len(clouds) == MAX_CLOUDS:
+                return np.stack(clouds).astype(np.float32)
+    if len(clouds) == 0:
+        raise ValueError(f"There are no LiDAR chunks in {episode_dir}")
+    return np.stack(clouds).astype(np.float32)
+
+def synthetic_clouds(rng):
+    return rng.uniform(-50.0, 50.0, (MAX_CLOUDS, 3, NUM_POINTS)).astype(np.float32)
+
+def measure(model, batch):
+    model(batch)
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        model(batch)
+    return (time.perf_counter() - start) / REPETITIONS * 1000.0
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+    clouds = synthetic_clouds(np.random.default_rng(0)) if source == 'synthetic' else recorded_clouds(source)
+    torch.set_num_threads(NUM_THREADS)
+    torch.manual_seed(0)
+    pointnet = PointNetfeat(global_feat=True)
+    if len(sys.argv) > 2:
+        state = torch.load(sys.argv[2], map_location='cpu')
+        pointnet.load_state_dict(state.get('state_dict', state.get('model', state)))
+    pointnet.eval()
+
+    clouds = torch.from_numpy(clouds)
+    print(f"{len(clouds)} {source} clouds of {NUM_POINTS} points, {NUM_THREADS} CPU thread(s)")
+    print(f"{'variant':>12} " + " ".join(f"{f'batch {b} (ms)':>15}" for b in BATCH_SIZES) + f" {'cosine':>8} {'rel. L2':>8} {'max abs':>9}")
+    with torch.inference_mode():
+        reference = build_variant(pointnet, 'float')(clouds)
+        for variant in VARIANTS:
+            model = build_variant(pointnet, variant)
+            features = model(clouds)
+            cosine = torch.nn.functional.cosine_similarity(features, reference, dim=1).mean().item()
+            relative = (torch.linalg.norm(features - reference, dim=1) / torch.linalg.norm(reference, dim=1).clamp_min(1e-12)).mean().item()
+            max_abs = (features - reference).abs().max().item()
+            times = [measure(model, clouds[:b]) for b in BATCH_SIZES]
+            print(f"{variant:>12} " + " ".join(f"{t:>15.2f}" for t in times) + f" {cosine:>8.4f} {relative:>8.4f} {max_abs:>9.4f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+'''
+LiDAR Downsampler Module:
+    It reduces every LiDAR scan to a fixed number of points in the sensor callback. The strategy and its parameters are
+    read from the 'downsampling' entry of the LiDAR in the sensors file (default_sensors.json):
+
+    "downsampling": {
+        "strategy": "linspace",     - One of the strategies below
+        "num_points": 500,          - Points of every scan (zero padded if there are fewer)
+        "seed": 0,                  - Seed of the random generator (random, range_stratified and ground_crop)
+        "voxel_size": 0.4,          - Voxel edge in meters (voxel)
+        "range_bins": 8,            - Number of distance rings (range_stratified)
+        "max_range": 50.0,          - Max distance of the rings (range_stratified)
+        "ground_z": -1.5,           - Points below this height (in the sensor frame) are ground (ground_crop)
+        "crop": [-50, 50, -50, 50]  - [x_min, x_max, y_min, y_max] of the kept points (ground_crop)
+    }
+
+    Strategies:
+        - linspace:         Evenly spaced indices of the raw buffer (fast, but biased towards the first channels)
+        - random:           Uniform random subset
+        - voxel:            One point per occupied voxel, then a random subset of the voxels if there are still too many
+        - range_stratified: The same number of points from every distance ring, so the far rings are not drowned by the
+                            dense near ones
+        - ground_crop:      Removes the ground and the points outside the crop box, then a random subset of the rest
+
+    Every strategy is vectorized with numpy (no Python loops over the points). The script
+    helpful-scripts/benchmark_lidar_downsampling.py measures their time.
+'''
+
+import numpy as np
+
+STRATEGIES = ['linspace', 'random', 'voxel', 'range_stratified', 'ground_crop']
+
+
+class LidarDownsampler:
+    def __init__(self, strategy='linspace', num_points=500, seed=0, voxel_size=0.4, range_bins=8, max_range=50.0, ground_z=-1.5, crop=(-50.0, 50.0, -50.0, 50.0)):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown LiDAR downsampling strategy {strategy}, available: {STRATEGIES}")
+        self.strategy = strategy
+        self.num_points = int(num_points)
+        self.voxel_size = float(voxel_size)
+        self.range_bins = int(range_bins)
+        self.max_range = float(max_range)
+        self.ground_z = float(ground_z)
+        self.crop = tuple(float(c) for c in crop)
+        self.__rng = np.random.default_rng(seed)
+        self.__select = getattr(self, f'_{strategy}')
+
+    @classmethod
+    def from_sensor_dict(cls, sensor_dict):
+        return cls(**sensor_dict.get('downsampling', {}))
+
+    def sample(self, points, out=None):
+        '''
+        points: (N, 4) array [x, y, z, intensity]
+        out: Optional preallocated (num_points, 4) float32 array
+        Returns the (num_points, 4) downsampled scan, zero padded if fewer points were kept.
+        '''
+        if out is None:
+            out = np.empty((self.num_points, 4), dtype=np.float32)
+        indices = self.__select(points)
+        count = len(indices)
+        np.take(points, indices, axis=0, out=out[:count])
+        out[count:] = 0.0
+        return out
+
+    # ====================================== Strategies ======================================
+    # Every strategy returns the indices of at most num_points points
+    def _linspace(self, points):
+        if len(points) <= self.num_points:
+            return np.arange(len(points))
+        return np.linspace(0, len(points) - 1, self.num_points, dtype=np.intp)
+
+    def _random(self, points, candidates=None):
+        candidates = np.arange(len(points)) if candidates is None else candidates
+        if len(candidates) <= self.num_points:
+            return candidates
+        return np.sort(self.__rng.choice(candidates, self.num_points, replace=False))
+
+    def _voxel(self, points):
+        if len(points) == 0:
+            return np.arange(0)
+        voxels = np.floor(points[:, :3] / self.voxel_size).astype(np.int64)
+        voxels -= voxels.min(axis=0)
+        extent = voxels.max(axis=0) + 1
+        keys = (voxels[:, 0] * extent[1] + voxels[:, 1]) * extent[2] + voxels[:, 2]
+        _, first = np.unique(keys, return_index=True)
+        return self._random(points, first)
+
+    def _range_stratified(self, points):
+        if len(points) <= self.num_points:
+            return np.arange(len(points))
+        distances = np.hypot(points[:, 0], points[:, 1])
+        bins = np.minimum((distances * (self.range_bins / self.max_range)).astype(np.intp), self.range_bins - 1)
+
+        # Random order inside every ring: shuffle, then stable sort by ring
+        order = self.__rng.permutation(len(points))
+        order = order[np.argsort(bins[order], kind='stable')]
+        counts = np.bincount(bins, minlength=self.range_bins)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        ranks = np.arange(len(points)) - starts[bins[order]]
+
+        # Same quota for every ring, the points left by the sparse rings are given to the rest (in random order)
+        quota = self.num_points // self.range_bins
+        chosen = ranks < quota
+        selected = order[chosen]
+        missing = self.num_points - len(selected)
+        if missing > 0:
+            rest = order[~chosen]
+            selected = np.concatenate((selected, rest[self.__rng.permutation(len(rest))[:missing]]))
+        return np.sort(selected)
+
+    def _ground_crop(self, points):
+        x_min, x_max, y_min, y_max = self.crop
+        x, y, z = points[:, 0], points[:, 1], points[:, 2]
+        kept = np.flatnonzero((z > self.ground_z) & (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))
+        return self._random(points, kept)
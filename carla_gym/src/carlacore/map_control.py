@@ -25,17 +25,41 @@ class MapControl:
         for idx, m in enumerate(self.__available_maps):
             print(f'{idx}: {m}')
     
+    # Returns True if the map was (re)loaded, False if the active one was kept
     def set_active_map(self, map_name, reload_map=False):
         # Check if the map is already loaded
         if self.__map_dict[map_name] == self.__active_map and not reload_map:
-            return
+            return False
         
         self.__active_map = self.__map_dict[map_name]
+        path = map_name
         if map_name in ["Town15", "Town11", "Town12", "Town13"]:
-            map_name += f"/{map_name}"
-        self.__client.load_world('/Game/Carla/Maps/' + map_name, reset_settings=False)
-        time.sleep(3)
+            path += f"/{map_name}"
+        self.__client.load_world('/Game/Carla/Maps/' + path, reset_settings=False)
+        self.__wait_until_loaded(map_name)
+        # The map (the whole OpenDRIVE description) is only fetched once, after the new episode simulated a frame
         self.__map = self.__world.get_map()
+        if self.get_active_map_name() != map_name:
+            print(f"Warning: map {map_name} was requested but the server has {self.get_active_map_name()} loaded")
+        return True
+
+    # Instead of a fixed sleep, waits until the server simulates a frame after the one the world had when it was loaded
+    # (the map name can't be used, it doesn't change when the same map is reloaded)
+    def __wait_until_loaded(self, map_name, timeout=config.SIM_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        load_frame = None
+        while time.monotonic() < deadline:
+            try:
+                if load_frame is None:
+                    synchronous = self.__world.get_settings().synchronous_mode
+                    load_frame = self.__world.get_snapshot().frame
+                frame = self.__world.tick() if synchronous else self.__world.wait_for_tick(seconds=1.0).frame
+            except RuntimeError:
+                # The episode is still being swapped on the server side
+                continue
+            if frame > load_frame:
+                return
+        print(f"Map {map_name} didn't load in {timeout} seconds")
 
     # Serves for debugging purposes
     def change_map(self):
@@ -44,4 +68,4 @@ class MapControl:
         self.set_active_map(map_idx)
     
     def reload_map(self):
-        self.set_active_map(self.get_active_map_name(), reload_map=True)
+        return self.set_active_map(self.get_active_map_name(), reload_map=True)
@@ -0,0 +1,212 @@
+'''
+Sensor Recorder Module:
+    It saves the sensor data of every episode to disk without blocking CARLA's sensor callbacks. The callbacks only copy
+    the data and put it in a bounded queue, a background thread groups the frames in chunks and writes them as
+    compressed numpy archives, so data collection runs at the speed of the simulator.
+
+    Layout of a recording (every recorder writes in its own run directory, so several envs and later runs never
+    overwrite each other's episodes):
+        <RECORD_DIR>/<run>/episode_<n>/<sensor>_<chunk>.npz   - 'frames' (frame ids), 'offsets' and 'data' (the arrays
+                                                                of the chunk concatenated along the first axis, item i
+                                                                is data[offsets[i]:offsets[i + 1]])
+        <RECORD_DIR>/<run>/episode_<n>/index.json             - For each sensor, the frame range of every chunk file and
+                                                                the number of recorded/dropped frames
+        <run> is <date>-<time>_[<name>_]<pid>_<random id> (see run_name)
+
+    Drop policies (what happens when the writer thread can't keep up and the queue is full):
+        - 'drop_newest': The new frame is discarded (the callback never waits)
+        - 'drop_oldest': The oldest queued frame is discarded to make room for the new one (the callback never waits)
+        - 'block':       The callback waits for room in the queue (lossless, but it slows down the simulation)
+    Only the frames count for the size of the queue, the episode markers are always queued, in order, and never dropped.
+'''
+
+import os
+import json
+import time
+import uuid
+import threading
+from collections import deque
+from itertools import islice
+import numpy as np
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK       = 'block'
+DROP_POLICIES = [DROP_NEWEST, DROP_OLDEST, BLOCK]
+
+
+def load_chunk(path):
+    '''
+    Reads a chunk file written by the recorder. Returns a dict {frame id: array}.
+    '''
+    with np.load(path) as chunk:
+        frames, offsets, data = chunk['frames'], chunk['offsets'], chunk['data']
+    return {int(frame): data[offsets[i]:offsets[i + 1]] for i, frame in enumerate(frames)}
+
+
+def run_name(name=None):
+    '''
+    Name of the run directory of a recorder, unique across processes and runs (name identifies the env, e.g. its port).
+    '''
+    prefix = f'{name}_' if name else ''
+    return f'{time.strftime("%Y%m%d-%H%M%S")}_{prefix}{os.getpid()}_{uuid.uuid4().hex[:6]}'
+
+
+class SensorRecorder:
+    def __init__(self, directory, queue_size=256, chunk_size=64, drop_policy=DROP_NEWEST, compress=True, name=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {drop_policy}, available: {DROP_POLICIES}")
+        if int(queue_size) < 1:
+            raise ValueError(f"The queue size of the recorder must be at least 1, got {queue_size}")
+        # Run directory of this recorder, the episodes are written inside it
+        self.directory = os.path.join(directory, run_name(name))
+        self.chunk_size = int(chunk_size)
+        self.drop_policy = drop_policy
+        self.__save = np.savez_compressed if compress else np.savez
+        self.__queue_size = int(queue_size)
+        self.__items = deque()          # Frames and episode markers, in order
+        self.__frames = 0               # Frames in __items
+        self.__unfinished = 0           # Items not written yet (queued or being written)
+        self.__condition = threading.Condition()
+        self.__lock = threading.Lock()
+        self.__episode = None
+        self.__dropped = {}
+        self.__thread = threading.Thread(target=self.__write_loop, name='sensor-recorder', daemon=True)
+        self.__thread.start()
+
+    # ====================================== Episodes ======================================
+    def start_episode(self, episode):
+        self.end_episode()
+        with self.__lock:
+            self.__episode = episode
+            self.__dropped = {}
+        self.__put(('start', episode, None, None))
+
+    def end_episode(self):
+        with self.__lock:
+            if self.__episode is None:
+                return
+            episode, dropped = self.__episode, self.__dropped
+            self.__episode = None
+        # Markers are never dropped, even with a full queue
+        self.__put(('end', episode, dropped, None))
+
+    # ====================================== Recording ======================================
+    def record(self, sensor, frame, data):
+        '''
+        Called from the sensor callbacks. The data is copied because the sensors reuse their buffers.
+        '''
+        if self.__episode is None:
+            return
+        item = ('data', sensor, frame, np.array(data, copy=True))
+        with self.__condition:
+            if self.__frames >= self.__queue_size:
+                if self.drop_policy == DROP_NEWEST:
+                    self.__count_drop(sensor)
+                    return
+                if self.drop_policy == BLOCK:
+                    self.__condition.wait_for(lambda: self.__frames < self.__queue_size)
+                else:
+                    # The oldest frame is removed where it is, the markers around it keep their order
+                    i = next(i for i, queued in enumerate(self.__items) if queued[0] == 'data')
+                    dropped = self.__items[i]
+                    del self.__items[i]
+                    self.__frames -= 1
+                    self.__unfinished -= 1
+                    # A frame of an ended episode is counted in the drops of its 'end' marker
+                    end = next((queued for queued in islice(self.__items, i, None) if queued[0] == 'end'), None)
+                    if end is not None:
+                        end[2][dropped[1]] = end[2].get(dropped[1], 0) + 1
+                    else:
+                        self.__count_drop(dropped[1])
+            self.__put(item)
+
+    def __put(self, item):
+        with self.__condition:
+            self.__items.append(item)
+            if item[0] == 'data':
+                self.__frames += 1
+            self.__unfinished += 1
+            self.__condition.notify_all()
+
+    def __get(self):
+        with self.__condition:
+            self.__condition.wait_for(lambda: len(self.__items) > 0)
+            item = self.__items.popleft()
+            if item[0] == 'data':
+                self.__frames -= 1
+            # Wakes the callbacks waiting for room with the 'block' policy
+            self.__condition.notify_all()
+            return item
+
+    def __task_done(self):
+        with self.__condition:
+            self.__unfinished -= 1
+            self.__condition.notify_all()
+
+    def __count_drop(self, sensor):
+        with self.__lock:
+            self.__dropped[sensor] = self.__dropped.get(sensor, 0) + 1
+
+    def pending(self):
+        with self.__condition:
+            return len(self.__items)
+
+    # Waits until every queued frame has been written
+    def flush(self):
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__unfinished == 0)
+
+    def close(self):
+        self.end_episode()
+        self.__put(('stop', None, None, None))
+        self.__thread.join()
+
+    # ====================================== Writer Thread ======================================
+    def __write_loop(self):
+        episode_dir = None
+        buffers = {}        # sensor -> list of (frame, array) not written yet
+        index = {}          # sensor -> {'chunks': {file: [first frame, last frame]}, 'frames': n}
+        while True:
+            kind, key, value, data = self.__get()
+            try:
+                if kind == 'data':
+                    if episode_dir is None:
+                        continue
+                    buffers.setdefault(key, []).append((value, data))
+                    if len(buffers[key]) >= self.chunk_size:
+                        self.__write_chunk(episode_dir, key, buffers.pop(key), index)
+                elif kind == 'start':
+                    episode_dir = os.path.join(self.directory, f'episode_{key:06d}')
+                    os.makedirs(episode_dir, exist_ok=True)
+                    buffers, index = {}, {}
+                elif kind == 'end':
+                    if episode_dir is not None:
+                        for sensor in list(buffers):
+                            self.__write_chunk(episode_dir, sensor, buffers.pop(sensor), index)
+                        self.__write_index(episode_dir, index, value)
+                    episode_dir = None
+                elif kind == 'stop':
+                    return
+            except Exception as e:
+                # A failed write must not kill the thread (the callbacks would block forever with the 'block' policy)
+                print(f"Sensor recorder: failed to write {kind} {key}: {e}")
+            finally:
+                self.__task_done()
+
+    def __write_chunk(self, episode_dir, sensor, items, index):
+        sensor_index = index.setdefault(sensor, {'chunks': {}, 'frames': 0})
+        name = f'{sensor}_{len(sensor_index["chunks"]):05d}.npz'
+        frames = np.array([frame for frame, _ in items], dtype=np.int64)
+        # Scalars and 1D arrays are stored one row per item, the rest keep their own first axis (e.g., image rows)
+        arrays = [np.atleast_2d(data) if data.ndim < 2 else data for _, data in items]
+        offsets = np.cumsum([0] + [len(data) for data in arrays])
+        self.__save(os.path.join(episode_dir, name), frames=frames, offsets=offsets, data=np.concatenate(arrays))
+        sensor_index['chunks'][name] = [int(frames[0]), int(frames[-1])]
+        sensor_index['frames'] += len(items)
+
+    def __write_index(self, episode_dir, index, dropped):
+        for sensor, count in dropped.items():
+            index.setdefault(sensor, {'chunks': {}, 'frames': 0})['dropped'] = count
+        with open(os.path.join(episode_dir, 'index.json'), 'w') as f:
+            json.dump(index, f, indent=4)
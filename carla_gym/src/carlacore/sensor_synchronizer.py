@@ -0,0 +1,55 @@
+'''
+Sensor Synchronizer Module:
+    It keeps track of the last simulation frame delivered by each streaming sensor of a vehicle, so that after a
+    world.tick() the environment can wait until every sensor has delivered the data of that frame instead of reading
+    whatever the callbacks stored last (or sleeping a fixed amount of time and hoping the sensors are ready).
+
+    Only the sensors that produce data every frame (sensor_tick = 0) are registered. The event based sensors
+    (Collision, Lane Invasion) and the ones with a slower sensor_tick never deliver some frames, so they are left out.
+'''
+
+import time
+import threading
+
+
+class SensorSynchronizer:
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__frames = {}          # sensor name -> last frame id delivered (None until the first one)
+
+    def register(self, name):
+        with self.__condition:
+            self.__frames[name] = None
+
+    def clear(self):
+        with self.__condition:
+            self.__frames = {}
+            self.__condition.notify_all()
+
+    # Called from the sensor callbacks (CARLA's threads) after the data of the frame has been stored
+    def notify(self, name, frame):
+        with self.__condition:
+            if name in self.__frames:
+                self.__frames[name] = frame
+                self.__condition.notify_all()
+
+    def missing(self, frame):
+        with self.__condition:
+            return self.__missing(frame)
+
+    def __missing(self, frame):
+        return [name for name, last in self.__frames.items() if last is None or last < frame]
+
+    def wait_for_frame(self, frame, timeout=None):
+        '''
+        Blocks until every registered sensor has delivered the given frame (or a newer one). Returns False if the
+        timeout expires first.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            while self.__missing(frame):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+        return True
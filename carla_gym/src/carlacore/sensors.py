@@ -25,14 +25,34 @@ import numpy as np
 from PIL import Image
 import cv2
 import carla_gym.src.config.configuration as configuration
+from carla_gym.src.carlacore.lidar_downsampler import LidarDownsampler
+
+
+# CARLA's raw_data is only valid during the callback, so the points kept after it are copied into an owned buffer
+# (preallocated, grown when a measurement has more points). Returns the view of the buffer holding the points
+def _copy_points(buffers, index, points):
+    if len(buffers[index]) < len(points):
+        buffers[index] = np.empty((max(len(points), 2 * len(buffers[index])), points.shape[1]), dtype=points.dtype)
+    out = buffers[index][:len(points)]
+    np.copyto(out, points)
+    return out
 
 # ====================================== RGB Camera ======================================
 class RGB_Camera:
-    def __init__(self, world, vehicle, sensor_dict):
+    def __init__(self, world, vehicle, sensor_dict, synchronizer=None, name='rgb_camera', recorder=None):
         self.__sensor = self.attach_rgb_camera(world, vehicle, sensor_dict)
-        self.__last_data = None
+        self.__image_shape = (int(sensor_dict['image_size_y']), int(sensor_dict['image_size_x']), 3)
+        # Two preallocated RGB buffers used alternately: the callback writes one while the other keeps the last full frame
+        self.__buffers = [np.zeros(self.__image_shape, dtype=np.uint8) for _ in range(2)]
+        self.__next_buffer = 0
         self.__raw_data = None
         self.__sensor_ready = False
+        self.__name = name
+        self.__synchronizer = synchronizer
+        self.__recorder = recorder
+        # Only the sensors that deliver data every frame can be waited for
+        if self.__synchronizer is not None and float(sensor_dict.get('sensor_tick', 0.0)) == 0.0:
+            self.__synchronizer.register(name)
         self.__sensor.listen(lambda data: self.callback(data))
 
     def attach_rgb_camera(self, world, vehicle, sensor_dict):
@@ -52,38 +72,36 @@ class RGB_Camera:
     def callback(self, data):
         global configuration
 
-        # Get the image from the data
-        image = Image.frombytes('RGBA', (data.width, data.height), data.raw_data, 'raw', 'RGBA')
-
-        # Convert the image to a NumPy array
-        image_array = np.array(image)
+        # View the raw BGRA bytes of CARLA without copying them
+        bgra = np.frombuffer(data.raw_data, dtype=np.uint8).reshape((data.height, data.width, 4))
 
-        # Take out the alpha channel
-        image_array = image_array[:, :, :3]
+        # Convert directly into the buffer that is not being read (dropping the alpha channel)
+        image_array = self.__buffers[self.__next_buffer]
+        if image_array.shape[:2] != bgra.shape[:2]:
+            image_array = self.__buffers[self.__next_buffer] = np.empty((data.height, data.width, 3), dtype=np.uint8)
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2RGB, dst=image_array)
 
+        # Publish the new frame, the next one goes to the other buffer
         self.__raw_data = image_array
+        self.__next_buffer ^= 1
         self.__sensor_ready = True
+        if self.__synchronizer is not None:
+            self.__synchronizer.notify(self.__name, data.frame)
 
-        # Ensure the array is contiguous in memory
-        image_array = np.ascontiguousarray(image_array)
-
-        # Display the processed image using Pygame
-        self.__last_data = image_array
-
-
-        # Save image in directory
-        if configuration.VERBOSE:
-            timestamp = data.timestamp
-            cv2.imwrite(f'data/rgb_camera/{timestamp}.png', image_array)
+        # The recorder copies the frame and writes it in its own thread
+        if self.__recorder is not None:
+            self.__recorder.record(self.__name, data.frame, image_array)
     
+    # The same frame is used for the display and the observation
     def get_last_data(self):
-        return self.__last_data
+        return self.__raw_data
 
+    # The returned array is one of the preallocated buffers: it stays valid for the next frame, after that it is overwritten
     def get_data(self):
         if self.__raw_data is not None:
             return self.__raw_data
         else:
-            return np.zeros((480, 640, 3))
+            return np.zeros(self.__image_shape, dtype=np.uint8)
     
     def is_ready(self):
         return self.__sensor_ready
@@ -93,11 +111,29 @@ class RGB_Camera:
 
 # ====================================== LiDAR ======================================
 class Lidar:
-    def __init__(self, world, vehicle, sensor_dict):
+    def __init__(self, world, vehicle, sensor_dict, synchronizer=None, name='lidar', recorder=None):
         self.__sensor = self.attach_lidar(world, vehicle, sensor_dict)
         self.__last_data = None
+        self.__last_data_frame = None
         self.__raw_data = None
+        self.__points = np.zeros((0, 4), dtype=np.float32)
+        # Every scan is reduced to a fixed number of points ('downsampling' entry of the sensors file), written
+        # alternately in two preallocated buffers
+        self.__downsampler = LidarDownsampler.from_sensor_dict(sensor_dict)
+        self.__buffers = [np.zeros((self.__downsampler.num_points, 4), dtype=np.float32) for _ in range(2)]
+        # Full point cloud of the scan (for the bird's-eye-view representation), copied alternately in two owned buffers
+        # sized for one rotation of the sensor
+        capacity = int(float(sensor_dict['points_per_second']) / max(float(sensor_dict['rotation_frequency']), 1.0))
+        self.__point_buffers = [np.zeros((capacity, 4), dtype=np.float32) for _ in range(2)]
+        self.__next_buffer = 0
+        self.__frame = None
         self.__sensor_ready = False
+        self.__name = name
+        self.__synchronizer = synchronizer
+        self.__recorder = recorder
+        # Only the sensors that deliver data every frame can be waited for
+        if self.__synchronizer is not None and float(sensor_dict.get('sensor_tick', 0.0)) == 0.0:
+            self.__synchronizer.register(name)
         self.__sensor.listen(lambda data: self.callback(data))
 
     def attach_lidar(self, world, vehicle, sensor_dict):
@@ -124,21 +160,39 @@ class Lidar:
         lidar_data = data.raw_data
         lidar_data = np.frombuffer(lidar_data, dtype=np.dtype('f4'))
         lidar_data = np.reshape(lidar_data, (int(lidar_data.shape[0] / 4), 4))
+        # Full point cloud, used by the bird's-eye-view representation after the callback returns
+        points = _copy_points(self.__point_buffers, self.__next_buffer, lidar_data)
 
-        # Ensure a fixed number of points (e.g., 400)
-        fixed_num_points = 500
-        if lidar_data.shape[0] < fixed_num_points:
-            # Pad with zeros if fewer points than expected
-            lidar_data = np.pad(lidar_data, ((0, fixed_num_points - lidar_data.shape[0]), (0, 0)), mode='constant')
-        elif lidar_data.shape[0] > fixed_num_points:
-            # Downsample if more points than expected
-            indices = np.linspace(0, lidar_data.shape[0] - 1, fixed_num_points, dtype=int)
-            lidar_data = lidar_data[indices]
+        # Ensure a fixed number of points (downsampled with the configured strategy, zero padded if there are fewer)
+        lidar_data = self.__downsampler.sample(points, out=self.__buffers[self.__next_buffer])
+        self.__next_buffer ^= 1
 
         # Update self.__raw_data with the modified Lidar data
+        self.__points = points
         self.__raw_data = lidar_data
+        self.__frame = data.frame
         self.__sensor_ready = True
+        if self.__synchronizer is not None:
+            self.__synchronizer.notify(self.__name, data.frame)
 
+        # The recorder copies the point cloud and writes it in its own thread
+        if self.__recorder is not None:
+            self.__recorder.record(self.__name, data.frame, lidar_data)
+    
+    # The visualization image is only needed by the display, so it is built on demand (once per frame)
+    def get_last_data(self):
+        # The frame id is read before the data (the callback writes them in the opposite order), so a frame that
+        # arrives in between is rebuilt on the next call instead of being cached with an older id
+        frame = self.__frame
+        raw_data = self.__raw_data
+        if raw_data is None:
+            return None
+        if self.__last_data_frame != frame:
+            self.__last_data = self.__build_image(raw_data)
+            self.__last_data_frame = frame
+        return self.__last_data
+
+    def __build_image(self, lidar_data):
         # Extract X, Y, Z coordinates and intensity values
         points_xyz = lidar_data[:, :3]
         intensity = lidar_data[:, 3]
@@ -166,21 +220,14 @@ class Lidar:
         lidar_image_array[y_indices, x_indices] = intensity * intensity_scale
 
         # Clip the intensity values to stay within the valid color range
-        lidar_image_array = np.clip(lidar_image_array, 0, 255)
-
-        # Display the processed image using Pygame
-        self.__last_data = lidar_image_array
-
-        # Save image in directory
-        if configuration.VERBOSE:
-            timestamp = data.timestamp
-            cv2.imwrite(f'data/lidar/{timestamp}.png', lidar_image_array)
-    
-    def get_last_data(self):
-        return self.__last_data
+        return np.clip(lidar_image_array, 0, 255)
     
     def get_data(self):
         return self.__raw_data
+
+    # Every point of the last scan [x, y, z, intensity], without padding or downsampling
+    def get_points(self):
+        return self.__points
     
     def is_ready(self):
         return self.__sensor_ready
@@ -190,11 +237,27 @@ class Lidar:
 
 # ====================================== Radar ======================================
 class Radar:
-    def __init__(self, world, vehicle, sensor_dict):
+    def __init__(self, world, vehicle, sensor_dict, synchronizer=None, name='radar', recorder=None):
         self.__sensor = self.attach_radar(world, vehicle, sensor_dict)
         self.__last_data = None
+        self.__last_data_frame = None
         self.__raw_data = None
+        # Fixed-shape observation: the nearest max_detections detections [velocity, azimuth, altitude, depth] sorted by
+        # depth (zero padded) and a mask with 1 for the valid rows. Two slots used alternately, like the camera buffers
+        self.__max_detections = int(sensor_dict.get('max_detections', 64))
+        self.__detections = [np.zeros((self.__max_detections, 4), dtype=np.float32) for _ in range(2)]
+        self.__masks = [np.zeros(self.__max_detections, dtype=np.uint8) for _ in range(2)]
+        # Every detection of the last measurement, for the visualization image (same slots)
+        self.__points = [np.zeros((self.__max_detections, 4), dtype=np.float32) for _ in range(2)]
+        self.__slot = 0
+        self.__frame = None
         self.__sensor_ready = False
+        self.__name = name
+        self.__synchronizer = synchronizer
+        self.__recorder = recorder
+        # Only the sensors that deliver data every frame can be waited for
+        if self.__synchronizer is not None and float(sensor_dict.get('sensor_tick', 0.0)) == 0.0:
+            self.__synchronizer.register(name)
         self.__sensor.listen(lambda data: self.callback(data))
 
     def attach_radar(self, world, vehicle, sensor_dict):
@@ -218,10 +281,34 @@ class Radar:
         # Get the radar data
         radar_data = data.raw_data
 
-        points = np.frombuffer(radar_data, dtype=np.dtype('f4'))
+        points = np.frombuffer(radar_data, dtype=np.dtype('f4')).reshape((-1, 4))
+        points = _copy_points(self.__points, self.__slot ^ 1, points)
+        self.__pack(points)
         self.__raw_data = points
+        self.__frame = data.frame
         self.__sensor_ready = True
-        points = np.reshape(points, (len(data), 4))
+        if self.__synchronizer is not None:
+            self.__synchronizer.notify(self.__name, data.frame)
+
+        # The recorder copies the detections (one row per detection) and writes them in its own thread
+        if self.__recorder is not None:
+            self.__recorder.record(self.__name, data.frame, points)
+    
+    # The visualization image is only needed by the display, so it is built on demand (once per frame)
+    def get_last_data(self):
+        # The frame id is read before the data (the callback writes them in the opposite order), so a frame that
+        # arrives in between is rebuilt on the next call instead of being cached with an older id
+        frame = self.__frame
+        raw_data = self.__raw_data
+        if raw_data is None:
+            return None
+        if self.__last_data_frame != frame:
+            self.__last_data = self.__build_image(raw_data)
+            self.__last_data_frame = frame
+        return self.__last_data
+
+    def __build_image(self, radar_data):
+        points = np.reshape(radar_data, (-1, 4))
 
         # Extract information from radar points
         azimuths = points[:, 1]
@@ -248,18 +335,28 @@ class Radar:
         # Set a value (e.g., velocity) at each (azimuth, depth) coordinate in the histogram
         radar_image_array[depth_indices, azimuth_indices] = 255  # Set a constant value for visibility
 
-        self.__last_data = radar_image_array
-
-        # Save image in directory
-        if configuration.VERBOSE:
-            timestamp = data.timestamp
-            cv2.imwrite(f'data/radar/{timestamp}.png', radar_image_array)
-    
-    def get_last_data(self):
-        return self.__last_data
+        return radar_image_array
 
+    # Packs the nearest detections into the free slot and publishes it
+    def __pack(self, points):
+        slot = self.__slot ^ 1
+        detections, mask = self.__detections[slot], self.__masks[slot]
+        count = min(len(points), self.__max_detections)
+        if len(points) > self.__max_detections:
+            nearest = np.argpartition(points[:, 3], count - 1)[:count]
+            nearest = nearest[np.argsort(points[nearest, 3])]
+        else:
+            nearest = np.argsort(points[:, 3])
+        np.take(points, nearest, axis=0, out=detections[:count])
+        detections[count:] = 0.0
+        mask[:count] = 1
+        mask[count:] = 0
+        self.__slot = slot
+
+    # Returns (detections, mask), the fixed-shape arrays of the observation
     def get_data(self):
-        return self.__raw_data
+        slot = self.__slot
+        return self.__detections[slot], self.__masks[slot]
     
     def is_ready(self):
         return self.__sensor_ready
@@ -269,10 +366,19 @@ class Radar:
 
 # ====================================== GNSS ======================================
 class GNSS:
-    def __init__(self, world, vehicle, sensor_dict):
+    def __init__(self, world, vehicle, sensor_dict, synchronizer=None, name='gnss', recorder=None):
         self.__sensor = self.attach_gnss(world, vehicle, sensor_dict)
         self.__last_data = None
+        # [latitude, longitude, altitude], float64 so the coordinates keep their precision
+        self.__buffers = [np.zeros(3, dtype=np.float64) for _ in range(2)]
+        self.__slot = 0
         self.__sensor_ready = False
+        self.__name = name
+        self.__synchronizer = synchronizer
+        self.__recorder = recorder
+        # Only the sensors that deliver data every frame can be waited for
+        if self.__synchronizer is not None and float(sensor_dict.get('sensor_tick', 0.0)) == 0.0:
+            self.__synchronizer.register(name)
         self.__sensor.listen(lambda data: self.callback(data))
 
     def attach_gnss(self, world, vehicle, sensor_dict):
@@ -288,14 +394,21 @@ class GNSS:
     
     def callback(self, data):
         global configuration
+        values = self.__buffers[self.__slot ^ 1]
+        values[:] = (data.latitude, data.longitude, data.altitude)
+        self.__slot ^= 1
         self.__last_data = data
         self.__sensor_ready = True
+        if self.__synchronizer is not None:
+            self.__synchronizer.notify(self.__name, data.frame)
+        if self.__recorder is not None:
+            self.__recorder.record(self.__name, data.frame, values)
 
     def get_last_data(self):
         return self.__last_data
     
     def get_data(self):
-        return np.array([self.__last_data.latitude, self.__last_data.longitude, self.__last_data.altitude])
+        return self.__buffers[self.__slot]
     
     def is_ready(self):
         return self.__sensor_ready
@@ -306,8 +419,18 @@ class GNSS:
 
 # ====================================== IMU ======================================
 class IMU:
-    def __init__(self, world, vehicle, sensor_dict):
+    def __init__(self, world, vehicle, sensor_dict, synchronizer=None, name='imu', recorder=None):
         self.__sensor = self.attach_imu(world, vehicle, sensor_dict)
+        self.__last_data = None
+        # [accelerometer x, y, z, gyroscope x, y, z, compass]
+        self.__buffers = [np.zeros(7, dtype=np.float32) for _ in range(2)]
+        self.__slot = 0
+        self.__name = name
+        self.__synchronizer = synchronizer
+        self.__recorder = recorder
+        # Only the sensors that deliver data every frame can be waited for
+        if self.__synchronizer is not None and float(sensor_dict.get('sensor_tick', 0.0)) == 0.0:
+            self.__synchronizer.register(name)
         self.__sensor.listen(lambda data: self.callback(data))
         self.__sensor_ready = False
 
@@ -324,11 +447,22 @@ class IMU:
     
     def callback(self, data):
         global configuration
+        accelerometer, gyroscope = data.accelerometer, data.gyroscope
+        values = self.__buffers[self.__slot ^ 1]
+        values[:] = (accelerometer.x, accelerometer.y, accelerometer.z, gyroscope.x, gyroscope.y, gyroscope.z, data.compass)
+        self.__slot ^= 1
         self.__last_data = data
         self.__sensor_ready = True
+        if self.__synchronizer is not None:
+            self.__synchronizer.notify(self.__name, data.frame)
+        if self.__recorder is not None:
+            self.__recorder.record(self.__name, data.frame, values)
 
     def get_last_data(self):
         return self.__last_data
+
+    def get_data(self):
+        return self.__buffers[self.__slot]
     
     def is_ready(self):
         return self.__sensor_ready
@@ -360,6 +494,9 @@ class Collision:
     
     def collision_occurred(self):
         return self.critical_collision
+
+    def reset(self):
+        self.critical_collision = False
     
     def is_ready(self):
         return self.__sensor_ready
@@ -395,5 +532,8 @@ class Lane_Invasion:
     def lane_invasion_occurred(self):
         return self.lane_transgression
 
+    def reset(self):
+        self.lane_transgression = False
+
     def destroy(self):
         self.__sensor.destroy()
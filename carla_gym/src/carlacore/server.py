@@ -13,22 +13,28 @@ Requirements:
 
 class CarlaServer:
     @staticmethod
-    def initialize_server(low_quality = False, offscreen_rendering = False, silent = False, sleep_time = 10):
+    def initialize_server(low_quality = False, offscreen_rendering = False, silent = False, sleep_time = 10, port = None, streaming_port = None):
         # Get environment variable CARLA_SERVER that contains the path to the Carla server directory
         carla_server = os.getenv('CARLA_SERVER')
+        # Several servers in the same machine need different RPC and streaming ports (the streaming one defaults to port + 1)
+        if streaming_port is None and port is not None:
+            streaming_port = port + 1
+        port_arg = f'-carla-rpc-port={port}' if port is not None else ''
+        port_arg += f' -carla-streaming-port={streaming_port}' if streaming_port is not None else ''
 
         # If it is Unix add the CarlaUE4.sh to the path else add CarlaUE4.exe
         if os.name == 'posix':
             carla_server = os.path.join(carla_server, 'CarlaUE4.sh')
-            command = f"bash {carla_server} {'--quality-level=Low' if low_quality else ''} {'--RenderOffScreen' if offscreen_rendering else ''}"
+            command = f"bash {carla_server} {'--quality-level=Low' if low_quality else ''} {'--RenderOffScreen' if offscreen_rendering else ''} {port_arg}"
         else:
             carla_server = os.path.join(carla_server, 'CarlaUE4.exe')
-            command = f"{carla_server} {'--quality-level=Low' if low_quality else ''} {'--RenderOffScreen' if offscreen_rendering else ''}"
+            command = f"{carla_server} {'--quality-level=Low' if low_quality else ''} {'--RenderOffScreen' if offscreen_rendering else ''} {port_arg}"
 
         # Run the command
         if not silent:
             print('Starting Carla server, please wait...')
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # The server gets its own process group (close_server kills the group), so closing it doesn't kill the caller
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=(os.name == 'posix'))
     
         # Wait for the server to start
         time.sleep(sleep_time)
@@ -40,7 +46,11 @@ class CarlaServer:
     @staticmethod
     def close_server(process, silent = False):
         if os.name == 'posix':
-            os.killpg(os.getpgid(process.pid), 15)
+            try:
+                os.killpg(os.getpgid(process.pid), 15)
+            except ProcessLookupError:
+                # The server already exited
+                pass
             if not silent:
                 print('Carla server closed')
         else:
@@ -50,9 +60,9 @@ class CarlaServer:
                 print('Carla server closed')
     
     @staticmethod
-    def restart_server(process, low_quality = False, offscreen_rendering = False, silent = False, sleep_time = 10):
+    def restart_server(process, low_quality = False, offscreen_rendering = False, silent = False, sleep_time = 10, port = None, streaming_port = None):
         CarlaServer.close_server(process, silent)
-        return CarlaServer.initialize_server(low_quality, offscreen_rendering, silent, sleep_time)
+        return CarlaServer.initialize_server(low_quality, offscreen_rendering, silent, sleep_time, port, streaming_port)
     
     @staticmethod
     def kill_carla_linux():
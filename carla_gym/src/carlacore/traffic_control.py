@@ -13,8 +13,9 @@ Traffic Controller module:
 '''
 
 class TrafficControl:
-    def __init__(self, world) -> None:
+    def __init__(self, world, tm_port=8000) -> None:
         self.__active_vehicles = []
+        self.__tm_port = tm_port # Traffic Manager of the autopilot, one per server in the same machine
         self.__active_pedestrians = []
         self.__active_ai_controllers = []
         self.__world = world
@@ -68,7 +69,7 @@ class TrafficControl:
     
     def toggle_autopilot(self, autopilot_on = True):
         for vehicle in self.__active_vehicles:
-            vehicle.set_autopilot(autopilot_on)
+            vehicle.set_autopilot(autopilot_on, self.__tm_port)
 
     def spawn_vehicles_around_ego(self, ego_vehicle, radius, num_vehicles_around_ego, seed=None):
         if seed is not None:
@@ -95,7 +96,7 @@ class TrafficControl:
             vehicle_bp = random.choice(vehicle_bps)
             try:
                 vehicle = self.__world.spawn_actor(vehicle_bp, point)
-                vehicle.set_autopilot(True)
+                vehicle.set_autopilot(True, self.__tm_port)
                 self.__active_vehicles.append(vehicle)
             except:
                 print('Error: Failed to spawn a traffic vehicle.')
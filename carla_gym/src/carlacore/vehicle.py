@@ -12,12 +12,31 @@ import os
 
 import carla_gym.src.config.configuration as configuration
 import carla_gym.src.carlacore.sensors as sensors
+from carla_gym.src.carlacore.sensor_synchronizer import SensorSynchronizer
+
+# Caches shared by every Vehicle of the process:
+#   - Parsed JSON files (path -> (mtime, data)), parsed again only when the file changes. The data must not be modified
+#   - Physics controls ready to apply ((vehicle type, weather condition, mtime of the physics file) -> PhysicsControl)
+_json_cache = {}
+_physics_cache = {}
+
+def _read_json(filename):
+    mtime = os.stat(filename).st_mtime_ns
+    cached = _json_cache.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(filename) as f:
+            cached = _json_cache[filename] = (mtime, json.load(f))
+    return cached
 
 class Vehicle:
-    def __init__(self, world):
+    def __init__(self, world, recorder=None):
         self.__vehicle = None
         self.__sensor_dict = {}
         self.__world = world
+        self.__synchronizer = SensorSynchronizer()
+        self.__recorder = recorder  # SensorRecorder that saves the data of the sensors (None to disable)
+        self.__blueprints = {}      # Filter -> blueprints, the blueprint library doesn't change while the server runs
+        self.__active_physics = None # Key of the physics control applied to the current vehicle (see __change_vehicle_physics)
 
         self.__control = carla.VehicleControl()
         self.__ackermann_control = carla.VehicleAckermannControl()
@@ -56,7 +75,11 @@ class Vehicle:
 
         vehicle_id = self.__read_vehicle_file(configuration.VEHICLE_PHYSICS_FILE)["id"]
 
-        vehicle_bp = self.__world.get_blueprint_library().filter(vehicle_id)
+        if vehicle_id not in self.__blueprints:
+            self.__blueprints[vehicle_id] = self.__world.get_blueprint_library().filter(vehicle_id)
+        vehicle_bp = self.__blueprints[vehicle_id]
+        # A new actor starts with the default physics
+        self.__active_physics = None
         
         # If location is not provided, spawn the vehicle in a random location
         if location is None:
@@ -88,19 +111,53 @@ class Vehicle:
             except:
                 print("Error: Failed to spawn vehicle. Check the location and rotation provided.")
                 return
+            # try_spawn_actor returns None when the location is taken (e.g., by another ego vehicle)
+            if self.__vehicle is None:
+                print("Error: Failed to spawn vehicle. The location is occupied.")
+                return
         
         # Attach sensors
         vehicle_data = self.__read_vehicle_file(configuration.VEHICLE_SENSORS_FILE)
         self.__attach_sensors(vehicle_data, self.__world)
 
+    def is_spawned(self):
+        return self.__vehicle is not None
+
+    # Stops the vehicle where it is (zero velocity, brake and hand brake). Used to park it between episodes
+    def stop(self):
+        self.__vehicle.set_target_velocity(carla.Vector3D(0.0, 0.0, 0.0))
+        self.__vehicle.set_target_angular_velocity(carla.Vector3D(0.0, 0.0, 0.0))
+        self.__vehicle.apply_control(carla.VehicleControl(brake=1.0, hand_brake=True))
+
+    # Moves the spawned vehicle and its sensors to a new start pose and leaves it as if it had just been spawned there
+    # (stopped, with the controls and the collision/lane invasion flags cleared), without respawning any actor
+    def teleport(self, location, rotation):
+        transform = carla.Transform(carla.Location(x=location[0], y=location[1], z=location[2]), carla.Rotation(pitch=rotation[0], yaw=rotation[1], roll=rotation[2]))
+        self.__vehicle.set_transform(transform)
+        self.stop()
+
+        self.__control = carla.VehicleControl()
+        self.__ackermann_control = carla.VehicleAckermannControl()
+        self.__throttle = 0.0
+        self.__brake = 0.0
+        self.__steering_angle = 0.0
+        self.__speed = 0.0
+        self.__vehicle.apply_control(self.__control)
+
+        for sensor in ['collision', 'lane_invasion']:
+            if sensor in self.__sensor_dict:
+                self.__sensor_dict[sensor].reset()
+
     def get_sensor_dict(self):
         return self.__sensor_dict
 
+    # Sensors attached by spawn_vehicle (and their attributes), used to build the observation space before spawning
+    def read_sensors_file(self):
+        return self.__read_vehicle_file(configuration.VEHICLE_SENSORS_FILE)
+
+    # The parsed file is cached (see _read_json), it must not be modified
     def __read_vehicle_file(self, filename):
-        with open(filename) as f:
-            vehicle_data = json.load(f)
-        
-        return vehicle_data
+        return _read_json(filename)[1]
     
     def destroy_vehicle(self):
         if self.__vehicle is None:
@@ -115,23 +172,22 @@ class Vehicle:
             print("Successfully destroyed the ego vehicle and its sensors.")
         self.__vehicle = None
         self.__sensor_dict = {}
+        self.__synchronizer.clear()
+        self.__active_physics = None
 
     # ====================================== Vehicle Sensors ======================================
     def __attach_sensors(self, vehicle_data, world):
         for sensor in vehicle_data:
             if sensor == 'rgb_camera':
-                self.__sensor_dict[sensor]    = sensors.RGB_Camera(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['rgb_camera'])
-                os.makedirs('data/rgb_camera', exist_ok=True)
+                self.__sensor_dict[sensor]    = sensors.RGB_Camera(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['rgb_camera'], synchronizer=self.__synchronizer, name='rgb_camera', recorder=self.__recorder)
             elif sensor == 'lidar':
-                self.__sensor_dict[sensor]    = sensors.Lidar(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['lidar'])
-                os.makedirs('data/lidar', exist_ok=True)
+                self.__sensor_dict[sensor]    = sensors.Lidar(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['lidar'], synchronizer=self.__synchronizer, name='lidar', recorder=self.__recorder)
             elif sensor == 'radar':
-                self.__sensor_dict[sensor]    = sensors.Radar(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['radar'])
-                os.makedirs('data/radar', exist_ok=True)
+                self.__sensor_dict[sensor]    = sensors.Radar(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['radar'], synchronizer=self.__synchronizer, name='radar', recorder=self.__recorder)
             elif sensor == 'gnss':
-                self.__sensor_dict[sensor]    = sensors.GNSS(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['gnss'])
+                self.__sensor_dict[sensor]    = sensors.GNSS(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['gnss'], synchronizer=self.__synchronizer, name='gnss', recorder=self.__recorder)
             elif sensor == 'imu':
-                self.__sensor_dict[sensor]    = sensors.IMU(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['imu'])
+                self.__sensor_dict[sensor]    = sensors.IMU(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['imu'], synchronizer=self.__synchronizer, name='imu', recorder=self.__recorder)
             elif sensor == 'collision':
                 self.__sensor_dict[sensor]    = sensors.Collision(world=world, vehicle=self.__vehicle, sensor_dict=vehicle_data['collision'])
             elif sensor == 'lane_invasion':
@@ -148,6 +204,7 @@ class Vehicle:
         if 'lidar' in self.__sensor_dict:
             lidar_data = self.__sensor_dict['lidar'].get_data()
             data_dict['lidar_data'] = lidar_data
+            data_dict['lidar_points'] = self.__sensor_dict['lidar'].get_points()
         if 'gnss' in self.__sensor_dict:
             gnss_data = self.__sensor_dict['gnss'].get_data()
             data_dict['gnss_data'] = gnss_data
@@ -155,8 +212,9 @@ class Vehicle:
             imu_data = self.__sensor_dict['imu'].get_data()
             data_dict['imu_data'] = imu_data
         if 'radar' in self.__sensor_dict:
-            radar_data = self.__sensor_dict['radar'].get_data()
+            radar_data, radar_mask = self.__sensor_dict['radar'].get_data()
             data_dict['radar_data'] = radar_data
+            data_dict['radar_mask'] = radar_mask
 
         return data_dict
 
@@ -166,20 +224,44 @@ class Vehicle:
                 return False
         return True
 
+    # Blocks until every streaming sensor has delivered the data of the given simulation frame (the one returned by world.tick()). Returns False if the timeout expires first
+    def wait_for_sensors(self, frame, timeout=None):
+        return self.__synchronizer.wait_for_frame(frame, timeout)
+
+    def missing_sensors(self, frame):
+        return self.__synchronizer.missing(frame)
+
     # ====================================== Vehicle Physics ======================================
 
     # Change the vehicle physics to a determined weather that is stated in the JSON file.
     def __change_vehicle_physics(self, weather_condition):
         # Read JSON file
-        physics_data = self.__read_vehicle_file(configuration.VEHICLE_PHYSICS_FILE)
+        mtime, physics_data = _read_json(configuration.VEHICLE_PHYSICS_FILE)
 
         # Check if the provided weather exists
         if weather_condition not in physics_data["weather_conditions"]:
             print(f"Weather physics configuration {weather_condition} does not exist!")
             return
 
+        # apply_physics_control rebuilds the physics of the vehicle, skip it if the profile is already applied
+        profile = (self.__vehicle.type_id, weather_condition, mtime)
+        if self.__active_physics == profile:
+            return
+
+        physics_control = _physics_cache.get(profile)
+        if physics_control is None:
+            physics_control = self.__build_physics_control(physics_data["weather_conditions"][weather_condition])
+            for key in [key for key in _physics_cache if key[2] != mtime]:
+                del _physics_cache[key]
+            _physics_cache[profile] = physics_control
+
+        self.__vehicle.apply_physics_control(physics_control)
+        self.__active_physics = profile
+        if configuration.VERBOSE:
+            print(f"Vehicle's physics changed to {weather_condition} weather")
+
+    def __build_physics_control(self, physics_data):
         physics_control = self.__vehicle.get_physics_control()
-        physics_data = physics_data["weather_conditions"][weather_condition]
 
         # Create Wheels Physics Control (This simulation assumes that wheels on the same axle have the same physics control)
         front_wheels  = carla.WheelPhysicsControl(tire_friction=physics_data["front_wheels"]["tire_friction"], 
@@ -195,9 +277,7 @@ class Vehicle:
         physics_control.wheels = wheels
         physics_control.mass = physics_data["vehicle"]["mass"]
         physics_control.drag_coefficient = physics_data["vehicle"]["drag_coefficient"]
-        self.__vehicle.apply_physics_control(physics_control)
-        if configuration.VERBOSE:
-            print(f"Vehicle's physics changed to {weather_condition} weather")
+        return physics_control
     
     def adapt_to_weather(self, weather_condition):
         # Change the vehicle physics depending on the weather condition
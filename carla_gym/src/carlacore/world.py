@@ -18,14 +18,15 @@ import carla_gym.src.config.configuration as config
 import time
 
 class World:
-    def __init__(self, client=None, synchronous_mode=False) -> None:
+    # host/port default to the ones in the configuration file, they can be changed to run several servers in the same machine
+    def __init__(self, client=None, synchronous_mode=False, host=None, port=None, tm_port=None) -> None:
         self.__client = client
         if self.__client is None:
-            self.__client = carla.Client(config.SIM_HOST, config.SIM_PORT)
+            self.__client = carla.Client(host or config.SIM_HOST, port or config.SIM_PORT)
             self.__client.set_timeout(config.SIM_TIMEOUT)
         self.__world = self.__client.get_world()
         self.__weather_control = WeatherControl(self.__world)
-        self.__traffic_control = TrafficControl(self.__world)
+        self.__traffic_control = TrafficControl(self.__world, tm_port or config.SIM_TM_PORT)
         self.__map_control     = MapControl(self.__world, self.__client)
         self.__map = self.__map_control.get_map()
         
@@ -48,8 +49,9 @@ class World:
     def set_timeout(self, timeout):
         self.__client.set_timeout(timeout)
     
+    # Returns the id of the simulation frame that was just computed
     def tick(self):
-        self.__world.tick()
+        return self.__world.tick()
 
     # ============ Weather Control ============
     # The output is a tuple (carla.WeatherPreset, Str: name of the weather preset)
@@ -85,15 +87,18 @@ class World:
     def print_available_maps(self):
         self.__map_control.print_available_maps()
 
+    # Returns True if the map was (re)loaded, False if the active one was kept
     def set_active_map(self, map_name, reload_map=False):
-        self.__map_control.set_active_map(map_name=map_name, reload_map=reload_map)
+        loaded = self.__map_control.set_active_map(map_name=map_name, reload_map=reload_map)
         self.__map = self.__map_control.get_map()
+        return loaded
     
     def change_map(self):
         self.__map_control.change_map()
     
     def reload_map(self):
         self.__map_control.reload_map()
+        self.__map = self.__map_control.get_map()
     
     # ============ Settings Control ============
     def set_settings(self):
@@ -8,14 +8,23 @@ BORDER_WIDTH            = 5
 
 # Vehicle and Sensors attributes
 SENSOR_FPS              = 30
+SENSOR_TIMEOUT          = 2.0 # Max seconds to wait for every sensor to deliver the data of a tick
 VERBOSE                 = False
 VEHICLE_SENSORS_FILE    = 'src/config/default_sensors.json'
 VEHICLE_PHYSICS_FILE    = 'src/config/default_vehicle_physics.json'
 VEHICLE_MODEL           = "vehicle.tesla.model3"
 
+# Sensor recording attributes (see src/carlacore/recorder.py)
+RECORD_DATA             = False
+RECORD_DIR              = 'data/recordings'
+RECORD_QUEUE_SIZE       = 256 # Max number of frames waiting to be written
+RECORD_CHUNK_SIZE       = 64  # Frames per file of each sensor
+RECORD_DROP_POLICY      = 'drop_newest' # What to do when the queue is full: 'drop_newest', 'drop_oldest' or 'block'
+
 # Simulation attributes
 SIM_HOST                = 'localhost'
 SIM_PORT                = 2000
+SIM_TM_PORT             = 8000 # Traffic Manager port (each server in the same machine needs its own)
 SIM_TIMEOUT             = 100.0
 SIM_LOW_QUALITY         = False
 SIM_OFFSCREEN_RENDERING = False
@@ -26,3 +35,4 @@ SIM_FPS                 = 30
 ENV_SCENARIOS_FILE      = 'src/config/default_scenarios.json'
 ENV_MAX_STEPS           = 430 # Max number of steps per episode. I suggest running the helpfull-scipts/check_max_num_steps.py script to get your number
 ENV_WAYPOINT_SPACING    = 7.0
+ENV_START_CLEARANCE     = 6.0 # Min distance (m) from a start to any vehicle for an agent of the multi-agent env to be restarted there
@@ -1,22 +1,95 @@
 import numpy as np
 
+try:
+  import torch
+except ImportError:
+  torch = None
+
+BACKENDS = ['numpy', 'torch']
+
 class FarthestSampler:
-  def __init__(self, dim=3):
+  '''
+  Farthest point sampling of k points out of n.
+
+  pts is a (dim, n) array, or a (batch, dim, n) array to sample the point clouds of several envs at once. The first
+  point is pts[..., seed_index]. When n <= k there is nothing to choose: every point is returned, in its original
+  order, and the indices are repeated cyclically up to k.
+
+  Backends:
+    - numpy: One vectorized step per sampled point over the whole batch (float32, about 2x faster than a float64 loop
+             for big clouds)
+    - torch: The same steps as torch operations, on the CPU or the GPU (device), useful for big batches
+  '''
+  def __init__(self, dim=3, seed_index=1, backend='numpy', device=None):
+    if backend not in BACKENDS:
+      raise ValueError(f"Unknown farthest point sampling backend {backend}, available: {BACKENDS}")
+    if backend == 'torch' and torch is None:
+      raise ValueError("The torch backend of the farthest point sampling needs torch")
     self.dim = dim
+    self.seed_index = int(seed_index)
+    self.backend = backend
+    self.device = device
 
   def calc_distances(self, p0, points):
     return ((p0 - points) ** 2).sum(axis=0)
 
   def sample(self, pts, k):
-    farthest_pts = np.zeros((self.dim, k))
-    farthest_pts_idx = np.zeros(k, dtype=int)
-    init_idx = 1
-    farthest_pts[:, 0] = pts[:, init_idx]
-    farthest_pts_idx[0] = init_idx
-    distances = self.calc_distances(farthest_pts[:, 0:1], pts)
-    for i in range(1, k):
-      idx = np.argmax(distances)
-      farthest_pts[:, i] = pts[:, idx]
-      farthest_pts_idx[i] = idx
-      distances = np.minimum(distances, self.calc_distances(farthest_pts[:, i:i+1], pts))
-    return farthest_pts, farthest_pts_idx
\ No newline at end of file
+    '''
+    Returns (farthest_pts, farthest_pts_idx): the (dim, k) sampled points and their (k,) indices, with a leading batch
+    dimension if pts has one.
+    '''
+    pts = np.asarray(pts)
+    batched = pts.ndim == 3
+    batch = pts if batched else pts[None]
+    n = batch.shape[2]
+
+    if n == 0:
+      farthest_pts_idx = np.zeros((batch.shape[0], k), dtype=np.intp)
+      farthest_pts = np.zeros(batch.shape[:2] + (k,), dtype=batch.dtype)
+      return (farthest_pts, farthest_pts_idx) if batched else (farthest_pts[0], farthest_pts_idx[0])
+
+    if n <= k:
+      farthest_pts_idx = np.broadcast_to(np.resize(np.arange(n), k), (batch.shape[0], k))
+    elif self.backend == 'torch':
+      farthest_pts_idx = self.__sample_torch(batch, k)
+    else:
+      farthest_pts_idx = self.__sample_numpy(batch, k)
+
+    farthest_pts = np.take_along_axis(batch, farthest_pts_idx[:, None, :], axis=2)
+    if batched:
+      return farthest_pts, farthest_pts_idx
+    return farthest_pts[0], farthest_pts_idx[0]
+
+  def __sample_numpy(self, batch, k):
+    # float32 and one contiguous (batch, n) array per coordinate, the steps are bound by memory bandwidth
+    points = np.ascontiguousarray(batch, dtype=np.float32)
+    rows = np.arange(points.shape[0])
+    farthest_pts_idx = np.empty((points.shape[0], k), dtype=np.intp)
+    farthest = np.full(points.shape[0], self.seed_index % points.shape[2], dtype=np.intp)
+    distances = np.full((points.shape[0], points.shape[2]), np.inf, dtype=np.float32)
+    new_distances = np.empty_like(distances)
+    diff = np.empty_like(distances)
+    for i in range(k):
+      farthest_pts_idx[:, i] = farthest
+      farthest_pts = points[rows, :, farthest]
+      new_distances.fill(0.0)
+      for d in range(points.shape[1]):
+        np.subtract(points[:, d, :], farthest_pts[:, d, None], out=diff)
+        np.multiply(diff, diff, out=diff)
+        np.add(new_distances, diff, out=new_distances)
+      np.minimum(distances, new_distances, out=distances)
+      farthest = distances.argmax(axis=1)
+    return farthest_pts_idx
+
+  def __sample_torch(self, batch, k):
+    with torch.no_grad():
+      points = torch.as_tensor(np.ascontiguousarray(batch, dtype=np.float32), device=self.device)
+      rows = torch.arange(points.shape[0], device=points.device)
+      farthest_pts_idx = torch.empty((points.shape[0], k), dtype=torch.long, device=points.device)
+      farthest = torch.full((points.shape[0],), self.seed_index % points.shape[2], dtype=torch.long, device=points.device)
+      distances = torch.full((points.shape[0], points.shape[2]), float('inf'), device=points.device)
+      for i in range(k):
+        farthest_pts_idx[:, i] = farthest
+        torch.minimum(distances, ((points - points[rows, :, farthest][:, :, None]) ** 2).sum(dim=1), out=distances)
+        farthest = distances.argmax(dim=1)
+    return farthest_pts_idx.cpu().numpy()
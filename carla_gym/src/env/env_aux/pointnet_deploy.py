@@ -0,0 +1,124 @@
+'''
+PointNet Deployment Module:
+    CPU inference variants of a trained PointNetfeat (point_net.py) for the rollout workers. They only compute the
+    global features (what PointNetEncoder observes) and can be compared with the float model with
+    helpful-scripts/pointnet_deploy_report.py.
+
+    - Every BatchNorm (in eval mode, with its running statistics) is folded into the weights of the layer before it
+    - The 1x1 Conv1d layers become nn.Linear over (batch, points, channels) clouds, the same product but in the layout
+      of the Linear kernels and of dynamic quantization
+    - The STN transforms can be dropped (the identity is used, the features change, see the report)
+    - The Linear layers can be dynamically quantized to int8 (int8 weights, activations quantized on the fly)
+
+    Variants (VARIANTS):
+        - 'float':       The original PointNetfeat in eval mode
+        - 'folded':      BatchNorm folded, 1x1 convs as Linear (same features up to float rounding)
+        - 'folded_int8': 'folded' with int8 dynamic quantization
+        - 'no_stn':      'folded' without the STN transforms
+        - 'no_stn_int8': 'no_stn' with int8 dynamic quantization
+'''
+
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+GLOBAL_FEATURES = 1024
+VARIANTS = ['float', 'folded', 'folded_int8', 'no_stn', 'no_stn_int8']
+
+
+def fold_batchnorm(layer, bn):
+    '''
+    Returns an nn.Linear equivalent to bn(layer(x)) in eval mode. layer is an nn.Linear or a Conv1d with kernel size 1
+    (its weight is used as the (out, in) matrix of the Linear).
+    '''
+    weight = layer.weight.detach().reshape(layer.weight.shape[0], -1)
+    bias = layer.bias.detach() if layer.bias is not None else torch.zeros(weight.shape[0])
+    linear = nn.Linear(weight.shape[1], weight.shape[0])
+    with torch.no_grad():
+        if bn is None:
+            linear.weight.copy_(weight)
+            linear.bias.copy_(bias)
+        else:
+            scale = bn.weight.detach() / torch.sqrt(bn.running_var + bn.eps)
+            linear.weight.copy_(weight * scale[:, None])
+            linear.bias.copy_((bias - bn.running_mean) * scale + bn.bias.detach())
+    return linear
+
+
+class _FoldedSTN(nn.Module):
+    # STN3d/STNkd with the BatchNorm folded, on (batch, points, k) clouds
+    def __init__(self, stn, k):
+        super(_FoldedSTN, self).__init__()
+        self.k = k
+        self.layer1 = fold_batchnorm(stn.conv1, stn.bn1)
+        self.layer2 = fold_batchnorm(stn.conv2, stn.bn2)
+        self.layer3 = fold_batchnorm(stn.conv3, stn.bn3)
+        self.fc1 = fold_batchnorm(stn.fc1, stn.bn4)
+        self.fc2 = fold_batchnorm(stn.fc2, stn.bn5)
+        self.fc3 = fold_batchnorm(stn.fc3, None)
+        self.register_buffer('identity', torch.eye(k).flatten())
+
+    def forward(self, x):
+        x = F.relu(self.layer1(x))
+        x = F.relu(self.layer2(x))
+        x = F.relu(self.layer3(x))
+        x = torch.max(x, 1)[0]
+        x = F.relu(self.fc1(x))
+        x = F.relu(self.fc2(x))
+        x = self.fc3(x) + self.identity
+        return x.view(-1, self.k, self.k)
+
+
+class FoldedPointNetfeat(nn.Module):
+    '''
+    Global features of a PointNetfeat with the BatchNorm folded and the 1x1 convs as Linear layers. The input is the
+    same (batch, 3, points) cloud, the output the (batch, 1024) global features.
+    '''
+    def __init__(self, pointnet, use_stn=True):
+        super(FoldedPointNetfeat, self).__init__()
+        self.stn = _FoldedSTN(pointnet.stn, 3) if use_stn else None
+        self.fstn = _FoldedSTN(pointnet.fstn, 64) if use_stn and pointnet.feature_transform else None
+        self.layer1 = fold_batchnorm(pointnet.conv1, pointnet.bn1)
+        self.layer2 = fold_batchnorm(pointnet.conv2, pointnet.bn2)
+        self.layer3 = fold_batchnorm(pointnet.conv3, pointnet.bn3)
+
+    def forward(self, x):
+        x = x.transpose(2, 1)
+        if self.stn is not None:
+            x = torch.bmm(x, self.stn(x))
+        x = F.relu(self.layer1(x))
+        if self.fstn is not None:
+            x = torch.bmm(x, self.fstn(x))
+        x = F.relu(self.layer2(x))
+        x = self.layer3(x)
+        return torch.max(x, 1)[0]
+
+
+class _FloatPointNetfeat(nn.Module):
+    # The original network, returning only the global features like FoldedPointNetfeat
+    def __init__(self, pointnet):
+        super(_FloatPointNetfeat, self).__init__()
+        self.pointnet = pointnet
+
+    def forward(self, x):
+        return self.pointnet(x)[0]
+
+
+def build_variant(pointnet, variant):
+    '''
+    Returns the eval mode module of the given variant of pointnet (a global feature PointNetfeat, it isn't modified).
+    The module maps (batch, 3, points) clouds to their (batch, 1024) global features.
+    '''
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown PointNet variant {variant}, available: {VARIANTS}")
+    if not pointnet.global_feat:
+        raise ValueError("Only the global features of PointNet can be deployed")
+    pointnet = copy.deepcopy(pointnet).eval()
+    if variant == 'float':
+        return _FloatPointNetfeat(pointnet).eval()
+
+    model = FoldedPointNetfeat(pointnet, use_stn=not variant.startswith('no_stn')).eval()
+    if variant.endswith('_int8'):
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    return model
@@ -0,0 +1,97 @@
+'''
+PointNet Encoder Module:
+    It turns the sampled LiDAR points of the observation, (3, n) per env, into a compact feature vector with the
+    PointNetfeat network of point_net.py, so the agent (and its replay buffer) receives a few floats instead of the
+    point cloud.
+
+    The network only runs inference: eval mode (BatchNorm with its running statistics), torch.inference_mode, an
+    optional TorchScript trace (frozen) and a fixed number of CPU threads. The clouds of several envs are encoded in a
+    single batched call.
+
+    The 1024 global features can be reduced with a linear projection: the 'projection' entry of the checkpoint if it
+    has one, otherwise a fixed random Gaussian projection (seeded, so every process computes the same features).
+
+    The network can be any of the deployment variants of pointnet_deploy.py (BatchNorm folded, int8, without STN).
+'''
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from carla_gym.src.env.env_aux.point_net import PointNetfeat
+from carla_gym.src.env.env_aux.pointnet_deploy import GLOBAL_FEATURES, build_variant
+
+
+class _GlobalFeatures(nn.Module):
+    # The global features of the deployment variant followed by the optional projection
+    def __init__(self, features, projection=None):
+        super(_GlobalFeatures, self).__init__()
+        self.features = features
+        self.projection = projection
+
+    def forward(self, x):
+        features = self.features(x)
+        if self.projection is not None:
+            features = self.projection(features)
+        return features
+
+
+class PointNetEncoder:
+    def __init__(self, checkpoint=None, num_points=500, projection_dim=None, num_threads=None, trace=True, device='cpu', seed=0,
+                 variant='float'):
+        '''
+        checkpoint: Path of a state dict of PointNetfeat (or a dict with it in 'state_dict'/'model' and, optionally, the
+                    weight of the projection in 'projection'). None keeps the random initialization
+        num_points: Points per cloud (used to trace the network)
+        projection_dim: Size of the output features, None for the 1024 global features
+        num_threads: torch CPU threads (None keeps the torch default)
+        variant: Deployment variant of the network (pointnet_deploy.VARIANTS), the int8 ones only run on the CPU
+        '''
+        if variant.endswith('_int8') and torch.device(device).type != 'cpu':
+            raise ValueError(f"The PointNet variant {variant} only runs on the CPU")
+        if num_threads is not None:
+            torch.set_num_threads(int(num_threads))
+        self.device = torch.device(device)
+        self.num_points = int(num_points)
+
+        pointnet = PointNetfeat(global_feat=True)
+        projection_weight = None
+        if checkpoint is not None:
+            state = torch.load(checkpoint, map_location='cpu')
+            if isinstance(state, dict) and ('state_dict' in state or 'model' in state):
+                projection_weight = state.get('projection')
+                state = state.get('state_dict', state.get('model'))
+            pointnet.load_state_dict(state)
+
+        projection = None
+        if projection_dim is not None:
+            projection = nn.Linear(GLOBAL_FEATURES, int(projection_dim), bias=False)
+            with torch.no_grad():
+                if projection_weight is not None:
+                    projection.weight.copy_(torch.as_tensor(projection_weight))
+                else:
+                    generator = torch.Generator().manual_seed(seed)
+                    projection.weight.copy_(torch.randn(int(projection_dim), GLOBAL_FEATURES, generator=generator) / np.sqrt(projection_dim))
+        self.feature_dim = GLOBAL_FEATURES if projection_dim is None else int(projection_dim)
+
+        model = _GlobalFeatures(build_variant(pointnet, variant), projection).to(self.device).eval()
+        for parameter in model.parameters():
+            parameter.requires_grad_(False)
+        if trace:
+            with torch.no_grad():
+                # Batch of 2 so the batch size stays dynamic in the trace
+                example = torch.zeros((2, 3, self.num_points), device=self.device)
+                model = torch.jit.freeze(torch.jit.trace(model, example))
+        self.__model = model
+
+    def encode(self, clouds):
+        '''
+        clouds: (3, n) or (N, 3, n) array of points
+        Returns the (feature_dim,) or (N, feature_dim) float32 features.
+        '''
+        clouds = np.asarray(clouds, dtype=np.float32)
+        batched = clouds.ndim == 3
+        batch = torch.from_numpy(np.ascontiguousarray(clouds if batched else clouds[None])).to(self.device)
+        with torch.inference_mode():
+            features = self.__model(batch).cpu().numpy()
+        return features if batched else features[0]
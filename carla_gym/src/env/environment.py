@@ -53,6 +53,7 @@ register(
 from carla_gym.src.carlacore.world import World
 from carla_gym.src.carlacore.server import CarlaServer
 from carla_gym.src.carlacore.vehicle import Vehicle
+from carla_gym.src.carlacore.recorder import SensorRecorder
 from carla_gym.src.carlacore.display import Display
 from carla_gym.src.env.reward import Reward
 import carla_gym.src.env.observation_action_space
@@ -62,7 +63,7 @@ from carla_gym.src.env.pre_processing import PreProcessing
 # Name: 'carla_rl-gym-v0'
 class CarlaEnv(gym.Env):
     metadata = {"render_modes": ["human"], "render_fps": config.SIM_FPS}
-    def __init__(self, continuous=True, scenarios=[], time_limit=60, initialize_server=True, random_weather=False, random_traffic=False, synchronous_mode=True, show_sensor_data=False, has_traffic=True, apply_physics=True, autopilot=False, verbose=True):
+    def __init__(self, continuous=True, scenarios=[], time_limit=60, initialize_server=True, random_weather=False, random_traffic=False, synchronous_mode=True, show_sensor_data=False, has_traffic=True, apply_physics=True, autopilot=False, verbose=True, sim_host=None, sim_port=None, action_repeat=1, persistent_rig=False, sim_streaming_port=None, tm_port=None):
         super().__init__()
         # Read the environment settings
         self.__is_continuous = continuous
@@ -75,24 +76,40 @@ class CarlaEnv(gym.Env):
         self.__apply_physics = apply_physics
         self.__autopilot = autopilot
         self.__verbose = verbose
+        self.__sim_host = sim_host
+        self.__sim_port = sim_port
+        self.__sim_streaming_port = sim_streaming_port
+        self.__tm_port = tm_port
+        # Number of ticks each action is applied for (it can be overwritten in each step call)
+        self.action_repeat = action_repeat
+        # Keep the ego vehicle and its sensors between episodes on the same map (it is teleported instead of respawned)
+        self.__persistent_rig = persistent_rig
 
         # 1. Start the server
+        self.__server_process = None
         if self.__automatic_server_initialization:
-            self.__server_process = CarlaServer.initialize_server(low_quality = config.SIM_LOW_QUALITY, offscreen_rendering = config.SIM_OFFSCREEN_RENDERING)
+            self.__server_process = CarlaServer.initialize_server(low_quality = config.SIM_LOW_QUALITY, offscreen_rendering = config.SIM_OFFSCREEN_RENDERING, port = self.__sim_port, streaming_port = self.__sim_streaming_port)
         
         if config.SIM_OFFSCREEN_RENDERING:
             self.__show_sensor_data = False
         
         # 2. Connect to the server
-        self.__world = World(synchronous_mode=self.__synchronous_mode)
+        self.__world = World(synchronous_mode=self.__synchronous_mode, host=self.__sim_host, port=self.__sim_port, tm_port=self.__tm_port)
 
         # 3. Read the flag and get the appropriate situations
         self.__get_situations(scenarios)
-        # 4. Create the vehicle
-        self.__vehicle = Vehicle(self.__world.get_world())
-
-        # 5. Observation space:
-        self.obs_space = carla_gym.src.env.observation_action_space.obs_space
+        # 4. Create the vehicle (and the recorder of its sensor data)
+        self.__recorder = None
+        if config.RECORD_DATA:
+            # Each env (and each run) records in its own directory, named after the port of its server
+            self.__recorder = SensorRecorder(config.RECORD_DIR, queue_size=config.RECORD_QUEUE_SIZE, chunk_size=config.RECORD_CHUNK_SIZE, drop_policy=config.RECORD_DROP_POLICY,
+                                             name=f'port{self.__sim_port if self.__sim_port is not None else config.SIM_PORT}')
+        self.__vehicle = Vehicle(self.__world.get_world(), recorder=self.__recorder)
+
+        # 5. Observation space (with the channels of the optional sensors of the vehicle):
+        self.obs_space = carla_gym.src.env.observation_action_space.build_obs_space(self.__vehicle.read_sensors_file())
+        self.__sensor_channels = [key for key in self.obs_space.spaces if key not in carla_gym.src.env.observation_action_space.obs_space.spaces]
+        self.observation_space = self.obs_space
         self.__observation = None
         self.pre_processing = PreProcessing()
 
@@ -103,6 +120,7 @@ class CarlaEnv(gym.Env):
         else:
             # For discrete actions
             self.act_space = carla_gym.src.env.observation_action_space.discrete_act_space
+        self.action_space = self.act_space
         
         # Truncated flag
         self.__time_limit = time_limit
@@ -118,21 +136,31 @@ class CarlaEnv(gym.Env):
 
         # Auxiliar variables
         self.__first_episode = True
+        self.__last_frame = None # Simulation frame of the last tick, the sensors are waited for it before building the observation
         self.__episode_number = 0
         self.__restart_every = 1000 # Reload every n episodes so it doesn't crash
+        self.reset_timings = {}     # Time (ms) of each stage of the last reset, also in its info
+        self.__last_mark = None
+        self.__clean_time = 0.0     # Time (ms) of the clean_scenario at the end of the last episode
+        self.__map_loaded = False   # The last load_scenario (re)loaded the map instead of reusing the world
         
     # ===================================================== GYM METHODS =====================================================                
     # This reset loads a random scenario and returns the initial state plus information about the scenario
-    # Options may include the name of the scenario to load    
-    def reset(self, seed=None, options={'scenario_name': None}):
+    # Options may include the name of the scenario to load (the gym.make wrappers and the vector envs pass options=None)
+    def reset(self, seed=None, options=None):
+        self.reset_timings = {'clean': self.__clean_time}
+        self.__last_mark = reset_start = time.perf_counter()
         # 1. Choose a scenario
-        if options['scenario_name'] is not None:
+        options = options or {}
+        if options.get('scenario_name') is not None:
             self.__active_scenario_name = options['scenario_name']
         else:
             self.__active_scenario_name = self.__chose_situation(seed)
         
         # 2. Load the scenario
         print(f"Loading scenario {self.__active_scenario_name}...")
+        if self.__recorder is not None:
+            self.__recorder.start_episode(self.__episode_number + 1)
         try:
             self.load_scenario(self.__active_scenario_name, seed)
         except KeyboardInterrupt as e:
@@ -153,10 +181,15 @@ class CarlaEnv(gym.Env):
             self.draw_waypoints(self.__waypoints)
         # Turn each waypoint into a list of 3 elements
         self.__waypoints = [np.array([w.x, w.y, w.z]) for w in self.__waypoints]
+        self.__mark_reset_stage('waypoints')
         
-        # 4. Get the initial state (Get the observation data)
-        time.sleep(0.5)
+        # 4. Get the initial state (Get the observation data) once the sensors delivered the last tick of the scenario loading
+        self.__wait_for_sensors(self.__last_frame)
+        self.__mark_reset_stage('sensors')
+        self.__update_reward_state()
         self.__update_observation()
+        self.__mark_reset_stage('observation')
+        self.reset_timings['total'] = 1000.0 * (time.perf_counter() - reset_start)
         
         # 5. Start the reward function
         self.__reward_func.reset(self.__waypoints)
@@ -170,6 +203,8 @@ class CarlaEnv(gym.Env):
         info = {
             'scenario_name': self.__active_scenario_name,
             'waypoints': self.__waypoints,
+            'map_loaded': self.__map_loaded,
+            'reset_timings': dict(self.reset_timings),
         }
         
         self.number_of_steps = 0
@@ -183,35 +218,50 @@ class CarlaEnv(gym.Env):
         else:
             raise NotImplementedError("This mode is not implemented yet")
 
-    def step(self, action):
-        # 0. Tick the world if in synchronous mode
-        if self.__synchronous_mode:
+    # The action is applied during `repeat` ticks (action_repeat by default), the rewards of every tick are summed and the observation is only built after the last one.
+    # It stops earlier if the episode ends in the middle of the repetitions.
+    def step(self, action, repeat=None):
+        repeat = self.action_repeat if repeat is None else repeat
+        action = np.array(action)
+        reward = 0.0
+        terminated = False
+        for tick in range(max(1, int(repeat))):
+            # 0. Tick the world if in synchronous mode
+            if self.__synchronous_mode:
+                try:
+                    self.__last_frame = self.__world.tick()
+                except KeyboardInterrupt:
+                    self.clean_scenario()
+                    print("Episode interrupted!")
+                    exit(0)
+            self.number_of_steps += 1
+            # 1. Control the vehicle
+            self.__control_vehicle(action)
+            # 1.5 Tick the display if it is active
+            if self.__show_sensor_data:
+                self.display.play_window_tick()
+            # 2. Update the state used by the reward function (the sensors are only read once, after the last tick)
+            self.__update_reward_state()
+            # 3. Calculate the reward
+            reward += self.__reward_func.calculate_reward(self.__vehicle, self.__reward_current_pos, self.__reward_target_pos, self.__reward_next_waypoint_pos, self.__reward_speed)
+            terminated = self.__reward_func.get_terminated()
+            self.__waypoints = self.__reward_func.get_waypoints()
+            
+            # 4. Check if the episode is truncated
             try:
-                self.__world.tick()
+                self.__truncated = self.__timer_truncated()
             except KeyboardInterrupt:
                 self.clean_scenario()
                 print("Episode interrupted!")
                 exit(0)
-        self.number_of_steps += 1
-        # 1. Control the vehicle
-        self.__control_vehicle(np.array(action))
-        # 1.5 Tick the display if it is active
-        if self.__show_sensor_data:
-            self.display.play_window_tick()
-        # 2. Update the observation
+            if self.__truncated or terminated:
+                break
+        
+        # 5. Update the observation (with the sensor data of the last tick)
+        if self.__synchronous_mode:
+            self.__wait_for_sensors(self.__last_frame)
         self.__update_observation()
-        # 3. Calculate the reward
-        reward = self.__reward_func.calculate_reward(self.__vehicle, self.__reward_current_pos, self.__reward_target_pos, self.__reward_next_waypoint_pos, self.__reward_speed)
-        terminated = self.__reward_func.get_terminated()
-        self.__waypoints = self.__reward_func.get_waypoints()
         
-        # 5. Check if the episode is truncated
-        try:
-            self.__truncated = self.__timer_truncated()
-        except KeyboardInterrupt:
-            self.clean_scenario()
-            print("Episode interrupted!")
-            exit(0)
         if self.__truncated or terminated:
             print(f"Episode ended with reward {self.__reward_func.get_total_ep_reward()}.")
             self.clean_scenario()
@@ -221,6 +271,7 @@ class CarlaEnv(gym.Env):
         info = {
             'scenario_name': self.__active_scenario_name,
             'waypoints': self.__waypoints,
+            'repeat_steps': tick + 1,
         }
         
         return self.__observation, reward, terminated, self.__truncated, info
@@ -244,13 +295,14 @@ class CarlaEnv(gym.Env):
         # 4. Close the server
         if self.__automatic_server_initialization:
             CarlaServer.close_server(self.__server_process)
+        # 5. Write the data that is still being recorded
+        if self.__recorder is not None:
+            self.__recorder.close()
 
 
     # ===================================================== OBSERVATION/ACTION METHODS =====================================================
-    def __update_observation(self):        
-        obs_space = self.__vehicle.get_observation_data()
-        rgb_image = obs_space['rgb_data']
-        lidar_data = obs_space['lidar_data']
+    # Updates the vehicle state used by the reward function. It is cheap (no sensor data), so it is called every tick.
+    def __update_reward_state(self):
         vehicle_loc = self.__vehicle.get_location()
         current_position = np.array([vehicle_loc.x, vehicle_loc.y, vehicle_loc.z])
         target_position = np.array([self.__active_scenario_dict['target_position']['x'], self.__active_scenario_dict['target_position']['y'], self.__active_scenario_dict['target_position']['z']])
@@ -259,25 +311,43 @@ class CarlaEnv(gym.Env):
         except IndexError:
             next_waypoint_position = np.array([0.0, 0.0, 0.0])
         speed = np.array([self.__vehicle.get_speed()])
+        
+        # Aux variables for the reward function so the information that is given to the ego vehicle and to the reward function is the same no matter what happens
+        self.__reward_target_pos = target_position
+        self.__reward_current_pos = current_position
+        self.__reward_next_waypoint_pos = next_waypoint_position
+        self.__reward_speed = speed[0]
+
+    # Waits until every streaming sensor delivered the given frame, so the camera and the LiDAR of the observation belong to the same tick
+    def __wait_for_sensors(self, frame):
+        if frame is None:
+            return
+        if not self.__vehicle.wait_for_sensors(frame, timeout=config.SENSOR_TIMEOUT):
+            print(f"Sensors {self.__vehicle.missing_sensors(frame)} didn't deliver frame {frame} in {config.SENSOR_TIMEOUT} seconds, using their last data")
+
+    # Builds the observation from the sensors and the state of the last __update_reward_state call
+    def __update_observation(self):        
+        obs_space = self.__vehicle.get_observation_data()
+        rgb_image = obs_space['rgb_data']
+        # The bird's-eye-view grid is built from the full point cloud instead of the 500 points of the sensor
+        lidar_data = obs_space['lidar_points'] if self.pre_processing.lidar_representation == 'bev' else obs_space['lidar_data']
         situation = self.__situations_map[self.__active_scenario_dict['situation']]
 
         observation = {
-            'rgb_data': np.uint8(rgb_image),
+            # The sensors hand out one of their two buffers, which they overwrite two frames later, so the observation gets a copy
+            'rgb_data': np.array(rgb_image, dtype=np.uint8),
             'lidar_data': np.float32(lidar_data),
-            'position': np.float32(current_position),
-            'target_position': np.float32(target_position),
-            'next_waypoint_position': np.float32(next_waypoint_position),
-            'speed': np.float32(speed),
+            'position': np.float32(self.__reward_current_pos),
+            'target_position': np.float32(self.__reward_target_pos),
+            'next_waypoint_position': np.float32(self.__reward_next_waypoint_pos),
+            'speed': np.float32([self.__reward_speed]),
             'situation': situation
         }
+        # GNSS, IMU and radar arrays are already packed by the sensors with the shape and dtype of the observation space
+        for key in self.__sensor_channels:
+            observation[key] = np.array(obs_space[key])
         
         self.__observation = self.pre_processing.preprocess_data(observation)
-        
-        # Aux variables for the reward function so the information that is given to the ego vehicle and to the reward function is the same no matter what happens
-        self.__reward_target_pos = target_position
-        self.__reward_current_pos = current_position
-        self.__reward_next_waypoint_pos = next_waypoint_position
-        self.__reward_speed = speed[0]
 
 
     # ===================================================== SCENARIO METHODS =====================================================
@@ -294,23 +364,30 @@ class CarlaEnv(gym.Env):
          
         # World
         # This is a fix to a weird bug that happens when the first town is the same as the default map (comment and run a couple of times to see the bug)
+        self.__map_loaded = False
         if self.__first_episode and self.__active_scenario_dict['map_name'] == self.__world.get_active_map_name():
             self.__world.reload_map()
+            self.__map_loaded = True
         self.__first_episode = False
         
-        self.__load_world(scenario_dict['map_name'])
+        # Loading another map destroys every actor, a persistent rig can only be kept on the same map
+        if self.__vehicle.is_spawned() and scenario_dict['map_name'] != self.__world.get_active_map_name():
+            self.__vehicle.destroy_vehicle()
+        # The world is reused when the map doesn't change, a new map is ready once the server simulates a frame of it
+        self.__map_loaded = self.__load_world(scenario_dict['map_name']) or self.__map_loaded
         self.__map = self.__world.update_traffic_map()
-        time.sleep(2.0)
         if self.__verbose:
-            print("World loaded!")
+            print("World loaded!" if self.__map_loaded else "World reused!")
         
         # Settings
         self.__world.set_settings()
+        self.__mark_reset_stage('world')
         
         # Weather
         self.__load_weather(scenario_dict['weather_condition'])
         if self.__verbose:
             print(self.__world.get_active_weather(), " weather preset loaded!")
+        self.__mark_reset_stage('weather')
         
         # Ego vehicle
         self.__spawn_vehicle(scenario_dict)
@@ -325,6 +402,7 @@ class CarlaEnv(gym.Env):
             self.__vehicle.adapt_to_weather(scenario_dict['weather_condition'])
             if self.__verbose:
                 print("Physics applied!")
+        self.__mark_reset_stage('vehicle')
             
         # Traffic
         if self.__has_traffic:
@@ -333,11 +411,14 @@ class CarlaEnv(gym.Env):
             if self.__verbose:
                 print("Traffic spawned!")
         self.__toggle_lights()
+        self.__mark_reset_stage('traffic')
         
-        # Tick the world to make sure everything is loaded
-        self.__world.tick()
+        # Tick the world so the spawned actors are placed and the sensors deliver this frame (reset waits for it)
+        self.__last_frame = self.__world.tick()
+        self.__mark_reset_stage('tick')
 
     def clean_scenario(self):
+        clean_start = time.perf_counter()
         # If synchronous mode is on, make it unsynchronous to destroy the vehicle
         if self.__synchronous_mode:
             settings = self.__world.get_world().get_settings()
@@ -345,13 +426,21 @@ class CarlaEnv(gym.Env):
             settings.fixed_delta_seconds = None
             self.__world.get_world().apply_settings(settings)
         
-        self.__vehicle.destroy_vehicle()
+        # The persistent rig is only parked, unless the map is going to be reloaded
+        reload_map = self.__episode_number % self.__restart_every == 0
+        if self.__persistent_rig and not reload_map and self.__vehicle.is_spawned():
+            self.__vehicle.stop()
+        else:
+            self.__vehicle.destroy_vehicle()
         self.__world.destroy_vehicles()
         self.__world.destroy_pedestrians()
+        if self.__recorder is not None:
+            self.__recorder.end_episode()
         
-        if self.__episode_number % self.__restart_every == 0:
+        if reload_map:
             self.__world.set_timeout(4.0)
             self.__world.reload_map()
+        self.__clean_time = 1000.0 * (time.perf_counter() - clean_start)
             
         if self.__verbose:
             print("Scenario cleaned!")
@@ -360,12 +449,16 @@ class CarlaEnv(gym.Env):
         for idx, i in enumerate(self.situations_list):
             print(idx, ": ", i)
     
+    # Returns True if the map was loaded, False if the current world was reused
     def __load_world(self, name):
-        self.__world.set_active_map(name)
+        return self.__world.set_active_map(name)
         
     def __spawn_vehicle(self, s_dict):
         location = (s_dict['initial_position']['x'], s_dict['initial_position']['y'], s_dict['initial_position']['z'])
         rotation = (s_dict['initial_rotation']['pitch'], s_dict['initial_rotation']['yaw'], s_dict['initial_rotation']['roll'])
+        if self.__persistent_rig and self.__vehicle.is_spawned():
+            self.__vehicle.teleport(location, rotation)
+            return
         try:
             self.__vehicle.spawn_vehicle(location, rotation)
         except Exception as e:
@@ -451,6 +544,13 @@ class CarlaEnv(gym.Env):
     
     def __start_timer(self):
         self.start_time = time.time()
+
+    # Adds the time since the last mark to a stage of reset_timings (load_scenario can run more than once in a reset)
+    def __mark_reset_stage(self, stage):
+        now = time.perf_counter()
+        if self.__last_mark is not None:
+            self.reset_timings[stage] = self.reset_timings.get(stage, 0.0) + 1000.0 * (now - self.__last_mark)
+        self.__last_mark = now
     
     def get_path_waypoints(self, spacing=5.0):
         current_location = self.__vehicle.get_location()
@@ -473,6 +573,10 @@ class CarlaEnv(gym.Env):
     
     def get_vehicle(self):
         return self.__vehicle
+
+    # Process of the server started by the environment (None if initialize_server is False)
+    def get_server_process(self):
+        return self.__server_process
         
     # ===================================================== DEBUG METHODS =====================================================
     def place_spectator_above_vehicle(self):
@@ -0,0 +1,426 @@
+'''
+Multi-agent vector environment for the carla environment.
+
+Instead of one CARLA server and world per ego vehicle (one CarlaEnv per env of a vector env), N ego vehicles are spawned
+in the same world, each one with its own sensors, Reward instance, scenario start and target. A single world.tick()
+advances all of them, so one server produces N samples per tick.
+
+It follows the gymnasium VectorEnv API:
+ - reset: loads the map, weather and traffic of a scenario and spawns every agent at the start of a scenario of that map
+ - step: takes the (N, ...) actions and returns the stacked observations, rewards, terminated and truncated flags and infos
+ - close: destroys the agents and the traffic and closes the server
+
+Auto-reset (AutoresetMode.NEXT_STEP): when the episode of an agent ends, its vehicle is teleported to the start of
+another scenario of the same map right away, and the next step (the action of that agent is ignored) returns its first
+observation, with a reward of 0. The other agents keep driving, the world is never reloaded by a single agent.
+
+Observation and action spaces are the ones of CarlaEnv (single_observation_space/single_action_space), the observations
+of every agent are pre-processed together with PreProcessing.preprocess_batch.
+'''
+
+import time
+import random
+import json
+import numpy as np
+import carla
+
+import gymnasium as gym
+from gymnasium.vector import AutoresetMode
+from gymnasium.vector.utils import batch_space
+import carla_gym.src.config.configuration as config
+
+from carla_gym.src.carlacore.world import World
+from carla_gym.src.carlacore.server import CarlaServer
+from carla_gym.src.carlacore.vehicle import Vehicle
+from carla_gym.src.env.reward import Reward
+import carla_gym.src.env.observation_action_space
+
+from carla_gym.src.env.pre_processing import PreProcessing
+
+
+# State of one ego vehicle of the multi-agent environment
+class EgoAgent:
+    def __init__(self, world):
+        self.vehicle = Vehicle(world)
+        self.reward_func = Reward()
+        self.scenario_name = None
+        self.scenario_dict = None
+        self.waypoints = None
+        self.start_location = None
+        self.start_time = None
+        self.needs_reset = False    # The episode ended, the next step returns its first observation
+        # State used by the reward function and the observation (see MultiAgentCarlaEnv.__update_reward_state)
+        self.current_pos = None
+        self.target_pos = None
+        self.next_waypoint_pos = None
+        self.speed = 0.0
+
+
+class MultiAgentCarlaEnv(gym.vector.VectorEnv):
+    metadata = {"autoreset_mode": AutoresetMode.NEXT_STEP, "render_fps": config.SIM_FPS}
+
+    def __init__(self, num_agents=2, continuous=True, scenarios=[], time_limit=60, initialize_server=True, random_weather=False, random_traffic=False, has_traffic=True, apply_physics=True, verbose=True, sim_host=None, sim_port=None, action_repeat=1, copy=True, sim_streaming_port=None, tm_port=None):
+        super().__init__()
+        # Read the environment settings (the world is always synchronous, one tick advances every agent)
+        self.num_envs = num_agents
+        self.__is_continuous = continuous
+        self.__automatic_server_initialization = initialize_server
+        self.__random_weather = random_weather
+        self.__random_traffic = random_traffic
+        self.__has_traffic = has_traffic
+        self.__apply_physics = apply_physics
+        self.__verbose = verbose
+        self.__sim_port = sim_port
+        self.__time_limit = time_limit
+        # Number of ticks each action is applied for (it can be overwritten in each step call)
+        self.action_repeat = action_repeat
+        # Return copies of the observations, the pre-processing buffers are reused by the next step
+        self.copy = copy
+
+        # 1. Start the server
+        if self.__automatic_server_initialization:
+            self.__server_process = CarlaServer.initialize_server(low_quality = config.SIM_LOW_QUALITY, offscreen_rendering = config.SIM_OFFSCREEN_RENDERING, port = self.__sim_port, streaming_port = sim_streaming_port)
+
+        # 2. Connect to the server
+        self.__world = World(synchronous_mode=True, host=sim_host, port=sim_port, tm_port=tm_port)
+
+        # 3. Read the flag and get the appropriate situations
+        self.__get_situations(scenarios)
+
+        # 4. Create the agents
+        self.__agents = [EgoAgent(self.__world.get_world()) for _ in range(num_agents)]
+
+        # 5. Observation space (with the channels of the optional sensors of the vehicle) and action space
+        self.single_observation_space = carla_gym.src.env.observation_action_space.build_obs_space(self.__agents[0].vehicle.read_sensors_file())
+        self.__sensor_channels = [key for key in self.single_observation_space.spaces if key not in carla_gym.src.env.observation_action_space.obs_space.spaces]
+        if self.__is_continuous:
+            self.single_action_space = carla_gym.src.env.observation_action_space.continuous_act_space
+        else:
+            self.single_action_space = carla_gym.src.env.observation_action_space.discrete_act_space
+        self.observation_space = batch_space(self.single_observation_space, self.num_envs)
+        self.action_space = batch_space(self.single_action_space, self.num_envs)
+        self.pre_processing = PreProcessing()
+
+        # Variables to store the current state
+        self.__map = None
+        self.__map_scenarios = []   # Names of the scenarios of the active map
+        self.__scenario_dict = None # Scenario that chose the map, weather and traffic
+        self.__situations_map = carla_gym.src.env.observation_action_space.situations_map
+        self.__rng = np.random.default_rng()
+
+        # Auxiliar variables
+        self.__first_episode = True
+        self.__last_frame = None
+        self.__episode_number = 0
+
+    # ===================================================== GYM METHODS =====================================================
+    # Loads the world of a scenario (options may include its name) and places every agent at the start of a scenario of that map
+    def reset(self, *, seed=None, options=None):
+        if seed is not None:
+            self.__rng = np.random.default_rng(seed)
+        options = options or {}
+        scenario_name = options.get('scenario_name')
+        if scenario_name not in self.situations_dict:
+            scenario_name = self.situations_list[self.__rng.integers(len(self.situations_list))]
+
+        print(f"Loading scenario {scenario_name} for {self.num_envs} agents...")
+        self.__load_world(scenario_name, seed)
+        print("Scenario loaded!")
+        self.__world.place_spectator_above_location(self.__agents[0].vehicle.get_location())
+
+        # Initial observation once the sensors of every agent delivered the last tick of the loading
+        self.__wait_for_sensors(self.__last_frame)
+        for agent in self.__agents:
+            self.__update_reward_state(agent)
+        self.__episode_number += 1
+
+        infos = {}
+        for i, agent in enumerate(self.__agents):
+            infos = self._add_info(infos, {'scenario_name': agent.scenario_name}, i)
+        return self.__build_observation(), infos
+
+    # The actions are applied during `repeat` ticks (action_repeat by default), the rewards of every tick are summed and
+    # the observations are only built after the last one. An agent whose episode ends stops accumulating rewards.
+    def step(self, actions, repeat=None):
+        repeat = self.action_repeat if repeat is None else repeat
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        terminated = np.zeros(self.num_envs, dtype=np.bool_)
+        truncated = np.zeros(self.num_envs, dtype=np.bool_)
+        # The agents that ended their episode in the previous step only return their first observation
+        resetting = np.array([agent.needs_reset for agent in self.__agents], dtype=np.bool_)
+        active = ~resetting
+        for tick in range(max(1, int(repeat))):
+            self.__last_frame = self.__world.tick()
+            for i in np.flatnonzero(active):
+                agent = self.__agents[i]
+                self.__control_vehicle(agent, actions[i])
+                self.__update_reward_state(agent)
+                rewards[i] += agent.reward_func.calculate_reward(agent.vehicle, agent.current_pos, agent.target_pos, agent.next_waypoint_pos, agent.speed)
+                terminated[i] = agent.reward_func.get_terminated()
+                agent.waypoints = agent.reward_func.get_waypoints()
+                truncated[i] = time.time() - agent.start_time > self.__time_limit
+                if terminated[i] or truncated[i]:
+                    active[i] = False
+            if not active.any():
+                break
+
+        # Observations of every agent with the sensor data of the last tick
+        for i in np.flatnonzero(resetting):
+            self.__update_reward_state(self.__agents[i])
+            self.__agents[i].needs_reset = False
+        self.__wait_for_sensors(self.__last_frame)
+        observations = self.__build_observation()
+
+        infos = {}
+        for i, agent in enumerate(self.__agents):
+            info = {'scenario_name': agent.scenario_name, 'repeat_steps': tick + 1}
+            if terminated[i] or truncated[i]:
+                print(f"Agent {i} ended its episode with reward {agent.reward_func.get_total_ep_reward()}.")
+                info['episode_reward'] = agent.reward_func.get_total_ep_reward()
+                self.__restart_agent(agent, exclude=[other.scenario_name for other in self.__agents if other is not agent])
+            infos = self._add_info(infos, info, i)
+
+        return observations, rewards, terminated, truncated, infos
+
+    # Destroys the agents, along with their sensors, and every npc, and closes the server
+    def close_extras(self, **kwargs):
+        self.__set_asynchronous()
+        for agent in self.__agents:
+            agent.vehicle.destroy_vehicle()
+        self.__world.destroy_world()
+        if self.__automatic_server_initialization:
+            CarlaServer.close_server(self.__server_process)
+
+    def get_agents(self):
+        return self.__agents
+
+    # ===================================================== OBSERVATION/ACTION METHODS =====================================================
+    # Updates the vehicle state used by the reward function of one agent (no sensor data, it is called every tick)
+    def __update_reward_state(self, agent):
+        vehicle_loc = agent.vehicle.get_location()
+        target = agent.scenario_dict['target_position']
+        agent.current_pos = np.array([vehicle_loc.x, vehicle_loc.y, vehicle_loc.z])
+        agent.target_pos = np.array([target['x'], target['y'], target['z']])
+        try:
+            agent.next_waypoint_pos = np.array([agent.waypoints[0][0], agent.waypoints[0][1], agent.waypoints[0][2]])
+        except IndexError:
+            agent.next_waypoint_pos = np.array([0.0, 0.0, 0.0])
+        agent.speed = agent.vehicle.get_speed()
+
+    # Waits until the streaming sensors of every agent delivered the given frame
+    def __wait_for_sensors(self, frame):
+        if frame is None:
+            return
+        deadline = time.monotonic() + config.SENSOR_TIMEOUT
+        for i, agent in enumerate(self.__agents):
+            if not agent.vehicle.wait_for_sensors(frame, timeout=max(0.0, deadline - time.monotonic())):
+                print(f"Sensors {agent.vehicle.missing_sensors(frame)} of agent {i} didn't deliver frame {frame} in {config.SENSOR_TIMEOUT} seconds, using their last data")
+
+    # Stacks the sensor data and state of every agent and pre-processes them in a single batch
+    def __build_observation(self):
+        sensor_data = [agent.vehicle.get_observation_data() for agent in self.__agents]
+        bev = self.pre_processing.lidar_representation == 'bev'
+        observations = {
+            'rgb_data': np.stack([data['rgb_data'] for data in sensor_data]),
+            # The bird's-eye-view grids are built from the full point clouds, which have different lengths
+            'lidar_data': [data['lidar_points'] for data in sensor_data] if bev else np.stack([data['lidar_data'] for data in sensor_data]),
+            'position': np.stack([agent.current_pos for agent in self.__agents]),
+            'target_position': np.stack([agent.target_pos for agent in self.__agents]),
+            'next_waypoint_position': np.stack([agent.next_waypoint_pos for agent in self.__agents]),
+            'speed': np.array([[agent.speed] for agent in self.__agents]),
+            'situation': np.array([self.__situations_map[agent.scenario_dict['situation']] for agent in self.__agents])
+        }
+        for key in self.__sensor_channels:
+            observations[key] = np.stack([data[key] for data in sensor_data])
+
+        observations = self.pre_processing.preprocess_batch(observations)
+        if self.copy:
+            observations = {key: np.array(value) for key, value in observations.items()}
+        return observations
+
+    def __control_vehicle(self, agent, action):
+        if self.__is_continuous:
+            agent.vehicle.control_vehicle(action)
+        else:
+            agent.vehicle.control_vehicle_discrete(action)
+
+    # ===================================================== SCENARIO METHODS =====================================================
+    def __load_world(self, scenario_name, seed=None):
+        scenario_dict = self.situations_dict[scenario_name]
+        self.__scenario_dict = scenario_dict
+
+        # Every agent and npc is destroyed, loading a map would destroy them anyway
+        self.__set_asynchronous()
+        for agent in self.__agents:
+            agent.vehicle.destroy_vehicle()
+        self.__world.destroy_vehicles()
+        self.__world.destroy_pedestrians()
+
+        # This is a fix to a weird bug that happens when the first town is the same as the default map (see CarlaEnv.load_scenario)
+        if self.__first_episode and scenario_dict['map_name'] == self.__world.get_active_map_name():
+            self.__world.reload_map()
+        self.__first_episode = False
+        # The world is reused when the map doesn't change, a new map is ready once the server simulates a frame of it
+        self.__world.set_active_map(scenario_dict['map_name'])
+        self.__map = self.__world.update_traffic_map()
+        self.__map_scenarios = [name for name in self.situations_list if self.situations_dict[name]['map_name'] == scenario_dict['map_name']]
+        self.__world.set_settings()
+
+        # Weather
+        if self.__random_weather:
+            self.__world.set_random_weather()
+        else:
+            self.__world.set_active_weather_preset(scenario_dict['weather_condition'])
+
+        # Agents: the first one drives the scenario of the map, the others different scenarios of the same map when there are enough
+        for agent in self.__agents:
+            name = scenario_name if agent is self.__agents[0] else self.__choose_map_scenario(exclude=[other.scenario_name for other in self.__agents if other is not agent])
+            self.__spawn_agent(agent, name)
+            if self.__apply_physics:
+                agent.vehicle.adapt_to_weather(scenario_dict['weather_condition'])
+        if self.__verbose:
+            print(f"{self.num_envs} agents spawned!")
+
+        # Traffic around the first agent
+        if self.__has_traffic:
+            self.__spawn_traffic(scenario_name, seed)
+        self.__toggle_lights()
+
+        # Tick the world to make sure everything is loaded
+        self.__last_frame = self.__world.tick()
+
+    def __spawn_agent(self, agent, scenario_name):
+        self.__set_agent_scenario(agent, scenario_name)
+        location, rotation = self.__scenario_start(agent.scenario_dict)
+        agent.vehicle.spawn_vehicle(location, rotation)
+        # The start can be taken by another agent, the vehicle is then spawned at a random spawn point (with the same target)
+        if not agent.vehicle.is_spawned():
+            print(f"Start of scenario {scenario_name} is blocked, spawning the agent at a random location...")
+            agent.vehicle.spawn_vehicle()
+        self.__start_agent_episode(agent, agent.vehicle.get_location())
+        agent.needs_reset = False
+
+    # Moves the agent to the start of another scenario of the same map, its first observation is returned by the next step.
+    # The start has to be free: scenarios whose start is taken (by npcs or other agents) are skipped and, when every start
+    # is taken, the agent is moved to a free spawn point of the map (with the target of the chosen scenario)
+    def __restart_agent(self, agent, exclude):
+        occupied = self.__occupied_locations(agent)
+        candidates = self.__map_scenario_candidates(exclude)
+        for scenario_name in candidates:
+            location, rotation = self.__scenario_start(self.situations_dict[scenario_name])
+            if self.__is_free(location, occupied):
+                break
+        else:
+            scenario_name = candidates[0]
+            location, rotation = self.__free_spawn_point(occupied)
+            print(f"Every start of the map is taken, restarting the agent in scenario {scenario_name} at a free spawn point...")
+        self.__set_agent_scenario(agent, scenario_name)
+        agent.vehicle.teleport(location, rotation)
+        # The transform is only applied in the next tick, the route starts at the new location
+        self.__start_agent_episode(agent, carla.Location(x=location[0], y=location[1], z=location[2]))
+        agent.needs_reset = True
+
+    # Locations of every vehicle but the agent's one, the agents restarted in this step are already at their new start
+    def __occupied_locations(self, agent):
+        own_id = agent.vehicle.get_vehicle().id
+        occupied = []
+        for vehicle in self.__world.get_world().get_actors().filter('vehicle.*'):
+            if vehicle.id != own_id:
+                location = vehicle.get_location()
+                occupied.append((location.x, location.y, location.z))
+        for other in self.__agents:
+            if other is not agent and other.needs_reset:
+                occupied.append((other.start_location.x, other.start_location.y, other.start_location.z))
+        return np.array(occupied, dtype=np.float64).reshape(-1, 3)
+
+    def __is_free(self, location, occupied):
+        return len(occupied) == 0 or np.min(np.linalg.norm(occupied - np.array(location), axis=1)) >= config.ENV_START_CLEARANCE
+
+    def __free_spawn_point(self, occupied):
+        spawn_points = self.__map.get_spawn_points()
+        for i in self.__rng.permutation(len(spawn_points)):
+            transform = spawn_points[i]
+            location = (transform.location.x, transform.location.y, transform.location.z)
+            if self.__is_free(location, occupied):
+                return location, (transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll)
+        raise RuntimeError("There is no free spawn point in the map to restart the agent")
+
+    @staticmethod
+    def __scenario_start(scenario_dict):
+        location = (scenario_dict['initial_position']['x'], scenario_dict['initial_position']['y'], scenario_dict['initial_position']['z'])
+        rotation = (scenario_dict['initial_rotation']['pitch'], scenario_dict['initial_rotation']['yaw'], scenario_dict['initial_rotation']['roll'])
+        return location, rotation
+
+    def __set_agent_scenario(self, agent, scenario_name):
+        agent.scenario_name = scenario_name
+        agent.scenario_dict = self.situations_dict[scenario_name]
+
+    def __start_agent_episode(self, agent, start_location):
+        waypoints = self.get_path_waypoints(start_location, agent.scenario_dict, spacing=config.ENV_WAYPOINT_SPACING)
+        agent.waypoints = [np.array([w.x, w.y, w.z]) for w in waypoints]
+        agent.start_location = start_location
+        agent.reward_func.reset(agent.waypoints)
+        agent.start_time = time.time()
+
+    def __choose_map_scenario(self, exclude):
+        return self.__map_scenario_candidates(exclude)[0]
+
+    # Scenarios of the map in random order, the ones not in exclude first (the others are only used if their start is free)
+    def __map_scenario_candidates(self, exclude):
+        others = [name for name in self.__map_scenarios if name not in exclude]
+        shared = [name for name in self.__map_scenarios if name in exclude]
+        return [others[i] for i in self.__rng.permutation(len(others))] + [shared[i] for i in self.__rng.permutation(len(shared))]
+
+    def __set_asynchronous(self):
+        settings = self.__world.get_world().get_settings()
+        settings.synchronous_mode = False
+        settings.fixed_delta_seconds = None
+        self.__world.get_world().apply_settings(settings)
+
+    def __toggle_lights(self):
+        lights_on = "night" in self.__world.get_active_weather().lower() or "noon" in self.__world.get_active_weather().lower()
+        self.__world.toggle_lights(lights_on=lights_on)
+        for agent in self.__agents:
+            agent.vehicle.toggle_lights(lights_on=lights_on)
+
+    # Same traffic as CarlaEnv for the scenario of the map, spawned around the first agent
+    def __spawn_traffic(self, scenario_name, seed):
+        if not self.__random_traffic and self.__scenario_dict['traffic_density'] == 'None':
+            return
+
+        if not self.__random_traffic:
+            seed = scenario_name
+        if seed is not None:
+            random.seed(seed)
+
+        if not self.__random_traffic:
+            num_vehicles = random.randint(1, 5) if self.__scenario_dict['traffic_density'] == 'Low' else random.randint(10, 20)
+        else:
+            num_vehicles = random.randint(1, 20)
+
+        self.__world.spawn_vehicles_around_ego(self.__agents[0].vehicle.get_vehicle(), radius=100, num_vehicles_around_ego=num_vehicles, seed=seed)
+
+    # ===================================================== SITUATIONS PARSING =====================================================
+    # Filter the current situations based on the flag
+    def __get_situations(self, scenarios):
+        with open(config.ENV_SCENARIOS_FILE, 'r') as f:
+            self.situations_dict = json.load(f)
+
+        if scenarios:
+            self.situations_dict = {key: value for key, value in self.situations_dict.items() if value['situation'] in scenarios}
+
+        self.situations_list = list(self.situations_dict.keys())
+
+    # ===================================================== AUX METHODS =====================================================
+    def get_path_waypoints(self, start_location, scenario_dict, spacing=5.0):
+        target_location = carla.Location(x=scenario_dict['target_position']['x'], y=scenario_dict['target_position']['y'], z=scenario_dict['target_position']['z'])
+        current_waypoint = self.__map.get_waypoint(start_location)
+        target_waypoint = self.__map.get_waypoint(target_location)
+
+        waypoints = []
+        while current_waypoint.transform.location.distance(target_waypoint.transform.location) > spacing:
+            waypoints.append(current_waypoint.transform.location)
+            current_waypoint = current_waypoint.next(spacing)[0]
+
+        return waypoints[1:] # Take out the first waypoint because it is the starting point
@@ -1,14 +1,39 @@
 from gymnasium import spaces
 import numpy as np
+from carla_gym.src.env.env_aux.lidar_bev import LidarBEV
+
+# LiDAR representation: 'points' (500 points chosen with farthest point sampling, (3, 500)) or 'bev' (bird's-eye-view
+# grid with max height, density and intensity channels, (height, width, 3), see env_aux/lidar_bev.py)
+lidar_representation = 'points'
+lidar_bev_params = {
+    'x_range': (-32.0, 32.0),   # Meters ahead/behind the sensor
+    'y_range': (-32.0, 32.0),   # Meters left/right of the sensor
+    'z_range': (-2.5, 1.5),     # Meters below/above the sensor (it is 1.7m above the ground)
+    'cell_size': 0.5,
+    'max_points': 16            # Number of points of a cell with density 1
+}
+
+# Optional PointNet features of the sampled LiDAR points, observed as 'lidar_features' (see env_aux/pointnet_encoder.py).
+# Only with the 'points' representation
+lidar_feature_params = {
+    'enabled': False,
+    'checkpoint': None,         # Weights of PointNetfeat, None keeps the random initialization
+    'projection_dim': 64,       # Size of the features, None for the 1024 global features of PointNet
+    'num_threads': 1,           # torch CPU threads of the encoder
+    'trace': True,              # Run the TorchScript trace of the network
+    'variant': 'float',         # Deployment variant: float, folded, folded_int8, no_stn, no_stn_int8 (env_aux/pointnet_deploy.py)
+    'keep_points': False        # Keep 'lidar_data' in the observation too
+}
 
 # Change this according to your needs.
 observation_shapes = {
     'rgb_data': (360, 640, 3),
-    'lidar_data': (3, 500), 
+    'lidar_data': (3, 500) if lidar_representation == 'points' else LidarBEV(**lidar_bev_params).shape,
     'position': (3,),
     'target_position': (3,),
     'next_waypoint_position': (3,),
     'speed': (1,),
+    'lidar_features': (lidar_feature_params['projection_dim'] or 1024,),
     'num_of_stuations': 4
 }
 
@@ -21,13 +46,43 @@ situations_map = {
 
 obs_space = spaces.Dict({
     'rgb_data': spaces.Box(low=0, high=255, shape=observation_shapes['rgb_data'], dtype=np.uint8),
-    'lidar_data': spaces.Box(low=-np.inf, high=np.inf, shape=observation_shapes['lidar_data'], dtype=np.float32),
+    'lidar_data': spaces.Box(low=-np.inf, high=np.inf, shape=observation_shapes['lidar_data'], dtype=np.float32) if lidar_representation == 'points'
+                  else spaces.Box(low=0.0, high=1.0, shape=observation_shapes['lidar_data'], dtype=np.float32),
     'position': spaces.Box(low=-np.inf, high=np.inf, shape=observation_shapes['position'], dtype=np.float32),
     'target_position': spaces.Box(low=-np.inf, high=np.inf, shape=observation_shapes['target_position'], dtype=np.float32),
     'next_waypoint_position': spaces.Box(low=-np.inf, high=np.inf, shape=observation_shapes['next_waypoint_position'], dtype=np.float32),
     'speed': spaces.Box(low=-np.inf, high=np.inf, shape=(1,), dtype=np.float32),
     'situation': spaces.Discrete(observation_shapes['num_of_stuations'])
 })
+if lidar_feature_params['enabled']:
+    obs_space = spaces.Dict({
+        **{key: space for key, space in obs_space.spaces.items() if key != 'lidar_data' or lidar_feature_params['keep_points']},
+        'lidar_features': spaces.Box(low=-np.inf, high=np.inf, shape=observation_shapes['lidar_features'], dtype=np.float32)
+    })
+
+# Fixed-shape channels of the optional sensors, added to the observation space when the sensor is in the sensors file
+sensor_observation_shapes = {
+    'gnss_data': (3,),      # [latitude, longitude, altitude]
+    'imu_data': (7,),       # [accelerometer x, y, z, gyroscope x, y, z, compass]
+    'radar_detections': 64  # Default number of radar detections (the 'max_detections' attribute of the radar)
+}
+
+def build_obs_space(sensors_dict=None):
+    '''
+    Returns obs_space plus the channels of the GNSS, IMU and radar found in sensors_dict (the sensors file of the vehicle).
+    The radar is observed as its nearest detections [velocity, azimuth, altitude, depth] and a mask of the valid rows.
+    '''
+    subspaces = dict(obs_space.spaces)
+    sensors_dict = sensors_dict or {}
+    if 'gnss' in sensors_dict:
+        subspaces['gnss_data'] = spaces.Box(low=-np.inf, high=np.inf, shape=sensor_observation_shapes['gnss_data'], dtype=np.float64)
+    if 'imu' in sensors_dict:
+        subspaces['imu_data'] = spaces.Box(low=-np.inf, high=np.inf, shape=sensor_observation_shapes['imu_data'], dtype=np.float32)
+    if 'radar' in sensors_dict:
+        detections = int(sensors_dict['radar'].get('max_detections', sensor_observation_shapes['radar_detections']))
+        subspaces['radar_data'] = spaces.Box(low=-np.inf, high=np.inf, shape=(detections, 4), dtype=np.float32)
+        subspaces['radar_mask'] = spaces.Box(low=0, high=1, shape=(detections,), dtype=np.uint8)
+    return spaces.Dict(subspaces)
 
 # For continuous actions (steering [-1.0, 1.0], throttle/brake [-1.0, 1.0])
 continuous_act_space = spaces.Box(low=np.array([-1.0, -1.0]), high=np.array([1.0, 1.0]), dtype=np.float32)
@@ -2,23 +2,39 @@
 Pre-processing Module:
     - This module is used to preprocess the observation data before feeding it to the policy network
 '''
+import time
 import numpy as np
 from carla_gym.src.env.env_aux.farthest_sampler import FarthestSampler
+from carla_gym.src.env.env_aux.lidar_bev import LidarBEV
+import carla_gym.src.env.observation_action_space as observation_action_space
 from carla_gym.src.env.env_aux.point_net import PointNetfeat
+from carla_gym.src.env.env_aux.pointnet_encoder import PointNetEncoder
 import cv2
 import torch
 
 class PreProcessing:
     def __init__(self) -> None:
         self.sampler = FarthestSampler()
-        pass
+        self.lidar_representation = observation_action_space.lidar_representation
+        self.lidar_bev = LidarBEV(**observation_action_space.lidar_bev_params)
+        self.timings = {}           # Time (ms) of each stage of the last preprocess_batch call
+        self.lidar_encoder = None
+        feature_params = observation_action_space.lidar_feature_params
+        if feature_params['enabled']:
+            if self.lidar_representation != 'points':
+                raise ValueError("The PointNet LiDAR features need the 'points' LiDAR representation")
+            self.lidar_encoder = PointNetEncoder(checkpoint=feature_params['checkpoint'], num_points=observation_action_space.observation_shapes['lidar_data'][1],
+                                                 projection_dim=feature_params['projection_dim'], num_threads=feature_params['num_threads'], trace=feature_params['trace'],
+                                                 variant=feature_params['variant'])
+            self.keep_lidar_points = feature_params['keep_points']
+        self.__batch_buffers = None
     
     def preprocess_data(self, observation_data):
         '''
         This is where the data is preprocessed before feeding it to the policy network
         The observation data is a dictionary containing the following keys:
             - rgb_data: The RGB image data
-            - lidar_data: The LiDAR data
+            - lidar_data: The LiDAR data (the full point cloud if the representation is 'bev')
             - position: The current position of the vehicle
             - target_position: The target position of the vehicle
             - next_waypoint_position: The next waypoint position of the vehicle
@@ -26,17 +42,84 @@ class PreProcessing:
             - situation: The current situation of the vehicle (Road, Roundabout, Junction, Tunnel)
         '''
         observation_data['lidar_data'] = self.__process_lidar(observation_data['lidar_data'])
+        if self.lidar_encoder is not None:
+            observation_data['lidar_features'] = self.lidar_encoder.encode(observation_data['lidar_data'])
+            if not self.keep_lidar_points:
+                del observation_data['lidar_data']
         
         return observation_data
 
+    def preprocess_batch(self, observations):
+        '''
+        Batched version of preprocess_data for the observations of N envs, stacked along the first axis:
+            - rgb_data: (N, H, W, 3)
+            - lidar_data: (N, P, 4), or a list of N point clouds of any length if the representation is 'bev'
+            - position, target_position, next_waypoint_position: (N, 3)
+            - speed: (N, 1)
+            - situation: (N,)
+        Every stage is a single vectorized operation over the N envs, written into preallocated buffers with the
+        shapes and dtypes of the observation space. The buffers are reused by the next call (copy them to keep them).
+        Other keys (e.g., GNSS, IMU and radar channels) are returned as they are. The time of each stage is stored in
+        self.timings (ms).
+        '''
+        num_envs = len(observations['situation'])
+        batch = self.__get_batch_buffers(num_envs)
+
+        start = time.perf_counter()
+        if self.lidar_representation == 'bev':
+            self.lidar_bev.encode_batch(observations['lidar_data'], out=batch['lidar_data'])
+        else:
+            lidar_data = np.asarray(observations['lidar_data'])
+            # Same steps as __process_lidar: drop the intensity, (N, 3, P) and sample the N clouds in one call
+            batch['lidar_data'][...], _ = self.sampler.sample(lidar_data[:, :, :3].transpose(0, 2, 1), 500)
+        lidar_end = time.perf_counter()
+
+        np.copyto(batch['rgb_data'], observations['rgb_data'], casting='unsafe')
+        image_end = time.perf_counter()
+
+        for key in ['position', 'target_position', 'next_waypoint_position', 'speed', 'situation']:
+            np.copyto(batch[key], np.reshape(observations[key], batch[key].shape), casting='unsafe')
+        scalars_end = time.perf_counter()
+
+        # The clouds of every env go through PointNet in a single call
+        if self.lidar_encoder is not None:
+            batch['lidar_features'][...] = self.lidar_encoder.encode(batch['lidar_data'])
+        features_end = time.perf_counter()
+
+        self.timings = {
+            'lidar': 1000.0 * (lidar_end - start),
+            'image': 1000.0 * (image_end - lidar_end),
+            'scalars': 1000.0 * (scalars_end - image_end),
+            'lidar_features': 1000.0 * (features_end - scalars_end),
+            'total': 1000.0 * (features_end - start)
+        }
+        processed = dict(batch)
+        if self.lidar_encoder is not None and not self.keep_lidar_points:
+            del processed['lidar_data']
+        for key, value in observations.items():
+            if key not in processed:
+                processed[key] = value
+        return processed
+
+    def __get_batch_buffers(self, num_envs):
+        if self.__batch_buffers is None or len(self.__batch_buffers['situation']) != num_envs:
+            self.__batch_buffers = {key: np.empty((num_envs,) + space.shape, dtype=space.dtype)
+                                    for key, space in observation_action_space.obs_space.spaces.items()}
+            # The sampled points are needed by the PointNet features even if they aren't observed
+            self.__batch_buffers.setdefault('lidar_data', np.empty((num_envs,) + observation_action_space.observation_shapes['lidar_data'], dtype=np.float32))
+        return self.__batch_buffers
+
     # This method extracts the features from the lidar data before feeding it to the policy network
     def __process_lidar(self, lidar_data):
+        if self.lidar_representation == 'bev':
+            return self.lidar_bev.encode(lidar_data)
+
         lidar_data = lidar_data[:, :-1]
         lidar_data = lidar_data.transpose([1, 0])
         
         # Sample the lidar data so the number of points remains constant without affecting the quality of the data
-        sampler = FarthestSampler()
-        lidar_data, _ = sampler.sample(lidar_data, 500)
+        # (the sampler returns the points as they are when there are no more than 500)
+        lidar_data, _ = self.sampler.sample(lidar_data, 500)
         
         return np.float32(lidar_data)
     
@@ -0,0 +1,293 @@
+'''
+Subprocess vector environment for the carla environment.
+
+Each env of the vector env is a CarlaEnv in its own worker process, with its own CARLA server started (and closed) by
+the worker on its own ports, so several envs run in parallel in the same machine:
+    worker i: RPC port base_port + i * port_stride, streaming port RPC port + 1, Traffic Manager port tm_base_port + i
+
+Every command is sent to all the workers before any answer is waited for, so the workers step in parallel. The
+observations don't travel through the pipes: each worker writes them in a shared memory ObservationRing created by the
+main process (see transport/shm_ring.py) and only the slot, the small entries (e.g., the situation), the reward, the
+flags and the info are pickled.
+
+Auto-reset (AutoresetMode.SAME_STEP, like the remote vector env): a worker whose episode ends resets its env in the
+same step, the final observation goes in infos["final_obs"] and the final info in infos["final_info"].
+
+When a worker dies (its env raised an exception, the server crashed, it was killed) or doesn't answer in step_timeout
+seconds, it is killed along with its server and started again on the same ports. Its env is reset and that step
+returns it as truncated, with the last observation of the dead worker as final observation and
+info["worker_restarted"] = True. A worker is only restarted max_restarts times.
+'''
+
+import os
+import time
+import signal
+import multiprocessing as mp
+import numpy as np
+
+import gymnasium as gym
+from gymnasium.vector import AutoresetMode
+from gymnasium.vector.utils import batch_space
+import carla_gym.src.config.configuration as config
+
+from carla_gym.src.transport.shm_ring import ObservationRing
+
+
+# Runs a CarlaEnv in the worker process, the observations are written in the shared memory ring of the worker
+def _worker(remote, parent_remote, env_kwargs):
+    parent_remote.close()
+    # carla is only imported by the workers
+    from carla_gym.src.env.environment import CarlaEnv
+    env = None
+    ring = None
+    try:
+        env = CarlaEnv(**env_kwargs)
+        server_process = env.get_server_process()
+        remote.send(('ready', env.observation_space, env.action_space, server_process.pid if server_process is not None else None))
+        _, description = remote.recv()
+        ring = ObservationRing.attach(description)
+
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'reset':
+                obs, info = env.reset(seed=data['seed'], options=data['options'])
+                remote.send(('reset', ring.write(obs), info))
+            elif cmd == 'step':
+                obs, reward, terminated, truncated, info = env.step(data['action'], repeat=data['repeat'])
+                final_obs = None
+                if terminated or truncated:
+                    # The final observation takes a slot of the ring and the first one of the next episode the next slot
+                    final_obs = ring.write(obs)
+                    obs, reset_info = env.reset()
+                    reset_info['final_info'] = info
+                    info = reset_info
+                remote.send(('step', ring.write(obs), float(reward), bool(terminated), bool(truncated), info, final_obs))
+            elif cmd == 'close':
+                break
+            else:
+                raise ValueError(f"Unknown command {cmd}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if env is not None:
+            env.close()
+        if ring is not None:
+            ring.close()
+        remote.close()
+
+
+class SubprocCarlaVectorEnv(gym.vector.VectorEnv):
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(self, num_envs=2, env_kwargs=None, base_port=config.SIM_PORT, port_stride=3, tm_base_port=config.SIM_TM_PORT, action_repeat=1, step_timeout=None, startup_timeout=300.0, max_restarts=3, start_method='spawn', copy=True):
+        '''
+        env_kwargs: Arguments of every CarlaEnv (the ports are set by the vector env)
+        step_timeout: Seconds a worker has to answer a step/reset before it is considered dead (None waits forever)
+        startup_timeout: Seconds a worker has to start its server and create its env
+        max_restarts: Number of times each worker can be restarted, a RuntimeError is raised after that
+        copy: Return copies of the observations (the vector env reuses its buffers in every step)
+        '''
+        self.num_envs = num_envs
+        self.action_repeat = action_repeat
+        self.copy = copy
+        self.__env_kwargs = dict(env_kwargs or {})
+        self.__ports = [(base_port + i * port_stride, base_port + i * port_stride + 1, tm_base_port + i) for i in range(num_envs)]
+        self.__step_timeout = step_timeout
+        self.__startup_timeout = startup_timeout
+        self.__max_restarts = max_restarts
+        self.__context = mp.get_context(start_method)
+
+        self.__remotes = [None] * num_envs
+        self.__processes = [None] * num_envs
+        self.__server_pids = [None] * num_envs
+        self.__rings = [None] * num_envs
+        self.__restarts = [0] * num_envs
+        self.__pending = [False] * num_envs    # A command was sent and its answer wasn't received
+        self.__buffers = None
+
+        # Every worker starts its server at the same time
+        try:
+            for i in range(num_envs):
+                self.__start_worker(i)
+            spaces = [self.__handshake(i) for i in range(num_envs)]
+        except BaseException:
+            for i in range(num_envs):
+                self.__stop_worker(i)
+                if self.__rings[i] is not None:
+                    self.__rings[i].close()
+            raise
+        self.single_observation_space, self.single_action_space = spaces[0]
+        self.observation_space = batch_space(self.single_observation_space, self.num_envs)
+        self.action_space = batch_space(self.single_action_space, self.num_envs)
+        self.closed = False
+
+        self.__buffers = {key: np.zeros((num_envs,) + space.shape, dtype=space.dtype) for key, space in self.single_observation_space.spaces.items()}
+
+    # ===================================================== GYM METHODS =====================================================
+    def reset(self, *, seed=None, options=None):
+        if isinstance(seed, int):
+            seed = [seed + i for i in range(self.num_envs)]
+        seeds = seed if seed is not None else [None] * self.num_envs
+        # CarlaEnv needs the scenario name in the options
+        options = options if options is not None else {'scenario_name': None}
+
+        for i in range(self.num_envs):
+            self.__send(i, 'reset', {'seed': seeds[i], 'options': options})
+        infos = {}
+        for i in range(self.num_envs):
+            try:
+                _, obs, info = self.__recv(i, self.__step_timeout)
+            except OSError as e:
+                obs, info = self.__restart_worker(i, e)
+            self.__write_obs(i, obs)
+            infos = self._add_info(infos, info, i)
+        return self.__observations(), infos
+
+    def step_async(self, actions):
+        actions = np.asarray(actions)
+        for i in range(self.num_envs):
+            self.__send(i, 'step', {'action': actions[i], 'repeat': self.action_repeat})
+
+    def step_wait(self, timeout=None):
+        timeout = self.__step_timeout if timeout is None else timeout
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        terminated = np.zeros(self.num_envs, dtype=np.bool_)
+        truncated = np.zeros(self.num_envs, dtype=np.bool_)
+        final_obs = [None] * self.num_envs
+        infos = {}
+        for i in range(self.num_envs):
+            try:
+                _, obs, rewards[i], terminated[i], truncated[i], info, final = self.__recv(i, timeout)
+                if final is not None:
+                    final_obs[i] = self.__read_obs(i, final)
+            except OSError as e:
+                # The episode of the dead worker ends here, with its last observation
+                final_obs[i] = {key: np.array(buffer[i]) for key, buffer in self.__buffers.items()}
+                obs, info = self.__restart_worker(i, e)
+                info = dict(info, worker_restarted=True)
+                truncated[i] = True
+            self.__write_obs(i, obs)
+            infos = self._add_info(infos, info, i)
+
+        if any(o is not None for o in final_obs):
+            infos["final_obs"] = np.array(final_obs, dtype=object)
+            infos["_final_obs"] = np.array([o is not None for o in final_obs])
+        return self.__observations(), rewards, terminated, truncated, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close_extras(self, **kwargs):
+        for i in range(self.num_envs):
+            self.__send(i, 'close', None)
+        for i in range(self.num_envs):
+            self.__stop_worker(i, timeout=60.0)
+            if self.__rings[i] is not None:
+                self.__rings[i].close()
+                self.__rings[i] = None
+
+    def get_ports(self):
+        return list(self.__ports)
+
+    # ===================================================== WORKERS =====================================================
+    def __start_worker(self, i):
+        rpc_port, streaming_port, tm_port = self.__ports[i]
+        env_kwargs = dict(self.__env_kwargs, sim_port=rpc_port, sim_streaming_port=streaming_port, tm_port=tm_port)
+        remote, worker_remote = self.__context.Pipe()
+        process = self.__context.Process(target=_worker, args=(worker_remote, remote, env_kwargs), daemon=True)
+        process.start()
+        worker_remote.close()
+        self.__remotes[i] = remote
+        self.__processes[i] = process
+        self.__pending[i] = False
+
+    # Receives the spaces and the server of a new worker and gives it its shared memory ring (the same one after a restart)
+    def __handshake(self, i):
+        _, observation_space, action_space, server_pid = self.__recv(i, self.__startup_timeout, pending=False)
+        self.__server_pids[i] = server_pid
+        if self.__rings[i] is None:
+            self.__rings[i] = ObservationRing.create(observation_space, num_slots=2)
+        self.__remotes[i].send(('attach', self.__rings[i].describe()))
+        return observation_space, action_space
+
+    def __stop_worker(self, i, timeout=0.0):
+        process = self.__processes[i]
+        if process is not None:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        # The server of a worker that didn't close its env is still running (it has its own process group)
+        if self.__server_pids[i] is not None and os.name == 'posix':
+            try:
+                os.killpg(self.__server_pids[i], signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass
+        self.__server_pids[i] = None
+        if self.__remotes[i] is not None:
+            self.__remotes[i].close()
+        self.__processes[i] = None
+        self.__remotes[i] = None
+
+    def __restart_worker(self, i, error):
+        if self.__restarts[i] >= self.__max_restarts:
+            raise RuntimeError(f"Worker {i} failed {self.__restarts[i] + 1} times, last error: {error}")
+        self.__restarts[i] += 1
+        print(f"Worker {i} failed ({error}), restarting it with its server (restart {self.__restarts[i]}/{self.__max_restarts})...")
+        self.__stop_worker(i)
+        self.__start_worker(i)
+        try:
+            self.__handshake(i)
+            self.__send(i, 'reset', {'seed': None, 'options': {'scenario_name': None}})
+            _, obs, info = self.__recv(i, self.__step_timeout)
+        except OSError as e:
+            return self.__restart_worker(i, e)
+        return obs, info
+
+    def __send(self, i, cmd, data):
+        try:
+            self.__remotes[i].send((cmd, data))
+            self.__pending[i] = True
+        except OSError:
+            # The worker is dead, __recv reports it
+            self.__pending[i] = False
+
+    # Waits for the answer of a worker, checking that it is still alive. Dead workers and timeouts raise an OSError
+    def __recv(self, i, timeout, pending=True):
+        if pending and not self.__pending[i]:
+            raise BrokenPipeError(f"Worker {i} didn't receive the command")
+        remote, process = self.__remotes[i], self.__processes[i]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not remote.poll(1.0):
+            if not process.is_alive():
+                raise ConnectionResetError(f"Worker {i} exited with code {process.exitcode}")
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Worker {i} didn't answer in {timeout} seconds")
+        try:
+            message = remote.recv()
+        except EOFError:
+            raise ConnectionResetError(f"Worker {i} closed its pipe")
+        self.__pending[i] = False
+        return message
+
+    # ===================================================== OBSERVATIONS =====================================================
+    # Copies the observation of a worker (its ring slot and the entries sent with the message) into the batch buffers
+    def __write_obs(self, i, message):
+        slot, seq, remaining = message
+        for key, value in self.__rings[i].read(slot, seq).items():
+            self.__buffers[key][i] = value
+        for key, value in remaining.items():
+            if key in self.__buffers:
+                self.__buffers[key][i] = value
+
+    def __read_obs(self, i, message):
+        slot, seq, remaining = message
+        obs = self.__rings[i].read(slot, seq, copy=True)
+        obs.update(remaining)
+        return obs
+
+    def __observations(self):
+        if self.copy:
+            return {key: buffer.copy() for key, buffer in self.__buffers.items()}
+        return self.__buffers
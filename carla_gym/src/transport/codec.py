@@ -0,0 +1,150 @@
+'''
+Codec Module:
+    It provides the wire formats used between the ZMQ env server (carla_server.py) and the remote clients.
+
+    Available encodings:
+        - binary: A small JSON header (keys, dtypes, shapes, reward, terminated, truncated, info...) followed by the raw
+                  ndarray buffers, each one in its own ZMQ frame. The receiver rebuilds the arrays with np.frombuffer.
+        - json:   Everything inside a single JSON message, the arrays are sent as nested lists. Only meant for debugging.
+        - shm:    Same host only. The Box observations are written in a shared memory ring (see shm_ring.py) and the
+                  header only carries the slot index and sequence number ('shm_slot', 'shm_seq'), anything that doesn't
+                  fit the ring is sent like in the binary encoding.
+
+    Message layout (binary):
+        frame 0:    JSON header, contains 'obs_meta' (list of {key, dtype, shape}) and 'obs_scalars' (non-array values)
+        frame 1..n: Raw buffers of the arrays, in the same order as 'obs_meta'
+'''
+
+import json
+import numpy as np
+from gymnasium import spaces
+
+ENCODING_BINARY     = 'binary'
+ENCODING_JSON       = 'json'
+ENCODING_SHM        = 'shm'
+SUPPORTED_ENCODINGS = [ENCODING_BINARY, ENCODING_JSON, ENCODING_SHM]
+
+
+# ====================================== Helpers ======================================
+# Converts numpy objects (arrays, scalars) found inside nested containers into JSON serializable types
+def to_jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    return value
+
+# Returns an object that exposes the buffer protocol, it accepts bytes, memoryviews and zmq.Frame objects
+def _frame_buffer(frame):
+    return frame.buffer if hasattr(frame, 'buffer') else frame
+
+def _frame_bytes(frame):
+    return frame.bytes if hasattr(frame, 'bytes') else bytes(frame)
+
+def negotiate_encoding(requested):
+    '''
+    Chooses the first supported encoding of the list sent by the client. If the client sends nothing the binary one is used.
+    '''
+    if requested is None:
+        return ENCODING_BINARY
+    if isinstance(requested, str):
+        requested = [requested]
+    for encoding in requested:
+        if encoding in SUPPORTED_ENCODINGS:
+            return encoding
+    raise ValueError(f"None of the requested encodings {requested} is supported, available: {SUPPORTED_ENCODINGS}")
+
+# Uniform bounds (e.g., the 0-255 of an image) are sent as a single value instead of one value per pixel
+def _compact_bound(bound):
+    if bound.size > 0 and np.all(bound == bound.flat[0]):
+        return bound.flat[0].item()
+    return bound.tolist()
+
+# The spaces are described as JSON so that remote clients (e.g., the vector env) can rebuild them without the env code
+def describe_space(space):
+    if isinstance(space, spaces.Dict):
+        return {'type': 'Dict', 'spaces': {key: describe_space(subspace) for key, subspace in space.spaces.items()}}
+    if isinstance(space, spaces.Box):
+        return {'type': 'Box', 'low': _compact_bound(space.low), 'high': _compact_bound(space.high), 'shape': list(space.shape), 'dtype': np.dtype(space.dtype).str}
+    if isinstance(space, spaces.Discrete):
+        return {'type': 'Discrete', 'n': int(space.n), 'start': int(space.start)}
+    raise NotImplementedError(f"Space {type(space).__name__} can't be described")
+
+def build_space(description):
+    if description['type'] == 'Dict':
+        return spaces.Dict({key: build_space(subspace) for key, subspace in description['spaces'].items()})
+    if description['type'] == 'Box':
+        dtype = np.dtype(description['dtype'])
+        shape = tuple(description['shape'])
+        low = np.broadcast_to(np.asarray(description['low'], dtype=dtype), shape)
+        high = np.broadcast_to(np.asarray(description['high'], dtype=dtype), shape)
+        return spaces.Box(low=low, high=high, shape=shape, dtype=dtype)
+    if description['type'] == 'Discrete':
+        return spaces.Discrete(description['n'], start=description['start'])
+    raise NotImplementedError(f"Space {description['type']} can't be built")
+
+
+# ====================================== Encoding ======================================
+def encode_message(header, obs=None, encoding=ENCODING_BINARY):
+    '''
+    Builds the list of frames of a message.
+        - header: Dictionary with the scalar part of the message (status, reward, terminated, truncated, info, ...)
+        - obs: Optional dictionary of observations, numpy arrays are sent as raw buffers in binary mode
+        - encoding: One of SUPPORTED_ENCODINGS
+    '''
+    header = dict(header)
+    header['encoding'] = encoding
+
+    if obs is None:
+        return [json.dumps(to_jsonable(header)).encode()]
+
+    obs_meta = []
+    obs_scalars = {}
+    buffers = []
+    for key, value in obs.items():
+        if isinstance(value, np.ndarray):
+            array = np.ascontiguousarray(value)
+            obs_meta.append({'key': key, 'dtype': array.dtype.str, 'shape': list(array.shape)})
+            buffers.append(array)
+        else:
+            obs_scalars[key] = to_jsonable(value)
+
+    header['obs_meta'] = obs_meta
+    header['obs_scalars'] = obs_scalars
+
+    if encoding == ENCODING_JSON:
+        header['obs_data'] = [array.tolist() for array in buffers]
+        return [json.dumps(to_jsonable(header)).encode()]
+    elif encoding in (ENCODING_BINARY, ENCODING_SHM):
+        return [json.dumps(to_jsonable(header)).encode()] + buffers
+    else:
+        raise ValueError(f"Unknown encoding {encoding}")
+
+
+# ====================================== Decoding ======================================
+def decode_message(frames):
+    '''
+    Rebuilds a message from its frames and returns (header, obs). The obs is None if the message has no observation.
+
+    In binary mode the arrays are read-only views over the received frames (no per-element conversion), so they must be
+    copied if they are going to be modified in place.
+    '''
+    header = json.loads(_frame_bytes(frames[0]).decode())
+    if 'obs_meta' not in header:
+        return header, None
+
+    obs = {}
+    if header.get('encoding') == ENCODING_JSON:
+        for meta, data in zip(header.pop('obs_meta'), header.pop('obs_data')):
+            obs[meta['key']] = np.asarray(data, dtype=np.dtype(meta['dtype'])).reshape(meta['shape'])
+    else:
+        for meta, frame in zip(header.pop('obs_meta'), frames[1:]):
+            array = np.frombuffer(_frame_buffer(frame), dtype=np.dtype(meta['dtype']))
+            obs[meta['key']] = array.reshape(meta['shape'])
+
+    obs.update(header.pop('obs_scalars', {}))
+    return header, obs
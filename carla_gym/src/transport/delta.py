@@ -0,0 +1,151 @@
+'''
+Delta Module:
+    It provides the stream mode of the env server transport (negotiated with the 'stream' parameter of hello). Consecutive
+    camera frames are very similar, so instead of sending every image the server sends periodic keyframes and, in
+    between, the XOR of the image with the last frame acknowledged by the client. The XOR is mostly zeros, so it
+    compresses several times better than the frame itself (lz4, or zlib with the fastest level if lz4 isn't installed).
+
+    Every request of the client carries 'ack', the sequence number of the last frame it decoded. The server encodes the
+    next frame against that one (it keeps the last frames sent to the client), so pipelined requests and replies
+    dropped by a client timeout are handled without any extra round trip. A keyframe is sent when:
+        - The client has no reference ('ack' is missing, e.g., after a decode error or a reconnection)
+        - The acknowledged frame is no longer in the server history
+        - An episode was reset, or keyframe_interval frames were sent since the last keyframe
+
+    If the client lost the reference of a frame anyway (e.g., more than history requests pipelined against the same
+    ack), decode raises MissingReference and the client asks for that frame again as a keyframe ('keyframe' command,
+    DeltaEncoder.keyframe), so the resync is transparent for the caller of reset/step.
+
+    Header entry ('stream_frame'):
+        {'seq': ..., 'ref': ... (None for keyframes), 'compression': ..., 'keys': {key: {'dtype', 'shape'}}}
+'''
+
+import numpy as np
+
+from carla_gym.src.transport.image_codec import FAST_COMPRESSION, compress_bytes, decompress_bytes
+
+STREAM_KEY = 'stream_frame'
+
+
+class MissingReference(RuntimeError):
+    # The reference of a delta frame is no longer in the decoder history, seq is the frame that couldn't be decoded
+    def __init__(self, seq, ref):
+        super().__init__(f"Missing reference frame {ref} to decode stream frame {seq}")
+        self.seq = seq
+
+
+def _select(obs, image_format):
+    # Only the images that are sent every step (the final observations of the vector env are sent once, as they are)
+    return [key for key, value in obs.items() if '/' not in key and image_format.applies_to(key, value)]
+
+
+class DeltaEncoder:
+    def __init__(self, image_format, keyframe_interval=30, history=8):
+        self.image_format = image_format
+        self.keyframe_interval = int(keyframe_interval)
+        self.history = int(history)
+        self.__frames = {}          # seq -> {key: array} of the last frames sent
+        self.__seq = 0
+        self.__ack = None
+        self.__since_keyframe = 0
+
+    @classmethod
+    def from_request(cls, params, image_format):
+        params = params if isinstance(params, dict) else {}
+        return cls(image_format, keyframe_interval=params.get('keyframe_interval', 30), history=params.get('history', 8))
+
+    def describe(self):
+        return {'keyframe_interval': self.keyframe_interval, 'history': self.history, 'compression': FAST_COMPRESSION}
+
+    def acknowledge(self, seq):
+        self.__ack = seq
+
+    def force_keyframe(self):
+        self.__since_keyframe = self.keyframe_interval
+
+    def encode(self, obs):
+        '''
+        Replaces the images of the observation with the compressed keyframe or delta. Returns (obs, meta) where meta is
+        the 'stream_frame' header entry (None if the observation has no images).
+        '''
+        keys = _select(obs, self.image_format)
+        if not keys:
+            return obs, None
+
+        reference = self.__frames.get(self.__ack)
+        if reference is None or self.__since_keyframe >= self.keyframe_interval or any(
+                key not in reference or reference[key].shape != obs[key].shape for key in keys):
+            reference = None
+
+        self.__seq += 1
+        frames = {}
+        encoded = dict(obs)
+        meta = {'seq': self.__seq, 'ref': self.__ack if reference is not None else None, 'compression': FAST_COMPRESSION, 'keys': {}}
+        for key in keys:
+            frame = np.ascontiguousarray(obs[key])
+            # The env may reuse its buffers, so the server keeps its own copy of the frames
+            frames[key] = frame.copy()
+            data = frame if reference is None else np.bitwise_xor(frame, reference[key])
+            encoded[key] = np.frombuffer(compress_bytes(data, FAST_COMPRESSION), dtype=np.uint8)
+            meta['keys'][key] = {'dtype': frame.dtype.str, 'shape': list(frame.shape)}
+
+        self.__since_keyframe = 0 if reference is None else self.__since_keyframe + 1
+        self.__frames[self.__seq] = frames
+        for seq in [seq for seq in self.__frames if seq <= self.__seq - self.history]:
+            del self.__frames[seq]
+        return encoded, meta
+
+    def keyframe(self, seq):
+        '''
+        Returns (obs, meta) with the images of a frame already sent, encoded as a keyframe (for a client that couldn't
+        decode it). obs only has the images.
+        '''
+        frames = self.__frames.get(seq)
+        if frames is None:
+            raise RuntimeError(f"Stream frame {seq} is no longer in the server history ({self.history} frames)")
+        encoded = {}
+        meta = {'seq': seq, 'ref': None, 'compression': FAST_COMPRESSION, 'keys': {}}
+        for key, frame in frames.items():
+            encoded[key] = np.frombuffer(compress_bytes(frame, FAST_COMPRESSION), dtype=np.uint8)
+            meta['keys'][key] = {'dtype': frame.dtype.str, 'shape': list(frame.shape)}
+        return encoded, meta
+
+
+class DeltaDecoder:
+    def __init__(self, history=8):
+        self.history = int(history)
+        self.__frames = {}
+        self.ack = None
+
+    def reset(self):
+        self.__frames = {}
+        self.ack = None
+
+    def decode(self, obs, meta):
+        '''
+        Rebuilds the images of a received observation (in place). The returned arrays are read-only because they are
+        also the references of the next deltas.
+        '''
+        reference = None
+        if meta['ref'] is not None:
+            reference = self.__frames.get(meta['ref'])
+            if reference is None:
+                # Without the reference the frame can't be rebuilt: the client asks for it as a keyframe, and the next
+                # requests don't send an ack so the next frames are keyframes too
+                self.ack = None
+                raise MissingReference(meta['seq'], meta['ref'])
+
+        frames = {}
+        for key, info in meta['keys'].items():
+            data = np.frombuffer(decompress_bytes(obs[key], meta['compression']), dtype=np.dtype(info['dtype']))
+            frame = data.reshape(info['shape']) if reference is None else np.bitwise_xor(data.reshape(info['shape']), reference[key])
+            frame.flags.writeable = False
+            frames[key] = frame
+            obs[key] = frame
+
+        self.__frames[meta['seq']] = frames
+        for seq in [seq for seq in self.__frames if seq <= meta['seq'] - self.history]:
+            del self.__frames[seq]
+        # Replies may be consumed out of order (pipelined requests), the newest decoded frame is the acknowledged one
+        self.ack = meta['seq'] if self.ack is None else max(self.ack, meta['seq'])
+        return obs
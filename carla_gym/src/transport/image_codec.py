@@ -0,0 +1,215 @@
+'''
+Image Codec Module:
+    It provides the per-client image format negotiated in the 'hello' command of carla_server.py. Every client declares
+    the resolution, channel order and compression it wants, and the server resizes and encodes the images once, before
+    sending them, instead of every client receiving the full resolution frames and doing it on its own.
+
+    Image format (the 'image' parameter of hello, every field is optional):
+        - size:          [height, width] of the images, None keeps the size of the camera
+        - channel_order: 'rgb' (the order of the env observations) or 'bgr'
+        - compression:   'raw', 'png', 'jpeg' or 'lz4'. If the lz4 package is not installed 'lz4' falls back to
+                         zlib with the fastest level, the chosen compression is sent back in the hello response
+        - quality:       JPEG quality (0-100)
+        - keys:          Observation keys to transform, by default every uint8 array with a HxWxC shape
+
+    Compressed images are sent as a flat uint8 array with the concatenated blobs (one blob per image, batched
+    observations have one image per env), and the message header gets an 'image_codec' entry to decode them:
+        {key: {'compression': ..., 'shape': [...decoded shape...], 'sizes': [...blob sizes...]}}
+'''
+
+import zlib
+import numpy as np
+from gymnasium import spaces
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+CHANNELS_RGB = 'rgb'
+CHANNELS_BGR = 'bgr'
+SUPPORTED_CHANNEL_ORDERS = [CHANNELS_RGB, CHANNELS_BGR]
+
+COMPRESSION_RAW  = 'raw'
+COMPRESSION_PNG  = 'png'
+COMPRESSION_JPEG = 'jpeg'
+COMPRESSION_LZ4  = 'lz4'
+COMPRESSION_ZLIB = 'zlib'
+SUPPORTED_COMPRESSIONS = [COMPRESSION_RAW, COMPRESSION_PNG, COMPRESSION_JPEG, COMPRESSION_LZ4, COMPRESSION_ZLIB]
+
+IMAGE_CODEC_KEY = 'image_codec'
+
+# Fast general purpose compression (used for the raw bytes of the 'lz4' images and the delta frames of delta.py)
+FAST_COMPRESSION = COMPRESSION_LZ4 if lz4_frame is not None else COMPRESSION_ZLIB
+
+
+def compress_bytes(data, compression=FAST_COMPRESSION):
+    if compression == COMPRESSION_LZ4:
+        return lz4_frame.compress(data)
+    return zlib.compress(data, 1)
+
+def decompress_bytes(data, compression=FAST_COMPRESSION):
+    if compression == COMPRESSION_LZ4:
+        return lz4_frame.decompress(data)
+    return zlib.decompress(data)
+
+
+def _is_image(value):
+    return isinstance(value, np.ndarray) and value.dtype == np.uint8 and value.ndim >= 3 and value.shape[-1] in (1, 3, 4)
+
+
+class ImageFormat:
+    def __init__(self, size=None, channel_order=CHANNELS_RGB, compression=COMPRESSION_RAW, quality=90, keys=None):
+        if channel_order not in SUPPORTED_CHANNEL_ORDERS:
+            raise ValueError(f"Unknown channel order {channel_order}, available: {SUPPORTED_CHANNEL_ORDERS}")
+        if compression not in SUPPORTED_COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, available: {SUPPORTED_COMPRESSIONS}")
+        if compression == COMPRESSION_LZ4:
+            compression = FAST_COMPRESSION
+        if (compression in (COMPRESSION_PNG, COMPRESSION_JPEG) or size is not None) and cv2 is None:
+            raise ValueError("Resizing and PNG/JPEG compression need OpenCV (cv2) on the server")
+
+        self.size = tuple(int(s) for s in size) if size is not None else None
+        self.channel_order = channel_order
+        self.compression = compression
+        self.quality = int(quality)
+        self.keys = set(keys) if keys is not None else None
+
+    @classmethod
+    def from_request(cls, params):
+        if not params:
+            return cls()
+        return cls(size=params.get('size'), channel_order=params.get('channel_order', CHANNELS_RGB),
+                   compression=params.get('compression', COMPRESSION_RAW), quality=params.get('quality', 90),
+                   keys=params.get('keys'))
+
+    def describe(self):
+        return {'size': list(self.size) if self.size is not None else None, 'channel_order': self.channel_order,
+                'compression': self.compression, 'quality': self.quality,
+                'keys': sorted(self.keys) if self.keys is not None else None}
+
+    @property
+    def is_identity(self):
+        return self.size is None and self.channel_order == CHANNELS_RGB and self.compression == COMPRESSION_RAW
+
+    @property
+    def is_compressed(self):
+        return self.compression != COMPRESSION_RAW
+
+    def applies_to(self, key, value):
+        # Final observations of the vector env are sent as 'final_obs/<i>/<key>'
+        if self.keys is not None and key.rsplit('/', 1)[-1] not in self.keys:
+            return False
+        return _is_image(value)
+
+    # ====================================== Spaces ======================================
+    def transform_space(self, space):
+        '''
+        Returns the observation space seen by the client (the image Boxes with the negotiated size).
+        '''
+        if self.size is None:
+            return space
+        subspaces = {}
+        for key, subspace in space.spaces.items():
+            if self._is_image_space(key, subspace):
+                shape = subspace.shape[:-3] + self.size + subspace.shape[-1:]
+                subspace = spaces.Box(low=0, high=255, shape=shape, dtype=np.uint8)
+            subspaces[key] = subspace
+        return spaces.Dict(subspaces)
+
+    def wire_space(self, space):
+        '''
+        Returns the space of the arrays that keep a fixed shape on the wire (used to lay out the shared memory ring).
+        Compressed images have a variable size, so they are left out.
+        '''
+        space = self.transform_space(space)
+        if not self.is_compressed:
+            return space
+        return spaces.Dict({key: subspace for key, subspace in space.spaces.items() if not self._is_image_space(key, subspace)})
+
+    def _is_image_space(self, key, subspace):
+        if self.keys is not None and key not in self.keys:
+            return False
+        return isinstance(subspace, spaces.Box) and subspace.dtype == np.uint8 and len(subspace.shape) >= 3 and subspace.shape[-1] in (1, 3, 4)
+
+    # ====================================== Encoding ======================================
+    def encode(self, obs):
+        '''
+        Resizes, reorders and compresses the images of the observation. Returns (obs, codec) where codec is the header
+        entry needed to decode the compressed images (None if nothing was compressed).
+        '''
+        if self.is_identity:
+            return obs, None
+        encoded = {}
+        codec = {}
+        for key, value in obs.items():
+            if not self.applies_to(key, value):
+                encoded[key] = value
+                continue
+            images = self._transform(value)
+            if self.is_compressed:
+                blobs = [self._compress(image) for image in images.reshape((-1,) + images.shape[-3:])]
+                encoded[key] = np.frombuffer(b''.join(blobs), dtype=np.uint8)
+                codec[key] = {'compression': self.compression, 'shape': list(images.shape), 'sizes': [len(blob) for blob in blobs]}
+            else:
+                encoded[key] = images
+        return encoded, codec or None
+
+    def _transform(self, value):
+        if self.size is None and self.channel_order == CHANNELS_RGB:
+            return value
+        height, width, channels = value.shape[-3:]
+        flat = value.reshape((-1, height, width, channels))
+        out_height, out_width = self.size if self.size is not None else (height, width)
+        out = np.empty((flat.shape[0], out_height, out_width, channels), dtype=np.uint8)
+        for image, dst in zip(flat, out):
+            if (out_height, out_width) != (height, width):
+                # INTER_AREA when shrinking avoids aliasing, the camera frames are usually downscaled
+                interpolation = cv2.INTER_AREA if out_height < height else cv2.INTER_LINEAR
+                image = cv2.resize(image, (out_width, out_height), interpolation=interpolation).reshape(dst.shape)
+            if self.channel_order == CHANNELS_BGR and channels >= 3:
+                dst[..., 0], dst[..., 1], dst[..., 2] = image[..., 2], image[..., 1], image[..., 0]
+                dst[..., 3:] = image[..., 3:]
+            else:
+                dst[...] = image
+        return out.reshape(value.shape[:-3] + out.shape[1:])
+
+    def _compress(self, image):
+        if self.compression == COMPRESSION_PNG:
+            # Fastest PNG level, the images are small and the point is saving bandwidth without stalling the server
+            ok, blob = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        elif self.compression == COMPRESSION_JPEG:
+            ok, blob = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        else:
+            return compress_bytes(np.ascontiguousarray(image), self.compression)
+        if not ok:
+            raise RuntimeError(f"Failed to encode image as {self.compression}")
+        return blob.tobytes()
+
+
+# ====================================== Decoding ======================================
+def decode_images(obs, codec):
+    '''
+    Rebuilds the compressed images of a received observation (in place), codec is the 'image_codec' header entry.
+    '''
+    for key, meta in codec.items():
+        data = obs[key]
+        shape = tuple(meta['shape'])
+        out = np.empty(shape, dtype=np.uint8)
+        flat = out.reshape((-1,) + shape[-3:])
+        offset = 0
+        for dst, size in zip(flat, meta['sizes']):
+            blob = data[offset:offset + size]
+            offset += size
+            if meta['compression'] in (COMPRESSION_PNG, COMPRESSION_JPEG):
+                image = cv2.imdecode(blob, cv2.IMREAD_UNCHANGED)
+            else:
+                image = np.frombuffer(decompress_bytes(blob, meta['compression']), dtype=np.uint8)
+            dst[...] = image.reshape(dst.shape)
+        obs[key] = out
+    return obs
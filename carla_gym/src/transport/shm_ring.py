@@ -0,0 +1,152 @@
+'''
+Shared Memory Ring Module:
+    It provides a ring of preallocated observation slots in shared memory, so that when the env server and its client run
+    on the same host the observations are written only once and only the slot index travels over ZMQ.
+
+    The ring is a memory mapped file placed in /dev/shm (or the temporary directory if it doesn't exist). A plain file
+    is used instead of multiprocessing.shared_memory because the server side still runs on Python 3.7.
+
+    Slot layout:
+        [uint64 sequence number][array 0][array 1]...  (every entry is aligned to 64 bytes)
+
+    The sequence number is written after the arrays, so the reader can detect when a slot was already overwritten by
+    the writer (the client lagged more than num_slots observations behind).
+'''
+
+import os
+import mmap
+import uuid
+import tempfile
+import numpy as np
+from gymnasium import spaces
+
+ALIGNMENT = 64
+SEQ_DTYPE = np.dtype('<u8')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _default_directory():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+def layout_from_space(space, num_slots):
+    '''
+    Builds the ring layout from a gymnasium Dict space. Only the Box entries are stored in the ring, the rest of the
+    observation (e.g., the Discrete situation) is small enough to go in the message header.
+    '''
+    entries = []
+    offset = _align(SEQ_DTYPE.itemsize)
+    for key, subspace in space.spaces.items():
+        if not isinstance(subspace, spaces.Box):
+            continue
+        dtype = np.dtype(subspace.dtype)
+        entries.append({'key': key, 'dtype': dtype.str, 'shape': list(subspace.shape), 'offset': offset})
+        offset = _align(offset + int(np.prod(subspace.shape)) * dtype.itemsize)
+
+    return {'entries': entries, 'slot_size': offset, 'num_slots': int(num_slots)}
+
+
+class ObservationRing:
+    def __init__(self, layout, path, create=False):
+        self.__layout = layout
+        self.__path = path
+        self.__owner = create
+        self.__slot_size = layout['slot_size']
+        self.__num_slots = layout['num_slots']
+        self.__next_slot = 0
+        self.__seq = 0
+
+        size = self.__slot_size * self.__num_slots
+        if create:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+            os.ftruncate(fd, size)
+        else:
+            fd = os.open(path, os.O_RDWR)
+        try:
+            self.__mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.__buffer = np.frombuffer(self.__mmap, dtype=np.uint8)
+
+        # Preallocated views for every slot, so writing/reading doesn't create any new object besides the dict
+        self.__seq_views = []
+        self.__slot_views = []
+        for slot in range(self.__num_slots):
+            base = slot * self.__slot_size
+            self.__seq_views.append(self.__buffer[base:base + SEQ_DTYPE.itemsize].view(SEQ_DTYPE))
+            views = {}
+            for entry in layout['entries']:
+                dtype = np.dtype(entry['dtype'])
+                start = base + entry['offset']
+                nbytes = int(np.prod(entry['shape'])) * dtype.itemsize
+                views[entry['key']] = self.__buffer[start:start + nbytes].view(dtype).reshape(entry['shape'])
+            self.__slot_views.append(views)
+
+    # ====================================== Constructors ======================================
+    @classmethod
+    def create(cls, space, num_slots=8, directory=None):
+        layout = layout_from_space(space, num_slots)
+        path = os.path.join(directory or _default_directory(), f'carla_obs_{os.getpid()}_{uuid.uuid4().hex[:8]}')
+        return cls(layout, path, create=True)
+
+    @classmethod
+    def attach(cls, description):
+        return cls(description['layout'], description['path'], create=False)
+
+    def describe(self):
+        return {'path': self.__path, 'layout': self.__layout}
+
+    # Keys of the observation stored in the slots
+    def keys(self):
+        return [entry['key'] for entry in self.__layout['entries']]
+
+    # ====================================== Writer ======================================
+    def write(self, obs):
+        '''
+        Copies the observation into the next slot. Returns (slot, seq, remaining) where remaining has the entries that
+        don't fit the layout (non-array values or arrays with a different shape or dtype) and must be sent in the message.
+        Nothing is cast, so the reader gets exactly the values of obs.
+        The keys written in the slot are the ones of obs that are not in remaining.
+        '''
+        slot = self.__next_slot
+        views = self.__slot_views[slot]
+        remaining = {}
+        for key, value in obs.items():
+            view = views.get(key)
+            if view is not None and isinstance(value, np.ndarray) and value.shape == view.shape and value.dtype == view.dtype:
+                np.copyto(view, value, casting='no')
+            else:
+                remaining[key] = value
+
+        self.__seq += 1
+        self.__seq_views[slot][0] = self.__seq
+        self.__next_slot = (slot + 1) % self.__num_slots
+        return slot, self.__seq, remaining
+
+    # ====================================== Reader ======================================
+    def read(self, slot, seq, keys=None, copy=False):
+        '''
+        Returns the observation stored in a slot (only the given keys, if any). Without copy the arrays are views over the
+        shared memory, so they are only valid until the writer wraps around the ring (num_slots observations later).
+        '''
+        if int(self.__seq_views[slot][0]) != seq:
+            raise RuntimeError(f"Shared memory slot {slot} was overwritten (expected seq {seq}, found {int(self.__seq_views[slot][0])})")
+        views = self.__slot_views[slot]
+        if keys is None:
+            keys = views.keys()
+        if copy:
+            return {key: views[key].copy() for key in keys}
+        return {key: views[key] for key in keys}
+
+    def close(self):
+        self.__buffer = None
+        self.__seq_views = []
+        self.__slot_views = []
+        try:
+            self.__mmap.close()
+        except BufferError:
+            # Some views are still alive on the caller's side, the mapping is released when they are garbage collected
+            pass
+        if self.__owner and os.path.exists(self.__path):
+            os.unlink(self.__path)
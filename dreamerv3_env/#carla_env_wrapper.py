@@ -1,25 +1,40 @@
 # Python 3.11
-import zmq
 import numpy as np
 import gymnasium as gym
 
+from carla_gym.src.transport.codec import ENCODING_BINARY
+from dreamerv3_env.remote_client import RemoteEnvClient
+
 class CarlaRemoteEnv(gym.Env):
-    def __init__(self):
-        self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REQ)
-        self.socket.connect("tcp://localhost:5555")
+    # encoding="shm" 只适用于服务器和客户端在同一主机的情况（run_carla_dreamerv3.sh 的部署方式）
+    # action_repeat 在服务器端执行（对应 configs/carla.yaml 的 env.action_repeat），每个决策只需一次往返
+    # image/stream 为服务器端的图像格式（分辨率、通道顺序、压缩）和差分流模式（见 RemoteEnvClient）
+    def __init__(self, address="tcp://localhost:5555", encoding=ENCODING_BINARY, shm_slots=8, timeout=None, action_repeat=1, image=None, stream=None):
+        self.action_repeat = action_repeat
+        self.client = RemoteEnvClient(address, encoding=encoding, shm_slots=shm_slots, timeout=timeout, image=image, stream=stream)
+        self.encoding = self.client.encoding
 
-        obs = self.reset()
-        self.obs_space = gym.spaces.Box(low=0, high=255, shape=np.array(obs).shape, dtype=np.float32)
+        obs, _ = self.reset()
+        self.obs_space = gym.spaces.Dict({
+            k: gym.spaces.Box(low=0, high=255, shape=v.shape, dtype=v.dtype) if v.dtype == np.uint8
+            else gym.spaces.Box(low=-np.inf, high=np.inf, shape=v.shape, dtype=v.dtype)
+            for k, v in obs.items() if isinstance(v, np.ndarray)
+        })
         self.act_space = gym.spaces.Box(low=-1.0, high=1.0, shape=(2,), dtype=np.float32)
 
-    def reset(self):
-        self.socket.send_json({"cmd": "reset"})
-        response = self.socket.recv_json()
-        return np.array(response["obs"], dtype=np.float32)
+    def reset(self, seed=None, options=None):
+        return self.client.reset()
+
+    # step_async/step_wait：发送动作后立即返回，服务器仿真的同时客户端可以做别的事（例如为其它环境推理）
+    def step_async(self, action):
+        self.client.step_async(action, self.action_repeat)
+
+    def step_wait(self, timeout=None):
+        return self.client.step_wait(timeout)
 
     def step(self, action):
-        self.socket.send_json({"cmd": "step", "action": action.tolist()})
-        response = self.socket.recv_json()
-        obs = np.array(response["obs"], dtype=np.float32)
-        return obs, response["reward"], response["done"], response["info"]
+        self.step_async(action)
+        return self.step_wait()
+
+    def close(self):
+        self.client.close()
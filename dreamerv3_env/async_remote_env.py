@@ -0,0 +1,235 @@
+# Python 3.11
+import math
+import time
+import asyncio
+import zmq
+import zmq.asyncio
+import numpy as np
+
+from carla_gym.src.transport.codec import ENCODING_BINARY
+from carla_gym.src.transport.delta import MissingReference
+from dreamerv3_env.remote_client import RemoteEnvBase
+
+class LatencyHistogram:
+    """
+    对数分桶的延迟直方图（默认1微秒到100秒，每个数量级20个桶，相对误差约12%），
+    内存固定，可以在整个训练过程中一直记录。
+    """
+
+    def __init__(self, min_latency=1e-6, max_latency=100.0, buckets_per_decade=20):
+        decades = math.log10(max_latency / min_latency)
+        self.edges = np.logspace(math.log10(min_latency), math.log10(max_latency), int(decades * buckets_per_decade) + 1)
+        self.reset()
+
+    def reset(self):
+        # 最后一个桶是超过 max_latency 的部分
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[np.searchsorted(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, q):
+        """返回第q百分位延迟（秒），取所在桶的上边界"""
+        if self.count == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count))
+        return float(min(self.edges[index], self.max)) if index < len(self.edges) else self.max
+
+    def summary(self):
+        """单位为毫秒"""
+        return {
+            "count": self.count,
+            "mean": 1000.0 * self.total / self.count if self.count else 0.0,
+            "p50": 1000.0 * self.percentile(50),
+            "p95": 1000.0 * self.percentile(95),
+            "p99": 1000.0 * self.percentile(99),
+            "max": 1000.0 * self.max
+        }
+
+class AsyncRemoteEnvClient(RemoteEnvBase):
+    """
+    carla_server.py 的asyncio客户端，一个进程（一个事件循环）可以同时驱动很多个环境服务器。
+    - 每次调用都有截止时间：step 默认使用 timeout（环境变量 ZMQ_STEP_TIMEOUT），连接和 reset 等其它请求使用
+      reset_timeout（环境变量 ZMQ_RESET_TIMEOUT），因为服务器可能还在启动CARLA或加载地图
+    - 超时或连接出错时自动重连（新的套接字和会话），并重新开始回合：step 返回重置后的观测，truncated=True，
+      info["restarted"] 记录原因
+    - reset/step 的延迟记录在 latency 直方图中（p50/p95/p99）
+    用法：先 await connect()，结束时 await close()。
+    """
+
+    def __init__(self, address="tcp://localhost:5555", encoding=ENCODING_BINARY, shm_slots=8, timeout=None, image=None, stream=None,
+                 max_reconnects=3, reconnect_delay=1.0, reset_timeout=None):
+        self._init_protocol(address, encoding, shm_slots, timeout, image, stream, reset_timeout)
+        self.context = zmq.asyncio.Context.instance()
+        self.socket = None
+        self.max_reconnects = max_reconnects
+        self.reconnect_delay = reconnect_delay
+        self.reconnects = 0
+        self.latency = {"reset": LatencyHistogram(), "step": LatencyHistogram()}
+        self._waiters = {}        # 请求id -> Future
+        self._reader = None
+
+    # ====================================== 连接 ======================================
+    async def connect(self, timeout=None):
+        self._open_socket()
+        header, _ = await self.request("hello", self._hello_params(), timeout)
+        if not self._apply_hello(header):
+            header, _ = await self.request("hello", self._hello_params(fallback=True), timeout)
+            self._apply_hello(header)
+
+    async def reconnect(self, timeout=None):
+        """
+        丢弃旧的套接字（以及其中未完成的请求），用新的身份重新连接和协商。
+        服务器把新连接当作新的客户端，旧会话的差分帧参考和共享内存都不再使用。
+        """
+        self.reconnects += 1
+        self._close_socket(ConnectionError(f"{self.address}: 重新连接"))
+        await self.connect(timeout)
+
+    def _open_socket(self):
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(self.address)
+        self._reader = asyncio.get_running_loop().create_task(self._read_loop())
+
+    def _close_socket(self, error):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        for future in self._waiters.values():
+            if not future.done():
+                future.set_exception(error)
+        self._waiters = {}
+        self._pending.clear()
+        self._received.clear()
+        self._step_ids = []
+        self._close_shm()
+        if self.delta is not None:
+            self.delta.reset()
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    async def _read_loop(self):
+        # 所有回复都由这个任务接收，再按请求id唤醒等待者
+        while True:
+            frames = await self.socket.recv_multipart(copy=False)
+            request_id = self._accept_reply(frames)
+            future = self._waiters.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    # ====================================== 请求/回复 ======================================
+    async def request(self, cmd, params=None, timeout=None):
+        """发送请求并等待回复，超过截止时间抛出TimeoutError（迟到的回复会被丢弃）"""
+        if timeout is None:
+            timeout = self.timeout if cmd == "step" else self.reset_timeout
+        request_id, frames = self._encode_request(cmd, params)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = future
+        await self.socket.send_multipart(frames)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._waiters.pop(request_id, None)
+            self._pending.discard(request_id)
+            raise TimeoutError(f"{self.address}: {cmd} 请求 {request_id} 在 {timeout} 秒内没有回复")
+        header, obs = self._received.pop(request_id)
+        try:
+            return self._finish_reply(header, obs)
+        except MissingReference as e:
+            # 丢失了参考帧，取回这一帧的关键帧，对调用者透明
+            _, keyframe_obs = await self.request("keyframe", {"seq": e.seq}, timeout)
+            return self._finish_reply(*self._apply_keyframe(header, obs, keyframe_obs))
+
+    # ====================================== 环境命令 ======================================
+    async def reset(self, timeout=None):
+        start = time.perf_counter()
+        try:
+            header, obs = await self.request("reset", timeout=timeout)
+        except (TimeoutError, ConnectionError, zmq.ZMQError) as e:
+            return await self._restart(e)
+        self.latency["reset"].record(time.perf_counter() - start)
+        return obs, header.get("info", {})
+
+    # repeat: 服务器端的动作重复次数（None 表示使用服务器上环境的设置）
+    async def step(self, action, repeat=None, timeout=None):
+        params = {"action": np.asarray(action).tolist()}
+        if repeat is not None:
+            params["repeat"] = repeat
+        start = time.perf_counter()
+        try:
+            header, obs = await self.request("step", params, timeout)
+        except (TimeoutError, ConnectionError, zmq.ZMQError) as e:
+            # 服务器上回合的状态未知，重连后从新回合开始，当前回合按截断处理
+            obs, info = await self._restart(e)
+            return obs, 0.0, False, True, info
+        self.latency["step"].record(time.perf_counter() - start)
+        return obs, header["reward"], header["terminated"], header["truncated"], header["info"]
+
+    # 重连和重置使用 reset_timeout，而不是step的截止时间（服务器可能仍在处理之前的 reset）
+    async def _restart(self, error):
+        for attempt in range(self.max_reconnects):
+            print(f"⚠️ {error}，重连并重新开始回合 ({attempt + 1}/{self.max_reconnects})")
+            try:
+                await self.reconnect()
+                header, obs = await self.request("reset")
+                info = header.get("info", {})
+                info["restarted"] = str(error)
+                return obs, info
+            except (TimeoutError, ConnectionError, zmq.ZMQError) as e:
+                error = e
+                await asyncio.sleep(self.reconnect_delay * 2 ** attempt)
+        raise ConnectionError(f"{self.address}: 重连 {self.max_reconnects} 次后仍然失败: {error}")
+
+    def latency_summary(self):
+        return {cmd: histogram.summary() for cmd, histogram in self.latency.items()}
+
+    async def close(self, close_env=False, timeout=1.0):
+        if self.socket is not None:
+            try:
+                await self.request("close" if close_env else "bye", timeout=timeout)
+            except (TimeoutError, ConnectionError, RuntimeError, zmq.ZMQError):
+                pass
+        self._close_socket(ConnectionError(f"{self.address}: 客户端已关闭"))
+
+class AsyncRemoteEnvPool:
+    """在一个事件循环中并发驱动多个环境服务器，每个服务器一个 AsyncRemoteEnvClient"""
+
+    def __init__(self, addresses, **kwargs):
+        self.clients = [AsyncRemoteEnvClient(address, **kwargs) for address in addresses]
+
+    async def connect(self):
+        await asyncio.gather(*(client.connect() for client in self.clients))
+
+    async def reset(self, timeout=None):
+        return await asyncio.gather(*(client.reset(timeout) for client in self.clients))
+
+    async def step(self, actions, repeat=None, timeout=None):
+        return await asyncio.gather(*(client.step(action, repeat, timeout) for client, action in zip(self.clients, actions)))
+
+    def latency_summary(self):
+        """所有服务器合并后的延迟分布（毫秒）"""
+        merged = {}
+        for client in self.clients:
+            for cmd, histogram in client.latency.items():
+                if cmd not in merged:
+                    merged[cmd] = LatencyHistogram()
+                merged[cmd].merge(histogram)
+        return {cmd: histogram.summary() for cmd, histogram in merged.items()}
+
+    async def close(self, close_env=False):
+        await asyncio.gather(*(client.close(close_env) for client in self.clients))
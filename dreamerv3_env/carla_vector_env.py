@@ -0,0 +1,105 @@
+# Python 3.11
+import numpy as np
+import gymnasium as gym
+from gymnasium.vector import AutoresetMode
+from gymnasium.vector.utils import batch_space
+
+from carla_gym.src.transport.codec import ENCODING_BINARY, build_space
+from dreamerv3_env.remote_client import RemoteEnvClient
+
+FINAL_OBS_PREFIX = "final_obs/"
+
+class CarlaRemoteVectorEnv(gym.vector.VectorEnv):
+    """
+    客户端的VectorEnv：每个carla_server.py进程托管若干个CarlaEnv（--num-envs），每个服务器每一步只需一次往返（step_batch）。
+    可以传入多个服务器地址：step_async 同时向所有服务器发送动作，step_wait 再收集结果，所有服务器并行仿真。
+    结束的环境由服务器在同一步内自动重置，最终观测放在 infos["final_obs"]，最终info放在 infos["final_info"]。
+    """
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    # action_repeat 在服务器端执行，每个决策只需一次往返；image/stream 为服务器端的图像格式和差分流模式（见 RemoteEnvClient）
+    # timeout 只用于 step，reset_timeout 用于 spaces/reset 等请求（见 RemoteEnvClient）
+    def __init__(self, address="tcp://localhost:5555", encoding=ENCODING_BINARY, shm_slots=8, timeout=None, action_repeat=1, image=None, stream=None, reset_timeout=None):
+        self.action_repeat = action_repeat
+        addresses = [address] if isinstance(address, str) else list(address)
+        self.clients = [RemoteEnvClient(a, encoding=encoding, shm_slots=shm_slots, timeout=timeout, image=image, stream=stream, reset_timeout=reset_timeout, batch=True) for a in addresses]
+
+        self.client_num_envs = []
+        for client in self.clients:
+            header, _ = client.request("spaces")
+            self.client_num_envs.append(header["num_envs"])
+        self.num_envs = sum(self.client_num_envs)
+        self.single_observation_space = build_space(header["observation_space"])
+        self.single_action_space = build_space(header["action_space"])
+        self.observation_space = batch_space(self.single_observation_space, self.num_envs)
+        self.action_space = batch_space(self.single_action_space, self.num_envs)
+        self.closed = False
+        self._step_ids = None
+
+    def reset(self, *, seed=None, options=None):
+        if isinstance(seed, int):
+            seed = [seed + i for i in range(self.num_envs)]
+        request_ids = []
+        for client, (start, end) in zip(self.clients, self._ranges()):
+            request_ids.append(client.send("reset_batch", {"seeds": seed[start:end] if seed is not None else None, "options": options}))
+        results = [client.recv(request_id) for client, request_id in zip(self.clients, request_ids)]
+
+        obs = self._concat([o for _, o in results])
+        infos = self._vector_infos([info for header, _ in results for info in header["infos"]])
+        return obs, infos
+
+    def step_async(self, actions):
+        actions = np.asarray(actions)
+        self._step_ids = [client.send("step_batch", {"actions": actions[start:end].tolist(), "repeat": self.action_repeat})
+                          for client, (start, end) in zip(self.clients, self._ranges())]
+
+    def step_wait(self, timeout=None):
+        results = [client.recv(request_id, client.timeout if timeout is None else timeout) for client, request_id in zip(self.clients, self._step_ids)]
+        self._step_ids = None
+
+        # 取出自动重置前的最终观测（服务器内的索引加上该服务器的偏移）
+        final_obs = [None] * self.num_envs
+        for (_, obs), (start, _) in zip(results, self._ranges()):
+            for key in [k for k in obs if k.startswith(FINAL_OBS_PREFIX)]:
+                _, index, obs_key = key.split("/", 2)
+                index = start + int(index)
+                if final_obs[index] is None:
+                    final_obs[index] = {}
+                final_obs[index][obs_key] = obs.pop(key)
+
+        obs = self._concat([o for _, o in results])
+        infos = self._vector_infos([info for header, _ in results for info in header["infos"]])
+        if any(o is not None for o in final_obs):
+            infos["final_obs"] = np.array(final_obs, dtype=object)
+            infos["_final_obs"] = np.array([o is not None for o in final_obs])
+
+        return (obs,
+                np.asarray([r for header, _ in results for r in header["rewards"]], dtype=np.float64),
+                np.asarray([t for header, _ in results for t in header["terminated"]], dtype=np.bool_),
+                np.asarray([t for header, _ in results for t in header["truncated"]], dtype=np.bool_),
+                infos)
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def _ranges(self):
+        start = 0
+        for n in self.client_num_envs:
+            yield start, start + n
+            start += n
+
+    def _concat(self, obs_list):
+        if len(obs_list) == 1:
+            return obs_list[0]
+        return {key: np.concatenate([obs[key] for obs in obs_list]) for key in obs_list[0]}
+
+    def _vector_infos(self, env_infos):
+        infos = {}
+        for i, info in enumerate(env_infos):
+            infos = self._add_info(infos, info, i)
+        return infos
+
+    def close_extras(self, **kwargs):
+        for client in self.clients:
+            client.close(close_env=True)
@@ -0,0 +1,201 @@
+# Python 3.11
+import os
+import json
+import time
+import zmq
+import numpy as np
+
+from carla_gym.src.transport.codec import ENCODING_BINARY, ENCODING_JSON, ENCODING_SHM, decode_message
+from carla_gym.src.transport.shm_ring import ObservationRing
+from carla_gym.src.transport.image_codec import IMAGE_CODEC_KEY, decode_images
+from carla_gym.src.transport.delta import STREAM_KEY, DeltaDecoder, MissingReference
+
+# run_carla_dreamerv3.sh 导出的超时（秒），未设置时一直等待：
+#   ZMQ_STEP_TIMEOUT: 只用于 step（一次决策的仿真）
+#   ZMQ_RESET_TIMEOUT: 其它请求（hello/spaces/init/reset等），服务器可能正在启动CARLA、执行gym.make或加载地图，需要长得多的时间
+def _env_timeout(name):
+    return float(os.environ[name]) if os.environ.get(name) else None
+
+DEFAULT_STEP_TIMEOUT = _env_timeout("ZMQ_STEP_TIMEOUT")
+DEFAULT_RESET_TIMEOUT = _env_timeout("ZMQ_RESET_TIMEOUT")
+
+class RemoteEnvBase:
+    """
+    同步客户端（RemoteEnvClient）和asyncio客户端（AsyncRemoteEnvClient）共用的协议部分：
+    hello协商、请求编码，以及回复中共享内存、差分帧和压缩图像的解码。
+    """
+
+    def _init_protocol(self, address, encoding, shm_slots, timeout, image, stream, reset_timeout=None, batch=False):
+        self.address = address
+        # step 的默认超时和其它请求（hello/spaces/init/reset等）的默认超时（秒），None表示一直等待
+        self.timeout = DEFAULT_STEP_TIMEOUT if timeout is None else timeout
+        self.reset_timeout = DEFAULT_RESET_TIMEOUT if reset_timeout is None else reset_timeout
+        self.shm_ring = None
+        self.delta = None
+        # batch: 客户端使用 reset_batch/step_batch，服务器按堆叠后的观测分配共享内存槽位
+        self._hello = {"encodings": [encoding, ENCODING_BINARY, ENCODING_JSON], "shm_slots": shm_slots, "image": image, "stream": stream, "batch": batch}
+
+        self._next_id = 0
+        self._pending = set()     # 已发送、尚未收到回复的请求id
+        self._received = {}       # 先于等待者到达的回复: id -> (header, obs)
+        self._step_ids = []       # step_async 发出的请求id（先进先出）
+
+    def _hello_params(self, fallback=False):
+        params = dict(self._hello)
+        if fallback:
+            # 服务器不在本机，退回二进制编码
+            params["encodings"] = [ENCODING_BINARY, ENCODING_JSON]
+        return params
+
+    def _apply_hello(self, header):
+        """返回False表示协商到了shm但服务器不在本机，需要用 _hello_params(fallback=True) 重新协商"""
+        self._close_shm()
+        if header["encoding"] == ENCODING_SHM:
+            if not os.path.exists(header["shm"]["path"]):
+                return False
+            self.shm_ring = ObservationRing.attach(header["shm"])
+        self.encoding = header["encoding"]
+        self.image_format = header.get("image")
+        self.delta = DeltaDecoder(header["stream"]["history"]) if header.get("stream") else None
+        return True
+
+    def _encode_request(self, cmd, params=None):
+        """返回 (请求id, 帧列表)"""
+        request_id = self._next_id
+        self._next_id += 1
+        params = dict(params or {})
+        if self.delta is not None and self.delta.ack is not None:
+            params["ack"] = self.delta.ack
+        self._pending.add(request_id)
+        return request_id, [b"", json.dumps({"id": request_id, "cmd": cmd, "params": params}).encode()]
+
+    def _accept_reply(self, frames):
+        """解码收到的帧，属于未完成请求的回复放入 _received（已放弃的请求的迟到回复被丢弃）"""
+        # 去掉空分隔帧
+        frames = frames[1:] if len(frames[0]) == 0 else frames
+        header, obs = decode_message(frames)
+        if header.get("id") in self._pending:
+            self._pending.discard(header["id"])
+            self._received[header["id"]] = (header, obs)
+            return header["id"]
+        return None
+
+    def _finish_reply(self, header, obs):
+        """
+        解码回复中的观测。差分帧缺少参考帧时抛出MissingReference，header和obs保持不变，
+        调用者用 keyframe 命令取回这一帧后交给 _apply_keyframe，再重新调用本方法。
+        """
+        if header.get("status") != "success":
+            raise RuntimeError(header.get("message"))
+        if "shm_slot" in header and self.shm_ring is not None:
+            # 数组直接在共享内存中原地读取，仅在之后的 shm_slots 步内有效
+            obs.update(self.shm_ring.read(header["shm_slot"], header["shm_seq"], header["shm_keys"]))
+        if STREAM_KEY in header:
+            obs = self.delta.decode(obs, header[STREAM_KEY])
+            del header[STREAM_KEY]
+        if IMAGE_CODEC_KEY in header:
+            obs = decode_images(obs, header.pop(IMAGE_CODEC_KEY))
+        return header, obs
+
+    @staticmethod
+    def _apply_keyframe(header, obs, keyframe_obs):
+        """用重新发送的关键帧（已解码）替换回复中无法解码的差分图像"""
+        del header[STREAM_KEY]
+        obs.update(keyframe_obs)
+        return header, obs
+
+    def _close_shm(self):
+        if self.shm_ring is not None:
+            self.shm_ring.close()
+            self.shm_ring = None
+
+class RemoteEnvClient(RemoteEnvBase):
+    """
+    carla_server.py 的DEALER客户端。
+    每个请求带有递增的请求id，可以同时有多个未完成的请求（send/recv，step_async/step_wait），
+    因此一个进程可以让多个服务器同时工作，并把策略推理和仿真重叠起来。每个请求都有自己的超时。
+    """
+
+    # image: 图像格式 {"size": [h, w], "channel_order": "rgb"/"bgr", "compression": "raw"/"png"/"jpeg"/"lz4", "quality": 90}，
+    #        由服务器在发送前缩放和压缩（见 carla_gym/src/transport/image_codec.py），None表示原始图像
+    # stream: 跨节点部署时使用关键帧 + 差分帧（True 或 {"keyframe_interval": 30}，见 carla_gym/src/transport/delta.py）
+    # timeout: step 的默认超时（秒），None时使用环境变量 ZMQ_STEP_TIMEOUT
+    # reset_timeout: 其它请求的默认超时（秒），None时使用环境变量 ZMQ_RESET_TIMEOUT
+    # batch: 使用 reset_batch/step_batch 命令（CarlaRemoteVectorEnv），而不是 reset/step
+    def __init__(self, address="tcp://localhost:5555", encoding=ENCODING_BINARY, shm_slots=8, timeout=None, image=None, stream=None, reset_timeout=None, batch=False):
+        self._init_protocol(address, encoding, shm_slots, timeout, image, stream, reset_timeout, batch)
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(address)
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+
+        # 协商观测编码，json只作为调试时的后备方案
+        header, _ = self.request("hello", self._hello_params())
+        if not self._apply_hello(header):
+            header, _ = self.request("hello", self._hello_params(fallback=True))
+            self._apply_hello(header)
+
+    # ====================================== 请求/回复 ======================================
+    def send(self, cmd, params=None):
+        """发送请求但不等待回复，返回请求id"""
+        request_id, frames = self._encode_request(cmd, params)
+        self.socket.send_multipart(frames)
+        return request_id
+
+    def recv(self, request_id, timeout=None):
+        """
+        等待指定请求的回复，其它请求的回复先缓存。超时后放弃该请求（迟到的回复会被丢弃）并抛出TimeoutError。
+        timeout为None时使用 reset_timeout（step 的回复由 step_wait 按 self.timeout 等待）
+        """
+        timeout = self.reset_timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while request_id not in self._received:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self._pending.discard(request_id)
+                raise TimeoutError(f"{self.address}: 请求 {request_id} 在 {timeout} 秒内没有回复")
+            if not self.poller.poll(None if remaining is None else int(remaining * 1000) + 1):
+                continue
+            self._accept_reply(self.socket.recv_multipart(copy=False))
+
+        header, obs = self._received.pop(request_id)
+        try:
+            return self._finish_reply(header, obs)
+        except MissingReference as e:
+            # 丢失了参考帧（例如流水线请求超过了history），取回这一帧的关键帧，对调用者透明
+            _, keyframe_obs = self.request("keyframe", {"seq": e.seq}, timeout)
+            return self._finish_reply(*self._apply_keyframe(header, obs, keyframe_obs))
+
+    def request(self, cmd, params=None, timeout=None):
+        return self.recv(self.send(cmd, params), timeout)
+
+    # ====================================== 环境命令 ======================================
+    def reset(self, timeout=None):
+        header, obs = self.request("reset", timeout=timeout)
+        return obs, header.get("info", {})
+
+    # repeat: 服务器端的动作重复次数（None 表示使用服务器上环境的设置）
+    def step_async(self, action, repeat=None):
+        params = {"action": np.asarray(action).tolist()}
+        if repeat is not None:
+            params["repeat"] = repeat
+        self._step_ids.append(self.send("step", params))
+
+    def step_wait(self, timeout=None):
+        header, obs = self.recv(self._step_ids.pop(0), self.timeout if timeout is None else timeout)
+        return obs, header["reward"], header["terminated"], header["truncated"], header["info"]
+
+    def step(self, action, repeat=None, timeout=None):
+        self.step_async(action, repeat)
+        return self.step_wait(timeout)
+
+    def close(self, close_env=False, timeout=1.0):
+        try:
+            self.request("close" if close_env else "bye", timeout=timeout)
+        except (TimeoutError, RuntimeError):
+            pass
+        finally:
+            self._close_shm()
+            self.socket.close()
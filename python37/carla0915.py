@@ -1,8 +1,9 @@
 import socket
-import json
 import time
 import numpy as np
 
+from lane_keeping_protocol import CMD_RESET, CMD_STEP, recv_frame, decode_request, send_observation, send_error
+
 try:
     import carla
 except ImportError:
@@ -36,6 +37,7 @@ class CarlaLaneKeepingServer:
         self.host = host
         self.port = port
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server.bind((host, port))
         self.server.listen(1)
         self.vehicle = None
@@ -72,8 +74,8 @@ class CarlaLaneKeepingServer:
     def _on_camera_data(self, image):
         array = np.frombuffer(image.raw_data, dtype=np.uint8)
         array = np.reshape(array, (image.height, image.width, 4))
-        array = array[:, :, :3]
-        self.last_image = array.tolist()
+        # 保持为ndarray，直接作为原始字节发送
+        self.last_image = np.ascontiguousarray(array[:, :, :3])
 
     def reset(self):
         if self.vehicle:
@@ -121,7 +123,7 @@ class CarlaLaneKeepingServer:
         return obs
 
     def _get_obs(self):
-        image = self.last_image if self.last_image is not None else [[0]*3]*IMAGE_SIZE[0]*IMAGE_SIZE[1]
+        image = self.last_image if self.last_image is not None else np.zeros((IMAGE_SIZE[0], IMAGE_SIZE[1], 3), dtype=np.uint8)
         velocity = self.vehicle.get_velocity()
         speed = float(np.sqrt(velocity.x**2 + velocity.y**2 + velocity.z**2))
         # 真实 lane_offset：车辆到最近车道中心线的横向距离
@@ -151,20 +153,20 @@ class CarlaLaneKeepingServer:
             print("[Carla0915] Waiting for DreamerV3 client...")
             conn, addr = self.server.accept()
             print(f"[Carla0915] Connected by {addr}")
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             try:
+                # 带长度前缀的二进制帧（见 lane_keeping_protocol.py），一次recv可能只收到消息的一部分
                 while True:
-                    data = conn.recv(40960)
-                    if not data:
+                    payload = recv_frame(conn)
+                    if payload is None:
                         break
-                    msg = json.loads(data.decode())
-                    if msg['cmd'] == 'reset':
-                        obs = self.reset()
-                        conn.sendall(json.dumps({'obs': obs}).encode())
-                    elif msg['cmd'] == 'step':
-                        obs = self.step(msg['action'])
-                        conn.sendall(json.dumps({'obs': obs}).encode())
+                    cmd, action = decode_request(payload)
+                    if cmd == CMD_RESET:
+                        send_observation(conn, self.reset())
+                    elif cmd == CMD_STEP:
+                        send_observation(conn, self.step(action))
                     else:
-                        conn.sendall(json.dumps({'error': 'Unknown command'}).encode())
+                        send_error(conn, f'Unknown command {cmd}')
             except Exception as e:
                 print(f"[Carla0915] Client error: {e}")
             finally:
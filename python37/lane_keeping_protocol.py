@@ -0,0 +1,136 @@
+'''
+Lane Keeping Protocol Module:
+    Binary framing used between python37/carla0915.py (Python 3.7, CARLA 0.9.15) and its Python 3.11 clients.
+    It only depends on the standard library and numpy, so both sides import this same file.
+
+    Every message is a frame: [uint32 payload length (big endian)][payload]
+
+    Request payload:  struct REQUEST  -> version, cmd, steer, acc
+    Response payload: struct RESPONSE -> version, status, height, width, channels, speed, lane_offset, done
+                      followed by the raw uint8 image (height * width * channels bytes, HWC order).
+                      If status is STATUS_ERROR the payload after the header is an utf-8 error message.
+'''
+
+import struct
+import socket
+import numpy as np
+
+PROTOCOL_VERSION = 1
+
+CMD_RESET = 1
+CMD_STEP  = 2
+
+STATUS_OK    = 0
+STATUS_ERROR = 1
+
+LENGTH   = struct.Struct('!I')
+REQUEST  = struct.Struct('!BBff')
+RESPONSE = struct.Struct('!BBHHHff?')
+
+# Upper bound of a single frame, anything bigger is considered a corrupted stream
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+# ====================================== Framing ======================================
+def recv_exact(conn, size):
+    '''
+    Reads exactly size bytes from the socket (a single recv may return less). Returns None if the peer closed the
+    connection before sending anything, and raises ConnectionError if it closed in the middle of a message.
+    '''
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = conn.recv_into(view[received:], size - received)
+        if count == 0:
+            if received == 0:
+                return None
+            raise ConnectionError(f"Connection closed after {received} of {size} bytes")
+        received += count
+    return buffer
+
+def recv_frame(conn):
+    header = recv_exact(conn, LENGTH.size)
+    if header is None:
+        return None
+    (size,) = LENGTH.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {size} bytes exceeds the limit of {MAX_FRAME_SIZE} bytes")
+    payload = recv_exact(conn, size)
+    if payload is None:
+        raise ConnectionError("Connection closed before the frame payload")
+    return payload
+
+def send_frame(conn, *parts):
+    # The length prefix goes together with the (small) first part, the rest (e.g., the image) is sent without copying it
+    size = sum(memoryview(part).nbytes for part in parts)
+    conn.sendall(LENGTH.pack(size) + bytes(parts[0]))
+    for part in parts[1:]:
+        conn.sendall(part)
+
+
+# ====================================== Requests ======================================
+def encode_request(cmd, steer=0.0, acc=0.0):
+    return REQUEST.pack(PROTOCOL_VERSION, cmd, steer, acc)
+
+def decode_request(payload):
+    version, cmd, steer, acc = REQUEST.unpack(bytes(payload[:REQUEST.size]))
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}, expected {PROTOCOL_VERSION}")
+    return cmd, {'steer': steer, 'acc': acc}
+
+
+# ====================================== Responses ======================================
+def send_observation(conn, obs):
+    image = np.ascontiguousarray(obs['image'], dtype=np.uint8)
+    height, width, channels = image.shape
+    header = RESPONSE.pack(PROTOCOL_VERSION, STATUS_OK, height, width, channels,
+                           float(obs['speed']), float(obs['lane_offset']), bool(obs['done']))
+    send_frame(conn, header, image)
+
+def send_error(conn, message):
+    send_frame(conn, RESPONSE.pack(PROTOCOL_VERSION, STATUS_ERROR, 0, 0, 0, 0.0, 0.0, True), str(message).encode())
+
+def decode_observation(payload):
+    '''
+    Rebuilds the observation dictionary. The image is a view over the received buffer (no copy).
+    '''
+    version, status, height, width, channels, speed, lane_offset, done = RESPONSE.unpack_from(payload)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}, expected {PROTOCOL_VERSION}")
+    if status != STATUS_OK:
+        raise RuntimeError(bytes(payload[RESPONSE.size:]).decode(errors='replace'))
+    image = np.frombuffer(payload, dtype=np.uint8, count=height * width * channels, offset=RESPONSE.size)
+    return {
+        'image': image.reshape(height, width, channels),
+        'speed': speed,
+        'lane_offset': lane_offset,
+        'done': done
+    }
+
+
+# ====================================== Client ======================================
+class LaneKeepingClient:
+    '''
+    Client of CarlaLaneKeepingServer. reset() and step() return the observation dictionary
+    {'image': uint8 HxWx3, 'speed': float, 'lane_offset': float, 'done': bool}.
+    '''
+    def __init__(self, host='127.0.0.1', port=50037, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _request(self, cmd, steer=0.0, acc=0.0):
+        send_frame(self.sock, encode_request(cmd, steer, acc))
+        payload = recv_frame(self.sock)
+        if payload is None:
+            raise ConnectionError("Server closed the connection")
+        return decode_observation(payload)
+
+    def reset(self):
+        return self._request(CMD_RESET)
+
+    def step(self, steer, acc):
+        return self._request(CMD_STEP, float(steer), float(acc))
+
+    def close(self):
+        self.sock.close()
@@ -6,7 +6,9 @@ DREAMER_ENV="python311"       # DreamerV3环境（Python 3.11）
 CARLA_PORT=2000               # CARLA服务器端口
 CARLA_SERVER_PORT=5555        # CARLA通信服务端口
 CARLA_TIMEOUT=30              # CARLA启动超时时间（秒）
-ZMQ_TIMEOUT=10                # ZMQ通信超时时间（秒）
+ZMQ_TIMEOUT=10                # 等待CARLA通信服务器就绪的时间（秒）
+ZMQ_STEP_TIMEOUT=60           # 客户端每次step的超时时间（秒）
+ZMQ_RESET_TIMEOUT=600         # 客户端连接、init、spaces和reset的超时时间（秒），包括启动CARLA和加载地图
 ENV_CHECK_RETRIES=5           # 环境检查重试次数
 ENV_CHECK_DELAY=2             # 环境检查延迟（秒）
 
@@ -248,6 +250,9 @@ sleep 5
 conda run -n "$DREAMER_ENV" bash -c "
 cd \"$DREAMER_PATH\"
 export PYTHONPATH=\$PYTHONPATH:\$PWD:\$CARLA_GYM_PATH
+# 远程环境客户端（dreamerv3_env/remote_client.py、async_remote_env.py）的默认超时
+export ZMQ_STEP_TIMEOUT=$ZMQ_STEP_TIMEOUT
+export ZMQ_RESET_TIMEOUT=$ZMQ_RESET_TIMEOUT
 echo \"Python executable: $(which python)\" 
 echo \"Python version: $(python --version)\"
 